@@ -1,16 +1,19 @@
 import os
-import csv
 from datetime import datetime
-import shutil
-from difflib import SequenceMatcher
+import time
 
 import imaging
 import ocr
 import config
+import course_cache
+import course_matcher
+import course_recognizer
+import layout
+import history
+import metrics
 
 # --- パス設定 ---
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
-CROPPED_DIR = os.path.join(SCRIPT_DIR, '..', 'data', 'temp', 'cropped')
 OUTPUT_DIR = os.path.join(SCRIPT_DIR, '..', 'data', 'output')
 DEBUG_DIR = os.path.join(SCRIPT_DIR, '..', 'data', 'debug')
 OUTPUT_CSV_PATH = os.path.join(OUTPUT_DIR, 'race_data.csv')
@@ -23,107 +26,198 @@ MAX_VALID_RATE = 10000
 def find_closest_course_name(ocr_text, course_list):
     """
     OCRで読み取ったテキストと、既知のコース名リストを比較し、
-    最も類似度が高いコース名を返す。
+    最も類似度が高いコース名を返す (照合はcourse_matcherで行う)。
     """
     if not ocr_text or ocr_text == "コース不明":
         return "コース不明"
-    
-    best_match = "コース不明"
-    best_score = 0.6
-    
-    for course in course_list:
-        score = SequenceMatcher(None, ocr_text, course).ratio()
-        if score > best_score:
-            best_score = score
-            best_match = course
-            
-    if best_match != "コース不明":
-        print(f"[analysis] Matched: '{ocr_text}' => '{best_match}' (score: {best_score:.2f})")
-    
+
+    matcher = _get_matcher(course_list)
+    best = matcher.top_k(ocr_text, 1)
+    if not best:
+        return "コース不明"
+
+    best_match, best_score = best[0]
+    print(f"[analysis] Matched: '{ocr_text}' => '{best_match}' (score: {best_score:.2f})")
     return best_match
 
+_matchers = {}
+
+def _get_matcher(course_list):
+    if course_list is config.COURSE_NAMES:
+        return course_matcher.get_course_matcher()
+    key = tuple(course_list)
+    matcher = _matchers.get(key)
+    if matcher is None:
+        matcher = _matchers[key] = course_matcher.CourseMatcher(key)
+    return matcher
+
 def get_last_race_rate(csv_path):
-    """CSVファイルから最後のレースの最終レートを取得する。"""
-    if not os.path.exists(csv_path) or os.path.getsize(csv_path) == 0:
-        return None
-    with open(csv_path, 'r', newline='', encoding='utf-8-sig') as f:
-        reader = list(csv.reader(f))
-        if len(reader) < 2: return None
-        header = reader[0]; last_log = reader[-1]
-        try:
-            rate_idx = header.index('Rate')
-            return int(last_log[rate_idx])
-        except (ValueError, IndexError): return None
+    """レース履歴から最後のレースの最終レートを取得する。"""
+    last_row = history.get_history(csv_path).last()
+    return last_row['Rate'] if last_row else None
 
 def get_last_race_course(csv_path):
-    """CSVファイルから最後のレースのコース名を取得する"""
-    if not os.path.exists(csv_path) or os.path.getsize(csv_path) == 0:
-        return None
-    with open(csv_path, 'r', newline='', encoding='utf-8-sig') as f:
-        reader = list(csv.reader(f))
-        if len(reader) < 2: return None
-        header = reader[0]
-        last_log = reader[-1]
-        try:
-            course_idx = header.index('Course')
-            return last_log[course_idx]
-        except (ValueError, IndexError):
-            return None
+    """レース履歴から最後のレースのコース名を取得する"""
+    last_row = history.get_history(csv_path).last()
+    return last_row['Course'] if last_row else None
+
+def _image_name(image, image_name, default):
+    if image_name: return image_name
+    return os.path.basename(image) if isinstance(image, str) else default
 
-def get_course_and_pre_race_rate(image_path):
+class CourseAnalysis:
     """
-    コース決定画面から、レート、コース名、参加人数を取得する。
-    2連続レースの場合、CSVの最後のコースを始点とする。
+    コース決定画面の解析結果。コース名がGemini APIの応答待ちの間も保持でき、
+    done()で完了を確認し、result()で (レート, コース名, 参加人数) を受け取る。
     """
-    os.makedirs(CROPPED_DIR, exist_ok=True)
-    
-    rate_path, course_path, participant_count, is_single_course = imaging.analyze_course_decision_screen(image_path)
+
+    def __init__(self, pre_race_rate, participant_count, is_single_course, csv_path,
+                 known_course_name=None, course_future=None, course_hash=None, name_area=None):
+        self.pre_race_rate = pre_race_rate
+        self.participant_count = participant_count
+        self.is_single_course = is_single_course
+        self.csv_path = csv_path
+        self.started_at = time.monotonic()
+        self._known_course_name = known_course_name
+        self._course_future = course_future
+        self._course_hash = course_hash
+        self._name_area = name_area
+        self._result = None
+
+    def done(self):
+        return self._course_future is None or self._course_future.done()
+
+    def result(self):
+        if self._result is None:
+            self._result = self._finish()
+        return self._result
+
+    def _finish(self):
+        raw_course_name = "コース不明"
+        if self._known_course_name:
+            raw_course_name = self._known_course_name
+        elif self._course_future:
+            raw_course_name = self._course_future.result()
+
+        corrected_course_name = find_closest_course_name(raw_course_name, config.COURSE_NAMES)
+        # Gemini APIで新たに認識できた場合のみ、キャッシュと参照画像に登録する
+        if corrected_course_name != "コース不明" and self._course_future is not None:
+            course_cache.get_course_cache().put(self._course_hash, self.is_single_course, corrected_course_name)
+            if self.is_single_course:
+                course_recognizer.get_local_recognizer().add_reference(corrected_course_name, self._name_area)
+        
+        final_course_name = "コース不明"
+        if corrected_course_name != "コース不明":
+            if self.is_single_course:
+                final_course_name = corrected_course_name
+            else:
+                start_point = get_last_race_course(self.csv_path)
+                if start_point is None:
+                    start_point = "不明"
+                
+                end_point = corrected_course_name
+                final_course_name = f"{start_point} → {end_point}"
+
+        return self.pre_race_rate, final_course_name, self.participant_count
+
+
+def start_course_analysis(image, csv_path=None, is_debug_mode=False, image_name=None):
+    """
+    コース決定画面の解析を開始し、CourseAnalysisを返す。
+    レートと参加人数はこの場で確定させ、コース名はキャッシュ・参照画像で決まらない場合のみ
+    Gemini APIへの問い合わせをバックグラウンドで開始する。
+    """
+    csv_path = csv_path or OUTPUT_CSV_PATH
+    frame = imaging.load_image(image)
+    if frame is None: return CourseAnalysis(None, 0, False, csv_path)
+    base_filename = os.path.splitext(_image_name(image, image_name, "course_screen.png"))[0]
+    debug_subfolder = os.path.join(DEBUG_DIR, base_filename) if is_debug_mode else None
     
-    pre_race_rate = None
-    if rate_path:
-        pre_race_rate = ocr.analyze_rate_ocr(rate_path, TESSERACT_PATH)
+    rate_roi, course_roi, participant_count, is_single_course = imaging.analyze_course_decision_screen(
+        frame, save_dir=debug_subfolder, base_filename=base_filename, debug_dir=debug_subfolder)
+    if is_debug_mode:
+        imaging.save_images(debug_subfolder, base_filename, {'frame': frame})
     
-    raw_course_name = "コース不明"
-    if course_path:
-        raw_course_name = ocr.analyze_course_ocr(course_path)
-        
-    corrected_course_name = find_closest_course_name(raw_course_name, config.COURSE_NAMES)
+    # レートの読み取りはコース名の特定と並行に行い、コース名が決まった後で結果を待つ
+    rate_future = {}
+    if rate_roi is not None:
+        rate_future = ocr.submit_fields({'prerace_rate': (ocr.analyze_rate_ocr, rate_roi, TESSERACT_PATH, f"{base_filename}_prerace_rate")})
     
-    final_course_name = "コース不明"
-    if corrected_course_name != "コース不明":
-        if is_single_course:
-            final_course_name = corrected_course_name
+    if course_roi is None:
+        pre_race_rate = _collect_pre_race_rate(rate_future, base_filename, csv_path)
+        return CourseAnalysis(pre_race_rate, participant_count, is_single_course, csv_path)
+
+    # 同じ画面を認識済みであれば、Gemini APIを呼ばずにキャッシュの結果を使う
+    name_area = imaging.crop_area(frame, layout.get_layout().single_course_name_area)
+    course_hash = imaging.compute_phash(course_roi)
+    cached_course_name = course_cache.get_course_cache().lookup(course_hash, is_single_course)
+    if cached_course_name:
+        print(f"[analysis] キャッシュからコース名を取得しました: '{cached_course_name}'")
+        known_course_name, course_future = cached_course_name, None
+    else:
+        # 参照画像との照合で十分な相関が得られれば、Gemini APIを使わない
+        local_name, local_score = course_recognizer.get_local_recognizer().recognize(name_area, course_roi, is_single_course)
+        if local_name and local_score >= course_recognizer.MIN_MATCH_SCORE:
+            print(f"[analysis] 参照画像からコース名を認識しました: '{local_name}' (score: {local_score:.2f})")
+            course_cache.get_course_cache().put(course_hash, is_single_course, local_name)
+            known_course_name, course_future = local_name, None
         else:
-            start_point = get_last_race_course(OUTPUT_CSV_PATH)
-            if start_point is None:
-                start_point = "不明"
-            
-            end_point = corrected_course_name
-            final_course_name = f"{start_point} → {end_point}"
+            known_course_name = None
+            course_future = ocr.submit_course_ocr(course_roi, label=f"{base_filename}_course_gemini_input")
 
-    return pre_race_rate, final_course_name, participant_count
+    pre_race_rate = _collect_pre_race_rate(rate_future, base_filename, csv_path)
+    return CourseAnalysis(pre_race_rate, participant_count, is_single_course, csv_path,
+                          known_course_name, course_future, course_hash, name_area)
 
-def process_result_image(image_path, course_name, pre_race_rate, participant_count, is_debug_mode=False):
-    """リザルト画面の画像を解析し、最終的なレース結果をCSVに保存する。"""
-    if not os.path.exists(image_path): return None
-    
-    os.makedirs(CROPPED_DIR, exist_ok=True); os.makedirs(OUTPUT_DIR, exist_ok=True); os.makedirs(DEBUG_DIR, exist_ok=True)
+def _collect_pre_race_rate(rate_future, base_filename, csv_path):
+    """
+    レース前のレートの読み取り結果を受け取る。前回のレースの最終レートと一致すれば
+    読み取りは正しいとみなし、数字のテンプレートの学習に使う。
+    """
+    pre_race_rate = ocr.collect_fields(rate_future).get('prerace_rate')
+    if pre_race_rate is not None and pre_race_rate == get_last_race_rate(csv_path):
+        ocr.confirm_digits({f"{base_filename}_prerace_rate": str(pre_race_rate)})
+    return pre_race_rate
 
-    detected_pos = imaging.crop_image_for_result(image_path)
-    base_filename = os.path.splitext(os.path.basename(image_path))[0]
+def get_course_and_pre_race_rate(image, csv_path=None, is_debug_mode=False, image_name=None):
+    """
+    コース決定画面から、レート、コース名、参加人数を取得する。
+    2連続レースの場合、CSVの最後のコースを始点とする。
+    imageにはファイルパスか、デコード済みのフレーム(ndarray)を渡す。
+    """
+    return start_course_analysis(image, csv_path, is_debug_mode, image_name).result()
+
+def process_result_image(image, course_name, pre_race_rate, participant_count, is_debug_mode=False, csv_path=None, image_name=None):
+    """
+    リザルト画面の画像を解析し、最終的なレース結果をCSVに保存する。
+    imageにはファイルパスか、デコード済みのフレーム(ndarray)を渡す。
+    CSVのFilename列にはimage_name (省略時はファイル名) を記録する。
+    """
+    frame = imaging.load_image(image)
+    if frame is None: return None
+    csv_path = csv_path or OUTPUT_CSV_PATH
+    image_name = _image_name(image, image_name, "result_screen.png")
+
+    base_filename = os.path.splitext(image_name)[0]
+    detected_pos, crops = imaging.crop_image_for_result(frame)
     final_result = None
 
     if detected_pos:
-        rank_path = os.path.join(CROPPED_DIR, f"{base_filename}_rank.png")
-        rate_path = os.path.join(CROPPED_DIR, f"{base_filename}_rate.png")
-        race_points_path = os.path.join(CROPPED_DIR, f"{base_filename}_rate_change.png")
-        
-        final_rank = detected_pos
-        if detected_pos >= 13: 
-             final_rank = ocr.analyze_rank_ocr(rank_path, TESSERACT_PATH)
-        
-        final_rate = ocr.analyze_rate_ocr(rate_path, TESSERACT_PATH)
-        race_points = ocr.analyze_rate_change_ocr(race_points_path, TESSERACT_PATH)
+        # 各項目は独立しているため並行に読み取り、全項目が揃ってから保存する
+        tasks = {
+            'rate': (ocr.analyze_rate_ocr, crops.get('rate'), TESSERACT_PATH, f"{base_filename}_rate"),
+            'rate_change': (ocr.analyze_rate_change_ocr, crops.get('rate_change'), TESSERACT_PATH, f"{base_filename}_rate_change"),
+        }
+        if detected_pos >= 13:
+            tasks['rank'] = (ocr.analyze_rank_ocr, crops.get('rank'), TESSERACT_PATH, f"{base_filename}_rank")
+        with metrics.stage('result_ocr'):
+            fields = ocr.read_fields(tasks)
+        for name, value in fields.items():
+            if value is None: metrics.inc('ocr_failures_total', field=name)
+
+        final_rank = fields['rank'] if detected_pos >= 13 else detected_pos
+        final_rate = fields['rate']
+        race_points = fields['rate_change']
         
         if final_rate is not None and final_rate > MAX_VALID_RATE:
             print(f"[analysis] WARNING: 異常なレート値({final_rate})を検出したため、この結果を破棄します。")
@@ -134,22 +228,29 @@ def process_result_image(image_path, course_name, pre_race_rate, participant_cou
             if pre_race_rate is not None and pre_race_rate > 0:
                 net_rate_change = final_rate - pre_race_rate
             else:
-                last_final_rate = get_last_race_rate(OUTPUT_CSV_PATH)
+                last_final_rate = get_last_race_rate(csv_path)
                 if last_final_rate is not None:
                     net_rate_change = final_rate - last_final_rate
 
+        # レース前のレートとレートの増減が最終レートと整合すれば、読み取りは正しいとみなして数字のテンプレートを学習する
+        # 順位は、同じ画面の読み取りが整合し、かつ13行目 (13位以下) として取りうる値であれば正しいとみなす
+        if pre_race_rate and final_rate is not None and race_points is not None and pre_race_rate + race_points == final_rate:
+            confirmed = {f"{base_filename}_rate": str(final_rate), f"{base_filename}_rate_change": f"{race_points:+d}"}
+            rank = fields.get('rank')
+            if detected_pos >= 13 and rank is not None and 13 <= rank <= (participant_count or ocr.RANK_RANGE[1]):
+                confirmed[f"{base_filename}_rank"] = str(rank)
+            ocr.confirm_digits(confirmed)
+
         if final_rank and final_rate is not None:
             timestamp_str = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            is_first_record = not os.path.exists(OUTPUT_CSV_PATH) or os.path.getsize(OUTPUT_CSV_PATH) == 0
-            if is_first_record:
+            store = history.get_history(csv_path)
+            if store.last() is None:
                 net_rate_change = 0
 
-            with open(OUTPUT_CSV_PATH, 'a', newline='', encoding='utf-8-sig') as f:
-                writer = csv.writer(f)
-                if is_first_record:
-                    writer.writerow(['Filename', 'Timestamp', 'Course', 'Rank', 'Participants', 'Rate', 'Rate Change'])
-                row_data = [os.path.basename(image_path), timestamp_str, course_name, final_rank, participant_count, final_rate, net_rate_change]
-                writer.writerow(row_data)
+            row_data = [image_name, timestamp_str, course_name, final_rank, participant_count, final_rate, net_rate_change]
+            with metrics.stage('history_append'):
+                store.append(row_data)
+            metrics.inc('races_recorded_total')
             
             print(f"[analysis] SUCCESS: 結果をCSVに保存しました -> Course:{course_name}, Rank:{final_rank}/{participant_count}, Rate:{final_rate}, Change:{net_rate_change:+}")
             final_result = row_data
@@ -158,18 +259,7 @@ def process_result_image(image_path, course_name, pre_race_rate, participant_cou
 
     if is_debug_mode:
         debug_subfolder = os.path.join(DEBUG_DIR, base_filename)
-        os.makedirs(debug_subfolder, exist_ok=True)
         print(f"[analysis] DEBUG: デバッグファイルを '{debug_subfolder}' に保存します。")
-        try:
-            shutil.move(image_path, os.path.join(debug_subfolder, os.path.basename(image_path)))
-        except (FileNotFoundError, PermissionError) as e:
-            print(f"[analysis] DEBUG WARNING: 元ファイルの移動に失敗しました: {e}")
-        for region_name in ['rank', 'rate', 'rate_change', 'prerace_rate', 'course_name', 'course_gemini_input']:
-            cropped_path = os.path.join(CROPPED_DIR, f"{base_filename}_{region_name}.png")
-            if os.path.exists(cropped_path):
-                try:
-                    shutil.move(cropped_path, os.path.join(debug_subfolder, f"{base_filename}_{region_name}.png"))
-                except (FileNotFoundError, PermissionError) as e:
-                    print(f"[analysis] DEBUG WARNING: 切り抜きファイルの移動に失敗しました: {e}")
-
-    return final_result
\ No newline at end of file
+        imaging.save_images(debug_subfolder, base_filename, {'frame': frame, **crops})
+
+    return final_result
@@ -2,39 +2,40 @@ import cv2
 import numpy as np
 import os
 from datetime import datetime
-import time
 import tkinter as tk
 from tkinter import ttk
 from tkinter import messagebox
+from tkinter import simpledialog
 import threading
 import shutil
-from pygrabber.dshow_graph import FilterGraph
-import pygetwindow as gw
-import pytesseract
-import win32gui
-import win32ui
-import win32con
-from ctypes import windll
-import csv
 import configparser
 
 import analysis
+import artifacts
 import config 
+import frame_store
+import history
+import metrics
+import monitor
+import profiler
+import session
 
 # --- パス設定 ---
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
-OUTPUT_DIR = os.path.join(SCRIPT_DIR, '..', 'data', 'temp')
+OUTPUT_DIR = frame_store.TEMP_DIR
 DEBUG_DIR = os.path.join(SCRIPT_DIR, '..', 'data', 'debug')
 CONFIG_FILE = os.path.join(SCRIPT_DIR, 'config.ini')
 
 # --- 設定 ---
-MONITORING_INTERVAL = 2 
+MONITORING_INTERVAL = monitor.MONITORING_INTERVAL
 TESSERACT_PATH = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
 
-monitoring_active = False 
-request_debug_capture = False
 
+# pygrabber・pygetwindow・pywin32 はWindows専用のため、キャプチャ・一覧の取得で初めて読み込む
 def capture_win_bg(hwnd):
+    import win32gui
+    import win32ui
+    from ctypes import windll
     left, top, right, bot = win32gui.GetClientRect(hwnd)
     w, h = right - left, bot - top
     hwndDC = win32gui.GetWindowDC(hwnd)
@@ -49,113 +50,35 @@ def capture_win_bg(hwnd):
     win32gui.DeleteObject(saveBitMap.GetHandle()); saveDC.DeleteDC(); mfcDC.DeleteDC(); win32gui.ReleaseDC(hwnd, hwndDC)
     return cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
 
-def monitor_loop(target_name, mode, app_instance):
-    global monitoring_active, request_debug_capture
-    monitoring_active = True 
-    if not os.path.exists(TESSERACT_PATH):
-        app_instance.update_status("エラー: Tesseract-OCRが見つかりません。"); app_instance.reset_gui_state(); return
-    pytesseract.pytesseract.tesseract_cmd = TESSERACT_PATH
-
-    cap = None; target_hwnd = None
-    if mode == "device":
-        cap = cv2.VideoCapture(target_name, cv2.CAP_DSHOW)
-        if not cap.isOpened(): app_instance.update_status(f"エラー: デバイス {target_name} を開けません"); app_instance.reset_gui_state(); return
-    elif mode == "window":
-        try: target_hwnd = gw.getWindowsWithTitle(target_name)[0]._hWnd
-        except IndexError: app_instance.update_status("エラー: ウィンドウが見つかりません。"); app_instance.reset_gui_state(); return
-    
-    app_instance.update_status("監視中 (コース決定画面を待っています)...")
-    
-    while monitoring_active:
-        raw_frame = None 
-        if mode == "device":
-            ret, raw_frame = cap.read()
-            if not ret: time.sleep(0.1); continue
-        elif mode == "window":
-            try:
-                if not win32gui.IsWindow(target_hwnd): app_instance.update_status("エラー: ウィンドウが閉じられました。"); break
-                raw_frame = capture_win_bg(target_hwnd)
-            except Exception: app_instance.update_status("エラー: ウィンドウのキャプチャに失敗しました。"); break
-        if raw_frame is None: time.sleep(MONITORING_INTERVAL); continue
-        
-        fhd_frame = cv2.resize(raw_frame, (1920, 1080), interpolation=cv2.INTER_AREA)
-
-        if request_debug_capture:
-            state = "course_decision" if app_instance.current_course_name is None else "result"
-            debug_img = analysis.imaging.draw_debug_overlay(fhd_frame, state, app_instance.current_course_name, app_instance.pre_race_rate)
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            os.makedirs(DEBUG_DIR, exist_ok=True)
-            save_path = os.path.join(DEBUG_DIR, f"debug_capture_{timestamp}.png")
-            if cv2.imwrite(save_path, debug_img):
-                app_instance.update_status(f"デバッグ画像を保存しました: {os.path.basename(save_path)}")
-            else:
-                app_instance.update_status(f"エラー: デバッグ画像の保存に失敗しました。")
-            request_debug_capture = False
-
-        def is_rate_detected_in_list(coord_list, frame):
-            detected_count = 0
-            for coords in coord_list:
-                if isinstance(coords, tuple):
-                    coords = {'x1': coords[0], 'y1': coords[1], 'x2': coords[2], 'y2': coords[3]}
-
-                x1, y1, x2, y2 = coords['x1'], coords['y1'], coords['x2'], coords['y2']
-                if y2 > frame.shape[0] or x2 > frame.shape[1]: continue
-                roi = frame[y1:y2, x1:x2]
-                gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
-                text = pytesseract.image_to_string(gray, config=r'--psm 7 -c tessedit_char_whitelist=0123456789').strip()
-                if text.isdigit() and len(text) >= 3: 
-                    detected_count += 1
-            return detected_count
-
-        # --- 監視ロジック ---
-        if app_instance.current_course_name is None:
-            if is_rate_detected_in_list(config.ALL_PLAYER_SLOTS, fhd_frame) >= 1:
-                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                output_path = os.path.join(OUTPUT_DIR, f"course_screen_{timestamp}.png")
-                cv2.imwrite(output_path, fhd_frame)
-                time.sleep(0.1) 
-                
-                app_instance.update_status("コース決定画面を検出。解析中...")
-                rate, course, p_count = analysis.get_course_and_pre_race_rate(output_path)
-                
-                if rate is not None and course != "コース不明":
-                    app_instance.pre_race_rate = rate
-                    app_instance.current_course_name = course
-                    app_instance.participant_count = p_count
-                    app_instance.update_status(f"コース:「{course}」({p_count}人) / あなたのレート: {rate} | リザルト画面を待機中...")
-                else:
-                    app_instance.update_status("コース解析に失敗。再試行します...")
-                
-                time.sleep(10); continue
-        else: # リザルト画面待機中
-            rate_count = is_rate_detected_in_list(config.RESULT_COORDS.values(), fhd_frame)
-            highlight_found = analysis.imaging.check_for_highlight(fhd_frame)
-
-            if rate_count >= 2 and highlight_found:
-                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                output_path = os.path.join(OUTPUT_DIR, f"result_screen_{timestamp}.png")
-                cv2.imwrite(output_path, fhd_frame)
-                time.sleep(0.1)
-                
-                app_instance.update_status(f"リザルト画面を検出。解析中...")
-                try:
-                    is_debug = app_instance.debug_mode_var.get()
-                    new_result = analysis.process_result_image(output_path, app_instance.current_course_name, app_instance.pre_race_rate, app_instance.participant_count, is_debug)
-                    if new_result: app_instance.update_log_display([new_result])
-                    
-                    app_instance.current_course_name = None; app_instance.pre_race_rate = None; app_instance.participant_count = 0
-                    
-                    app_instance.update_status("監視中 (コース決定画面を待っています)...")
-
-                except Exception as e:
-                    app_instance.update_status(f"解析エラー: {e}")
-                    app_instance.current_course_name = None; app_instance.pre_race_rate = None; app_instance.participant_count = 0
-                    import traceback; traceback.print_exc(); time.sleep(5)
-        
-        time.sleep(MONITORING_INTERVAL)
-    if cap: cap.release()
-    if not app_instance.root.winfo_exists(): return
-    app_instance.reset_gui_state()
+class DeviceSource:
+    """DirectShowの映像デバイスからフレームを取得する。"""
+
+    def __init__(self, device_index):
+        self.cap = cv2.VideoCapture(device_index, cv2.CAP_DSHOW)
+        if not self.cap.isOpened():
+            raise IOError(f"デバイス {device_index} を開けません")
+
+    def read_at(self, seconds):
+        ret, frame = self.cap.read()
+        return frame if ret else None
+
+    def release(self):
+        self.cap.release()
+
+
+class WindowSource:
+    """ウィンドウの内容を、背面にあってもキャプチャする。"""
+
+    def __init__(self, window_title):
+        import pygetwindow as gw
+        try: self.hwnd = gw.getWindowsWithTitle(window_title)[0]._hWnd
+        except IndexError: raise IOError("ウィンドウが見つかりません。")
+
+    def read_at(self, seconds):
+        import win32gui
+        if not win32gui.IsWindow(self.hwnd): raise EOFError("ウィンドウが閉じられました。")
+        try: return capture_win_bg(self.hwnd)
+        except Exception: raise IOError("ウィンドウのキャプチャに失敗しました。")
 
 def load_setting(key):
     config_parser = configparser.ConfigParser(); config_parser.read(CONFIG_FILE)
@@ -454,12 +377,13 @@ class App:
         self.source_type_var = tk.StringVar()
         self.target_var = tk.StringVar()
         self.debug_mode_var = tk.BooleanVar(value=False)
+        self.debug_mode_var.trace_add('write', self.on_debug_mode_changed)
         self.targets = {}
         self.LOG_DISPLAY_LIMIT = 30
         
-        self.current_course_name = None
-        self.pre_race_rate = None
-        self.participant_count = 0
+        self.scheduler = session.get_scheduler()
+        self.session = None  # 監視中のsession.MonitorSession
+        self.history = history.get_history(analysis.OUTPUT_CSV_PATH)
 
         menubar = tk.Menu(root); root.config(menu=menubar)
         settings_menu = tk.Menu(menubar, tearoff=0)
@@ -469,6 +393,7 @@ class App:
         menubar.add_cascade(label="ツール", menu=tools_menu)
         tools_menu.add_command(label="レース記録を手動追加", command=self.open_add_race_window)
         tools_menu.add_command(label="デバッグキャプチャ", command=self.on_debug_capture)
+        tools_menu.add_command(label="プロファイルを記録", command=self.on_profile)
         tools_menu.add_command(label="監視状態を強制切替", command=self.force_switch_state)
         tools_menu.add_separator()
         tools_menu.add_command(label="一時ファイルを消去", command=self.clear_temp_files)
@@ -505,6 +430,7 @@ class App:
         self.control_panel = ControlPanel(self.root, self); self.control_panel.withdraw()
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
         os.makedirs(OUTPUT_DIR, exist_ok=True); os.makedirs(DEBUG_DIR, exist_ok=True)
+        frame_store.get_store()  # 索引を読み込み、保存期間を過ぎたスクリーンショットを削除する
         self.load_initial_logs_and_stats()
         self.update_dropdown()
         self.root.after(100, self.initialize_source)
@@ -523,47 +449,14 @@ class App:
             messagebox.showerror("エラー", "元のデータが見つかりませんでした。")
             
     def find_row_in_csv(self, timestamp):
-        try:
-            with open(analysis.OUTPUT_CSV_PATH, 'r', newline='', encoding='utf-8-sig') as f:
-                reader = csv.reader(f)
-                header = next(reader)
-                ts_idx = header.index('Timestamp')
-                for row in reader:
-                    if row[ts_idx] == timestamp:
-                        return dict(zip(header, row))
-        except (FileNotFoundError, ValueError, IndexError) as e:
-            print(f"CSV検索エラー: {e}")
-            return None
-        return None
+        return self.history.find_by_timestamp(timestamp)
 
     def save_edited_race(self, new_data):
         try:
-            with open(analysis.OUTPUT_CSV_PATH, 'r', newline='', encoding='utf-8-sig') as f:
-                reader = csv.reader(f)
-                header = next(reader)
-                all_rows = list(reader)
-
-            filename_idx = header.index('Filename')
-            updated = False
-            for i, row in enumerate(all_rows):
-                if row[filename_idx] == new_data['Filename']:
-                    updated_row = [new_data.get(h, '') for h in header]
-                    
-                    prev_rate = int(all_rows[i-1][header.index('Rate')]) if i > 0 else 0
-                    if prev_rate > 0:
-                        new_rate = int(new_data['Rate'])
-                        updated_row[header.index('Rate Change')] = new_rate - prev_rate
-
-                    all_rows[i] = updated_row
-                    updated = True
-                    break
-            
-            if not updated: raise ValueError("更新対象の行が見つかりません。")
-
-            with open(analysis.OUTPUT_CSV_PATH, 'w', newline='', encoding='utf-8-sig') as f:
-                writer = csv.writer(f)
-                writer.writerow(header)
-                writer.writerows(all_rows)
+            if self.history.edit_race(new_data['Filename'], new_data) is None:
+                raise ValueError("更新対象の行が見つかりません。")
+            # 編集はDBのトランザクションで確定済み。CSVはGUIのスレッドを待たせないよう、少し後に裏で書き出す
+            self.history.schedule_flush_csv()
 
             self.load_initial_logs_and_stats()
             self.update_status("レース記録を更新しました。")
@@ -576,7 +469,6 @@ class App:
 
     def add_new_race(self, new_data):
         try:
-            header = ['Filename', 'Timestamp', 'Course', 'Rank', 'Participants', 'Rate', 'Rate Change']
             last_rate = analysis.get_last_race_rate(analysis.OUTPUT_CSV_PATH)
             
             final_rate = new_data['Rate']
@@ -595,12 +487,7 @@ class App:
                 rate_change
             ]
             
-            is_new_file = not os.path.exists(analysis.OUTPUT_CSV_PATH) or os.path.getsize(analysis.OUTPUT_CSV_PATH) == 0
-            with open(analysis.OUTPUT_CSV_PATH, 'a', newline='', encoding='utf-8-sig') as f:
-                writer = csv.writer(f)
-                if is_new_file:
-                    writer.writerow(header)
-                writer.writerow(new_row)
+            self.history.append(new_row)
 
             self.load_initial_logs_and_stats()
             self.update_status("レース記録を手動で追加しました。")
@@ -608,30 +495,50 @@ class App:
         except Exception as e:
             messagebox.showerror("エラー", f"データの追加に失敗しました: {e}")
 
+    @property
+    def monitoring_active(self):
+        return self.session is not None and self.session.active
+
     def force_switch_state(self):
-        if not monitoring_active:
+        if not self.monitoring_active:
             messagebox.showwarning("情報", "監視中にのみ実行できます。")
             return
         
-        if self.current_course_name is None:
-            self.current_course_name = "手動切替"
-            self.pre_race_rate = 0
-            self.participant_count = 0
+        state = self.session.state
+        if state.waiting_for_course:
+            state.current_course_name = "手動切替"
+            state.pre_race_rate = 0
+            state.participant_count = 0
             self.update_status("状態を強制的に「リザルト待機」に変更しました。")
         else:
-            self.current_course_name = None
-            self.pre_race_rate = None
-            self.participant_count = 0
+            state.reset()
             self.update_status("状態を強制的に「コース決定待機」に変更しました。")
 
     def on_debug_capture(self):
-        global request_debug_capture
-        if monitoring_active:
-            request_debug_capture = True
+        if self.monitoring_active:
+            self.session.request_debug_capture()
             self.update_status("デバッグキャプチャをリクエストしました。")
         else:
             messagebox.showwarning("情報", "デバッグキャプチャは監視中にのみ実行できます。")
 
+    def on_profile(self):
+        if not self.monitoring_active:
+            messagebox.showwarning("情報", "プロファイルは監視中にのみ実行できます。")
+            return
+        seconds = simpledialog.askinteger("プロファイル", "記録する秒数を入力してください:", parent=self.root,
+                                          initialvalue=profiler.DEFAULT_DURATION, minvalue=1, maxvalue=600)
+        if not seconds: return
+        if profiler.profile_for(seconds, on_finished=self.on_profile_finished) is None:
+            self.update_status("プロファイルは既に記録中です。")
+            return
+        self.update_status(f"{seconds}秒間のプロファイルを記録しています...")
+
+    def on_profile_finished(self, result):
+        if result.paths:
+            self.update_status(f"プロファイルを保存しました: {os.path.basename(result.paths[0])}")
+        else:
+            self.update_status("エラー: プロファイルの保存に失敗しました。")
+
     def initialize_source(self):
         last_name = load_setting('last_source_name'); last_type = load_setting('last_source_type')
         if not last_name or not last_type:
@@ -655,8 +562,12 @@ class App:
     def update_dropdown(self):
         menu = self.dropdown["menu"]; menu.delete(0, "end")
         source_type = self.source_type_var.get()
-        if source_type == "device": self.targets = {name: i for i, name in enumerate(FilterGraph().get_input_devices())}
-        else: self.targets = {win.title: win.title for win in gw.getWindowsWithTitle('') if win.title and win.visible and win.title != self.root.title() and win.title != self.control_panel.title()}
+        if source_type == "device":
+            from pygrabber.dshow_graph import FilterGraph
+            self.targets = {name: i for i, name in enumerate(FilterGraph().get_input_devices())}
+        else:
+            import pygetwindow as gw
+            self.targets = {win.title: win.title for win in gw.getWindowsWithTitle('') if win.title and win.visible and win.title != self.root.title() and win.title != self.control_panel.title()}
         if not self.targets: self.targets = {"利用可能なターゲットがありません": None}
         for name in self.targets.keys(): menu.add_command(label=name, command=lambda value=name: self.target_var.set(value))
         current_selection = self.target_var.get()
@@ -670,12 +581,50 @@ class App:
         self.control_panel.withdraw()
         self.root.focus_set()
         self.root.lift()
-        threading.Thread(target=monitor_loop, args=(target_value, source_type, self), daemon=True).start()
+        threading.Thread(target=self.start_session, args=(target_value, source_type), daemon=True).start()
+
+    def start_session(self, target_value, source_type):
+        if not os.path.exists(TESSERACT_PATH):
+            self.update_status("エラー: Tesseract-OCRが見つかりません。"); self.reset_gui_state(); return
+        analysis.ocr.get_engine(TESSERACT_PATH)
+        try:
+            source = DeviceSource(target_value) if source_type == "device" else WindowSource(target_value)
+        except IOError as e:
+            self.update_status(f"エラー: {e}"); self.reset_gui_state(); return
+
+        self.session = session.MonitorSession(
+            "", source,
+            on_status=self.update_status,
+            on_result=lambda row: self.update_log_display([row]),
+            on_finished=self.on_session_finished,
+            is_debug_mode=self.debug_mode_var.get(),
+            interval=MONITORING_INTERVAL,
+        )
+        self.update_status("監視中 (コース決定画面を待っています)...")
+        self.scheduler.add(self.session)
+
+    def on_session_finished(self, finished_session):
+        if finished_session is not self.session: return
+        self.session = None
+        if self.root.winfo_exists(): self.root.after(0, self.reset_gui_state)
+
+    def on_debug_mode_changed(self, *args):
+        if self.session is not None: self.session.is_debug_mode = self.debug_mode_var.get()
+
+    def stop_session(self):
+        current, self.session = self.session, None
+        if current is not None: self.scheduler.remove(current)
 
     def on_stop_click(self):
-        global monitoring_active; monitoring_active = False; self.reset_gui_state()
+        self.stop_session(); self.reset_gui_state()
     def on_closing(self):
-        global monitoring_active; monitoring_active = False; self.root.destroy()
+        self.stop_session()
+        try: self.history.flush_csv()
+        except Exception as e: print(f"[app] WARNING: CSVの書き出しに失敗しました: {e}")
+        artifacts.flush()
+        analysis.ocr.close_engines()
+        metrics.disable()
+        self.root.destroy()
 
     def reset_gui_state(self):
         if not self.root.winfo_exists(): return
@@ -691,20 +640,13 @@ class App:
     def load_initial_logs_and_stats(self):
         self.log_tree.delete(*self.log_tree.get_children())
         self.update_stats()
-        if not os.path.exists(analysis.OUTPUT_CSV_PATH): return
-        with open(analysis.OUTPUT_CSV_PATH, 'r', newline='', encoding='utf-8-sig') as f:
-            reader=list(csv.reader(f))
-            if len(reader) < 2: return
-            header=reader[0]; all_logs=reader[1:]; all_logs.reverse()
-            recent_logs=all_logs[:self.LOG_DISPLAY_LIMIT]
-            try:
-                ts_idx, course_idx, rank_idx, p_idx, rate_idx, change_idx = header.index('Timestamp'), header.index('Course'), header.index('Rank'), header.index('Participants'), header.index('Rate'), header.index('Rate Change')
-                for row in recent_logs:
-                    rank_str = f"{row[rank_idx]}/{row[p_idx]}"
-                    rate_change = int(row[change_idx])
-                    formatted_change = f"+{rate_change}" if rate_change >= 0 else str(rate_change)
-                    self.log_tree.insert('', 'end', values=(row[ts_idx], row[course_idx], rank_str, row[rate_idx], formatted_change))
-            except (ValueError, IndexError): print("CSVヘッダーの形式が正しくないか、データが不足しています。")
+        try:
+            for row in self.history.recent(self.LOG_DISPLAY_LIMIT):
+                rank_str = f"{row['Rank']}/{row['Participants']}"
+                rate_change = int(row['Rate Change'])
+                formatted_change = f"+{rate_change}" if rate_change >= 0 else str(rate_change)
+                self.log_tree.insert('', 'end', values=(row['Timestamp'], row['Course'], rank_str, row['Rate'], formatted_change))
+        except (TypeError, ValueError): print("レース履歴のデータ形式が正しくないか、データが不足しています。")
 
     def update_log_display(self, new_results):
         if self.root.winfo_exists(): self.root.after(0, self._update_log_display, new_results)
@@ -721,23 +663,17 @@ class App:
         self.update_stats()
 
     def clear_logs(self):
-        if not os.path.exists(analysis.OUTPUT_CSV_PATH): messagebox.showinfo("情報", "消去するログがありません。"); return
+        if self.history.last() is None: messagebox.showinfo("情報", "消去するログがありません。"); return
         if messagebox.askyesno("確認", "本当にすべてのレースログを消去しますか？\nこの操作は元に戻せません。"):
             try:
-                os.remove(analysis.OUTPUT_CSV_PATH); self.load_initial_logs_and_stats()
+                self.history.clear(); self.load_initial_logs_and_stats()
                 messagebox.showinfo("成功", "すべてのログを消去しました。"); self.update_status("全ログを消去しました。")
             except Exception as e: messagebox.showerror("エラー", f"ログの消去に失敗しました: {e}")
 
     def clear_temp_files(self):
         if messagebox.askyesno("確認", "一時ファイル（スクリーンショット、切り抜き画像）をすべて消去しますか？"):
             try:
-                count = 0
-                temp_cropped_dir = os.path.join(OUTPUT_DIR, 'cropped')
-                for folder in [OUTPUT_DIR, temp_cropped_dir]:
-                    if not os.path.exists(folder): continue
-                    for filename in os.listdir(folder):
-                        file_path = os.path.join(folder, filename)
-                        if os.path.isfile(file_path): os.remove(file_path); count += 1
+                count = frame_store.get_store().clear()
                 messagebox.showinfo("成功", f"{count} 個の一時ファイルを消去しました。")
             except Exception as e: messagebox.showerror("エラー", f"一時ファイルの消去に失敗しました: {e}")
 
@@ -750,36 +686,19 @@ class App:
             except Exception as e: messagebox.showerror("エラー", f"デバッグファイルの消去に失敗しました: {e}")
 
     def update_stats(self):
-        if not os.path.exists(analysis.OUTPUT_CSV_PATH):
-            self.total_races_var.set("合計レース数: 0"); self.avg_rate_var.set("平均レート(100戦): -")
-            self.max_rate_var.set("最高レート: -"); self.min_rate_var.set("最低レート: -"); return
-        with open(analysis.OUTPUT_CSV_PATH, 'r', newline='', encoding='utf-8-sig') as f:
-            reader=list(csv.reader(f)); header=reader[0]; all_logs=reader[1:]
-            if not all_logs: self.total_races_var.set("合計レース数: 0"); return
-            try:
-                rate_idx = header.index('Rate')
-                all_rates = [int(row[rate_idx]) for row in all_logs]
-                recent_100_rates = all_rates[-100:]
-                self.total_races_var.set(f"合計レース数: {len(all_rates)}")
-                self.avg_rate_var.set(f"平均レート(100戦): {sum(recent_100_rates)/len(recent_100_rates):.0f}")
-                self.max_rate_var.set(f"最高レート: {max(all_rates)}")
-                self.min_rate_var.set(f"最低レート: {min(all_rates)}")
-            except (ValueError, IndexError):
-                print("CSVヘッダーまたはデータ形式が不正です。統計を更新できません。")
+        total, avg_rate, max_rate, min_rate = self.history.summary()
+        self.total_races_var.set(f"合計レース数: {total}")
+        self.avg_rate_var.set(f"平均レート(100戦): {avg_rate:.0f}" if avg_rate is not None else "平均レート(100戦): -")
+        self.max_rate_var.set(f"最高レート: {max_rate}" if max_rate is not None else "最高レート: -")
+        self.min_rate_var.set(f"最低レート: {min_rate}" if min_rate is not None else "最低レート: -")
 
     def get_previous_course_name(self):
         # この関数は現在直接使用されませんが、デバッグ等のために残しておきます。
-        if not os.path.exists(analysis.OUTPUT_CSV_PATH): return None
-        with open(analysis.OUTPUT_CSV_PATH, 'r', newline='', encoding='utf-8-sig') as f:
-            reader=list(csv.reader(f))
-            if len(reader) < 2: return None
-            header=reader[0]; last_log=reader[-1]
-            try:
-                course_idx = header.index('Course')
-                return last_log[course_idx]
-            except (ValueError, IndexError): return None
+        return analysis.get_last_race_course(analysis.OUTPUT_CSV_PATH)
 
 if __name__ == '__main__':
+    metrics.enable_from_env()
+    analysis.ocr.init_api_key()
     root = tk.Tk()
     app = App(root)
     root.mainloop()
\ No newline at end of file
@@ -0,0 +1,188 @@
+"""
+デバッグ画像や検出した画面など、解析には使わない画像 (成果物) のファイルへの書き込みを、
+キャプチャ・解析のスレッドから切り離して専用のスレッドで行う。
+書き込み待ちのキューには上限があり、ディスクが遅く溜まりすぎた場合は drop_policy に従って
+画像を捨てる (監視処理を待たせない)。PNGは圧縮率よりも速度を優先した設定で書き出す。
+
+画像は書き込みが終わるまで参照を保持するだけで複製しないため、渡した配列 (MappedFrameの場合は元のフレーム) は変更しないこと。
+"""
+import os
+import queue
+import threading
+import time
+import weakref
+
+import cv2
+import numpy as np
+
+import geometry
+import metrics
+
+# --- 設定 ---
+QUEUE_SIZE = 64              # 書き込み待ちにできる画像の数
+# PNGの圧縮レベル (0〜9)。NoneならOpenCVの既定 (速度優先の設定) で書き出す。
+# OpenCV 5では、レベルを明示的に指定するより既定の設定のほうが3倍ほど速い (1920x1080で約20ms)
+PNG_COMPRESSION = None
+FLUSH_TIMEOUT = 10.0         # 終了時に書き込み待ちの画像を待つ秒数
+
+DROP_NEWEST = "drop_newest"  # キューが一杯なら、新しく渡された画像を捨てる
+DROP_OLDEST = "drop_oldest"  # キューが一杯なら、最も古い書き込み待ちの画像を捨てて、新しい画像を入れる
+BLOCK = "block"              # キューが一杯なら、空くまで待つ (監視処理も待たされる)
+DROP_POLICIES = (DROP_NEWEST, DROP_OLDEST, BLOCK)
+DEFAULT_DROP_POLICY = DROP_OLDEST
+
+
+def encode_params(path, compression=PNG_COMPRESSION):
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.png' and compression is not None: return ext, [cv2.IMWRITE_PNG_COMPRESSION, compression]
+    return ext, []
+
+
+def read_image(path, flags=cv2.IMREAD_COLOR):
+    """
+    write_imageで書き出した画像を読み込む。cv2.imreadはWindowsで日本語を含むパスを扱えないため、
+    バイト列として読んでから復号する。読み込めない場合はNone。
+    """
+    try:
+        data = np.fromfile(path, dtype=np.uint8)
+    except OSError:
+        return None
+    return cv2.imdecode(data, flags) if data.size else None
+
+
+def write_image(path, image, compression=PNG_COMPRESSION):
+    """
+    画像をpathに書き出す (フォルダは自動で作成する)。日本語を含むパスにも書き込めるよう、エンコードしてから書き込む。
+    拡張子が .npy の場合はエンコードせず、配列をそのまま書き出す。
+    """
+    ext, params = encode_params(path, compression)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    if ext == '.npy':
+        with open(path, 'wb') as f:
+            np.save(f, np.ascontiguousarray(image))
+        return True
+    ok, encoded = cv2.imencode(ext, image, params)
+    if not ok: return False
+    encoded.tofile(path)
+    return True
+
+
+class ArtifactWriter:
+    """
+    画像の書き込みを順に処理するスレッドと、上限付きの書き込み待ちキュー。
+    nameは書き込みスレッドの名前と、メトリクスのwriterラベルに使う。
+    """
+
+    def __init__(self, max_queue=QUEUE_SIZE, drop_policy=DEFAULT_DROP_POLICY, compression=PNG_COMPRESSION, name="artifacts"):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"drop_policyは {', '.join(DROP_POLICIES)} のいずれかを指定してください: {drop_policy}")
+        self.name = name
+        self.drop_policy = drop_policy
+        self.compression = compression
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._thread = None
+        _all_writers.add(self)
+
+    def submit(self, path, image, on_done=None):
+        """
+        画像の書き込みを予約する。書き込み待ちに入れられた場合はTrue、捨てた場合はFalseを返す。
+        on_doneを指定した場合は、書き込み後に書き込みスレッドから on_done(成功したか) が呼ばれる。
+        """
+        if image is None or image.size == 0: return False
+        # MappedFrameの1920x1080への変換は書き込みスレッドで行い、呼び出し元のスレッドを待たせない
+        self._ensure_started()
+        item = (path, image, on_done)
+        if self.drop_policy == BLOCK:
+            self._queue.put(item)
+            return True
+        with self._lock:
+            try:
+                self._queue.put_nowait(item)
+                return True
+            except queue.Full:
+                if self.drop_policy == DROP_NEWEST:
+                    self._drop(item)
+                    return False
+            # DROP_OLDEST: 最も古いものを捨てて入れ直す (書き込みスレッドが取り出していれば空きができている)
+            try:
+                self._drop(self._queue.get_nowait())
+                self._queue.task_done()
+            except queue.Empty:
+                pass
+            self._queue.put_nowait(item)
+            return True
+
+    def pending(self):
+        return self._queue.unfinished_tasks
+
+    def flush(self, timeout=FLUSH_TIMEOUT):
+        """書き込み待ちの画像が全て書き込まれるまで、最大timeout秒待つ。全て書き込まれていればTrue。"""
+        with self._queue.all_tasks_done:
+            return self._queue.all_tasks_done.wait_for(lambda: not self._queue.unfinished_tasks, timeout)
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive(): return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=f"{self.name}-writer", daemon=True)
+                self._thread.start()
+
+    def _drop(self, item):
+        self.dropped += 1
+        metrics.inc('artifacts_dropped_total', writer=self.name)
+        path, _, on_done = item
+        print(f"[artifacts] WARNING: 書き込み待ちが上限 ({self._queue.maxsize}) に達したため、画像を保存しませんでした: {os.path.basename(path)}")
+        if on_done: on_done(False)
+
+    def _run(self):
+        while True:
+            path, image, on_done = self._queue.get()
+            ok = False
+            try:
+                with metrics.stage('artifact_write'):
+                    ok = write_image(path, geometry.to_array(image), self.compression)
+                if not ok: print(f"[artifacts] ERROR: 画像のエンコードに失敗しました: {path}")
+            except Exception as e:
+                print(f"[artifacts] ERROR: 画像の保存に失敗しました: {path} ({e})")
+            finally:
+                if ok:
+                    self.written += 1
+                else:
+                    self.failed += 1
+                    metrics.inc('artifacts_failed_total', writer=self.name)
+                if on_done:
+                    try: on_done(ok)
+                    except Exception as e: print(f"[artifacts] ERROR: 保存後の処理に失敗しました: {e}")
+                self._queue.task_done()
+
+
+_writer = None
+_writer_lock = threading.Lock()
+_all_writers = weakref.WeakSet()  # flushで待つ、生成済みの全てのArtifactWriter
+
+def get_writer():
+    """プロセス全体で共有するArtifactWriterを返す。"""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = ArtifactWriter()
+        return _writer
+
+def submit(path, image, on_done=None):
+    """get_writer().submit の省略形。"""
+    return get_writer().submit(path, image, on_done)
+
+def flush(timeout=FLUSH_TIMEOUT):
+    """
+    共有のArtifactWriterと、個別に生成したArtifactWriter (frame_storeなど) の書き込み待ちを待つ。
+    全て書き込まれていればTrue。
+    """
+    deadline = time.monotonic() + timeout
+    ok = True
+    for writer in list(_all_writers):
+        ok = writer.flush(max(0.0, deadline - time.monotonic())) and ok
+    return ok
@@ -0,0 +1,408 @@
+"""
+画像処理・OCR・コース名照合・レース履歴の各処理を、保存済みのコース決定画面・リザルト画面の
+フレームで繰り返し実行し、処理ごとの所要時間 (p50/p95) と処理速度をJSONで出力する。
+基準値 (ベースライン) と比べて遅くなった処理があれば、終了コード1で終了する。
+あわせて、解析用モジュールの読み込み時間が上限を超えていないか、読み込みだけでGUIやAPIクライアントなどの
+重い依存モジュールを読み込んでいないかを、新しいプロセスで確認する。
+
+OCRは既定ではスタブ (Tesseractを呼ばない) に差し替え、オフラインで同じ条件で測定できるようにする。
+--real-ocr を指定した場合のみTesseractを使う。
+
+使い方:
+    python src/benchmark.py [--corpus フォルダ] [--repeat 回数] [--output 結果.json]
+    python src/benchmark.py --save-baseline          (現在の結果を基準値として保存)
+    python src/benchmark.py --streams 8              (8ストリームの並行処理の、ワーカー数ごとの処理速度も測定)
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+import analysis
+import config
+import frame_store
+import geometry
+import history
+import imaging
+import monitor
+import ocr
+import replay
+
+# --- パス設定 ---
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+CORPUS_DIR = frame_store.TEMP_DIR  # 監視中に検出した画面が保存される場所
+BASELINE_PATH = os.path.join(SCRIPT_DIR, '..', 'data', 'benchmark', 'baseline.json')
+
+# --- 設定 ---
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.npy')
+DEFAULT_REPEAT = 20
+MAX_FRAMES_PER_KIND = 50      # 1種類の画面あたりに読み込むフレーム数の上限
+REGRESSION_TOLERANCE = 0.25   # 基準値のp50からこの割合を超えて遅くなったら回帰とみなす
+REGRESSION_MIN_DELTA_MS = 0.05  # 測定誤差とみなす差 (これ以下の差は回帰とみなさない)
+HISTORY_ROWS = 2000           # レース履歴の測定で事前に投入する行数
+COURSE_NAME_SAMPLES = 200     # コース名照合の測定に使う、誤認識を模した文字列の数
+STREAM_FRAMES = 100           # --streamsの測定で、1ストリームあたりに再生するフレーム数
+IMPORT_CHECK_MODULES = ('analysis', 'monitor', 'session', 'replay', 'benchmark')
+IMPORT_BUDGET_MS = 500        # 上記モジュールの読み込みに許す時間(ms)
+IMPORT_CHECK_RUNS = 3         # 読み込み時間は最も速かった回で判定する
+# 上記モジュールの読み込みだけで読み込まれてはならない (使用時に初めて読み込む) モジュール
+LAZY_MODULES = ('tkinter', 'google.generativeai', 'pytesseract', 'tesserocr', 'PIL.Image',
+                'win32gui', 'win32ui', 'pygrabber', 'pygetwindow')
+
+
+class StubEngine:
+    """TesseractEngineの代わりに使う、何も読み取らないエンジン。前処理とテンプレート照合だけを測定する。"""
+    is_resident = True
+
+    def recognize(self, image, whitelist=ocr.DIGITS):
+        return ""
+
+    def recognize_batch(self, images, whitelist=ocr.DIGITS):
+        return ["" for _ in images]
+
+    def close(self):
+        pass
+
+
+def install_stub_ocr():
+    """OCRとGemini APIの呼び出しをスタブに差し替える。"""
+    engine = StubEngine()
+    ocr.get_engine = lambda tesseract_path=None, max_engines=None: engine
+
+    def submit_course_ocr(image, label=None):
+        future = ocr.Future()
+        future.set_result("コース不明 (スタブ)")
+        return future
+    ocr.submit_course_ocr = submit_course_ocr
+
+
+# --- 測定データ ---
+def load_corpus(corpus_dir, limit=MAX_FRAMES_PER_KIND):
+    """
+    フォルダ内の画像を読み込み、{'course': [...], 'result': [...]} に分ける。
+    ファイル名が course_/result_ で始まるもの (監視中に保存された画面) はその名前で、
+    それ以外は画面判定で振り分ける。フレームは監視時と同じくgeometry.map_frameを通す。
+    """
+    corpus = {imaging.SCREEN_COURSE_DECISION: [], imaging.SCREEN_RESULT: []}
+    if not os.path.isdir(corpus_dir): return corpus
+    for name in sorted(os.listdir(corpus_dir)):
+        if not name.lower().endswith(IMAGE_EXTENSIONS): continue
+        path = os.path.join(corpus_dir, name)
+        raw = np.load(path) if name.lower().endswith('.npy') else cv2.imread(path)
+        if raw is None: continue
+        frame = geometry.map_frame(raw)
+        if name.startswith('course'):
+            kind = imaging.SCREEN_COURSE_DECISION
+        elif name.startswith('result'):
+            kind = imaging.SCREEN_RESULT
+        else:
+            kind = imaging.classify_screen(frame)
+        if kind in corpus and len(corpus[kind]) < limit:
+            corpus[kind].append(frame)
+    return corpus
+
+
+def _noisy_course_names(count, seed=0):
+    """コース名の一部の文字を欠落・置換した、OCRの誤認識を模した文字列を作る。"""
+    rng = random.Random(seed)
+    names = []
+    for _ in range(count):
+        chars = list(rng.choice(config.COURSE_NAMES))
+        for _ in range(rng.randint(0, 2)):
+            index = rng.randrange(len(chars))
+            if rng.random() < 0.5 and len(chars) > 1: del chars[index]
+            else: chars[index] = rng.choice("ーィッノ口二")
+        names.append("".join(chars))
+    return names
+
+
+# --- 測定 ---
+def measure(func, inputs, repeat, warmup=1):
+    """inputsの各要素でfuncを呼び出す処理をrepeat回繰り返し、1回あたりの所要時間 (ミリ秒) の一覧を返す。"""
+    samples = []
+    with contextlib.redirect_stdout(io.StringIO()):  # 解析処理のDEBUG出力を測定に含めない
+        for i in range(warmup + repeat):
+            for item in inputs:
+                started = time.perf_counter()
+                func(item)
+                if i >= warmup:
+                    samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def summarize(samples):
+    samples = np.asarray(samples)
+    mean = float(samples.mean())
+    return {
+        'n': int(samples.size),
+        'p50_ms': round(float(np.percentile(samples, 50)), 4),
+        'p95_ms': round(float(np.percentile(samples, 95)), 4),
+        'mean_ms': round(mean, 4),
+        'throughput_per_sec': round(1000 / mean, 1) if mean > 0 else None,
+    }
+
+
+def build_stages(corpus, work_dir):
+    """(処理名, 関数, 入力の一覧) を返す。入力がない処理は含めない。"""
+    courses = corpus[imaging.SCREEN_COURSE_DECISION]
+    results = corpus[imaging.SCREEN_RESULT]
+    frames = courses + results
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        result_crops = [crops for _, crops in map(imaging.crop_image_for_result, results) if crops]
+        prerace_rois = [roi for roi, *_ in map(imaging.analyze_course_decision_screen, courses) if roi is not None]
+
+    csv_path = os.path.join(work_dir, 'race_data.csv')
+    store = history.get_history(csv_path)
+    rows = [[f"result_screen_{i:06d}.png", f"2025-01-01 00:{i // 60 % 60:02d}:{i % 60:02d}",
+             config.COURSE_NAMES[i % len(config.COURSE_NAMES)], i % 12 + 1, 12, 1500 + i % 300, i % 7 - 3]
+            for i in range(HISTORY_ROWS)]
+    for row in rows: store.append(row)
+    append_rows = itertools.cycle(rows)
+
+    stages = [
+        ('imaging.classify_screen', imaging.classify_screen, frames),
+        ('imaging.check_for_highlight', imaging.check_for_highlight, results),
+        ('imaging.crop_image_for_result', imaging.crop_image_for_result, results),
+        ('imaging.analyze_course_decision_screen', imaging.analyze_course_decision_screen, courses),
+        ('ocr.analyze_rank_ocr', lambda c: ocr.analyze_rank_ocr(c['rank'], label='rank'), [c for c in result_crops if 'rank' in c]),
+        ('ocr.analyze_rate_ocr', lambda roi: ocr.analyze_rate_ocr(roi, label='rate'), [c['rate'] for c in result_crops if 'rate' in c] + prerace_rois),
+        ('ocr.analyze_rate_change_ocr', lambda c: ocr.analyze_rate_change_ocr(c['rate_change'], label='rate_change'), [c for c in result_crops if 'rate_change' in c]),
+        ('analysis.find_closest_course_name', lambda text: analysis.find_closest_course_name(text, config.COURSE_NAMES), _noisy_course_names(COURSE_NAME_SAMPLES)),
+        ('analysis.get_last_race_rate', analysis.get_last_race_rate, [csv_path]),
+        ('history.append', lambda _: store.append(next(append_rows)), [None]),
+        ('history.export_csv', lambda path: store.export_csv(path), [os.path.join(work_dir, 'export.csv')]),
+    ]
+    return [(name, func, inputs) for name, func, inputs in stages if inputs]
+
+
+def run(corpus, repeat=DEFAULT_REPEAT, only=None):
+    """全ての処理を測定し、{処理名: 集計結果} を返す。"""
+    work_dir = tempfile.mkdtemp(prefix='mkworld_benchmark_')
+    try:
+        report = {}
+        for name, func, inputs in build_stages(corpus, work_dir):
+            if only and name not in only: continue
+            report[name] = summarize(measure(func, inputs, repeat))
+        history.get_history(os.path.join(work_dir, 'race_data.csv')).close()
+        return report
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def find_regressions(stages, baseline, tolerance=REGRESSION_TOLERANCE):
+    """基準値と比べてp50が許容範囲を超えて遅くなった処理の一覧を返す。"""
+    regressions = []
+    for name, current in stages.items():
+        base = baseline.get('stages', {}).get(name)
+        if not base: continue
+        limit = max(base['p50_ms'] * (1 + tolerance), base['p50_ms'] + REGRESSION_MIN_DELTA_MS)
+        if current['p50_ms'] > limit:
+            regressions.append({'stage': name, 'baseline_p50_ms': base['p50_ms'], 'p50_ms': current['p50_ms'],
+                                'ratio': round(current['p50_ms'] / base['p50_ms'], 2) if base['p50_ms'] else None})
+    return regressions
+
+
+# --- 並行処理 ---
+class CorpusSource:
+    """コーパスのフレームを、コース決定画面とリザルト画面が交互に並んだ映像として繰り返し再生する。"""
+
+    def __init__(self, name, frames, count, frame_interval=monitor.MONITORING_INTERVAL):
+        self.name = name
+        self.frames = frames
+        self.count = count
+        self.frame_interval = frame_interval
+        self.position = -1
+
+    def read_at(self, seconds):
+        target = max(self.position + 1, math.ceil(seconds / self.frame_interval))
+        if target >= self.count: return None
+        self.position = target
+        return self.frames[target % len(self.frames)]
+
+    def release(self):
+        pass
+
+
+def _stream_frames(corpus):
+    courses = [geometry.to_array(f) for f in corpus[imaging.SCREEN_COURSE_DECISION]]
+    results = [geometry.to_array(f) for f in corpus[imaging.SCREEN_RESULT]]
+    return [f for pair in itertools.zip_longest(courses, results) for f in pair if f is not None]
+
+
+def worker_counts(streams):
+    """1からstreamsまでの2の累乗と、streams自身。"""
+    counts = {streams}
+    count = 1
+    while count < streams:
+        counts.add(count)
+        count *= 2
+    return sorted(counts)
+
+
+def measure_streams(corpus, streams, frames_per_stream=STREAM_FRAMES, workers=None):
+    """
+    streams本のストリームをreplay.run_replaysで並行に処理し、ワーカー数ごとの処理速度 (frames/sec) を返す。
+    全てのフレームを解析するよう、サンプリング間隔は固定にする。フレームがない場合はNone。
+    """
+    frames = _stream_frames(corpus)
+    if not frames: return None
+    work_dir = tempfile.mkdtemp(prefix='mkworld_benchmark_streams_')
+    save_detected_frames, monitor.SAVE_DETECTED_FRAMES = monitor.SAVE_DETECTED_FRAMES, False  # 測定用の画面をdata/tempに残さない
+    try:
+        scaling = []
+        for count in (workers or worker_counts(streams)):
+            sources = [CorpusSource(f"stream{i}", frames, frames_per_stream) for i in range(streams)]
+            csv_paths = [os.path.join(work_dir, f"w{count}_stream{i}.csv") for i in range(streams)]
+            with contextlib.redirect_stdout(io.StringIO()):
+                report = replay.run_replays(sources, csv_paths, adaptive=False, workers=count)
+            for csv_path in csv_paths:
+                history.get_history(csv_path).close()
+            scaling.append({'workers': count, 'frames': report['frames'], 'elapsed_sec': round(report['elapsed'], 3),
+                            'fps': round(report['fps'], 1)})
+        base_fps = scaling[0]['fps']
+        for entry in scaling:
+            entry['speedup'] = round(entry['fps'] / base_fps, 2) if base_fps else None
+        return {'streams': streams, 'frames_per_stream': frames_per_stream, 'scaling': scaling}
+    finally:
+        monitor.SAVE_DETECTED_FRAMES = save_detected_frames
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+# --- 読み込み時間 ---
+_IMPORT_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+for name in sys.argv[1].split(','):
+    __import__(name)
+elapsed = time.perf_counter() - started
+print(json.dumps({'elapsed_ms': elapsed * 1000, 'loaded': [m for m in sys.argv[2].split(',') if m in sys.modules]}))
+"""
+
+def check_imports(modules=IMPORT_CHECK_MODULES, budget_ms=IMPORT_BUDGET_MS, runs=IMPORT_CHECK_RUNS):
+    """
+    新しいPythonプロセスでmodulesを読み込み、所要時間と、読み込まれてしまったLAZY_MODULESを返す。
+    problemsが空でなければ、上限超過か不要な依存モジュールの読み込みがある。
+    """
+    timings, loaded = [], set()
+    for _ in range(runs):
+        completed = subprocess.run([sys.executable, '-c', _IMPORT_PROBE, ','.join(modules), ','.join(LAZY_MODULES)],
+                                   cwd=SCRIPT_DIR, capture_output=True, text=True, encoding='utf-8')
+        if completed.returncode != 0:
+            error = (completed.stderr.strip().splitlines() or ['不明なエラー'])[-1]
+            return {'modules': list(modules), 'budget_ms': budget_ms, 'problems': [f"読み込みに失敗しました: {error}"]}
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        timings.append(result['elapsed_ms'])
+        loaded.update(result['loaded'])
+
+    elapsed_ms = min(timings)
+    problems = []
+    if elapsed_ms > budget_ms:
+        problems.append(f"読み込みに{elapsed_ms:.0f}msかかっています (上限: {budget_ms}ms)")
+    if loaded:
+        problems.append(f"読み込み時に {', '.join(sorted(loaded))} が読み込まれています")
+    return {'modules': list(modules), 'budget_ms': budget_ms, 'elapsed_ms': round(elapsed_ms, 1),
+            'lazy_modules_loaded': sorted(loaded), 'problems': problems}
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'opencv': cv2.__version__,
+        'numpy': np.__version__,
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="画像処理・OCR・履歴処理の所要時間を測定します。")
+    parser.add_argument('--corpus', default=CORPUS_DIR, help="測定に使う画面のフォルダ (既定: data/temp)")
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help="各処理を繰り返す回数")
+    parser.add_argument('--stage', action='append', help="測定する処理名 (複数指定可。既定: 全て)")
+    parser.add_argument('--output', help="結果のJSONを書き出すパス (既定: 標準出力)")
+    parser.add_argument('--baseline', default=BASELINE_PATH, help="比較する基準値のJSON (既定: data/benchmark/baseline.json)")
+    parser.add_argument('--save-baseline', action='store_true', help="今回の結果を基準値として保存する")
+    parser.add_argument('--tolerance', type=float, default=REGRESSION_TOLERANCE, help="回帰とみなす、基準値からの遅延の割合")
+    parser.add_argument('--real-ocr', action='store_true', help="スタブではなくTesseractでOCRを測定する")
+    parser.add_argument('--tesseract', help="tesseract実行ファイルのパス (--real-ocr使用時)")
+    parser.add_argument('--import-budget', type=float, default=IMPORT_BUDGET_MS, help="モジュールの読み込みに許す時間(ms)")
+    parser.add_argument('--streams', type=int, help="指定したストリーム数を並行に処理し、ワーカー数ごとの処理速度を測定する")
+    parser.add_argument('--stream-frames', type=int, default=STREAM_FRAMES, help="--streams使用時の、1ストリームあたりのフレーム数")
+    args = parser.parse_args()
+    if args.streams is not None and args.streams < 1:
+        parser.error("--streams には1以上を指定してください。")
+    if args.stream_frames < 1:
+        parser.error("--stream-frames には1以上を指定してください。")
+
+    if args.real_ocr:
+        ocr.get_engine(args.tesseract)
+    else:
+        install_stub_ocr()
+
+    corpus = load_corpus(args.corpus)
+    if not any(corpus.values()):
+        print(f"[benchmark] WARNING: {args.corpus} にコース決定画面・リザルト画面の画像がありません。画像を使わない処理のみ測定します。", file=sys.stderr)
+
+    stages = run(corpus, args.repeat, only=set(args.stage) if args.stage else None)
+    report = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'environment': environment(),
+        'ocr': 'tesseract' if args.real_ocr else 'stub',
+        'corpus': {kind: len(frames) for kind, frames in corpus.items()},
+        'repeat': args.repeat,
+        'stages': stages,
+        'imports': check_imports(budget_ms=args.import_budget),
+    }
+    if args.streams:
+        report['streams'] = measure_streams(corpus, args.streams, args.stream_frames)
+        if report['streams'] is None:
+            print("[benchmark] WARNING: 画像がないため、並行処理の速度は測定しません。", file=sys.stderr)
+
+    baseline = None
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        report['baseline'] = {'path': args.baseline, 'created_at': baseline.get('created_at')}
+        report['regressions'] = find_regressions(stages, baseline, args.tolerance)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+        print(f"[benchmark] 基準値を保存しました: {args.baseline}", file=sys.stderr)
+
+    ocr.close_engines()
+    for regression in (report.get('regressions') or []):
+        print(f"[benchmark] WARNING: {regression['stage']} が遅くなっています "
+              f"(p50: {regression['baseline_p50_ms']}ms -> {regression['p50_ms']}ms)", file=sys.stderr)
+    for problem in report['imports']['problems']:
+        print(f"[benchmark] WARNING: モジュールの{problem}", file=sys.stderr)
+    if report.get('regressions') or report['imports']['problems']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
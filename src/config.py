@@ -35,8 +35,10 @@ BASE_COORDS = {
     'rate_change': {'x1': 1630, 'y1': 45, 'x2': 1730, 'y2': 110},
 }
 BASE_Y_STEP = 77
+RESULT_ROWS = 13
+# 解析処理はlayout.pyで配列にまとめた座標を使う。RESULT_COORDSは 'rate_7' のような名前で参照する場合用
 RESULT_COORDS = {}
-for i in range(1, 14):
+for i in range(1, RESULT_ROWS + 1):
     y_offset = (i - 1) * BASE_Y_STEP
     RESULT_COORDS[f'rank_{i}'] = (BASE_COORDS['rank']['x1'], BASE_COORDS['rank']['y1'] + y_offset, BASE_COORDS['rank']['x2'], BASE_COORDS['rank']['y2'] + y_offset)
     RESULT_COORDS[f'rate_{i}'] = (BASE_COORDS['rate']['x1'], BASE_COORDS['rate']['y1'] + y_offset, BASE_COORDS['rate']['x2'], BASE_COORDS['rate']['y2'] + y_offset)
@@ -0,0 +1,121 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+
+# --- パス設定 ---
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_PATH = os.path.join(SCRIPT_DIR, '..', 'data', 'cache', 'course_cache.json')
+
+# --- 設定 ---
+MAX_ENTRIES = 512
+MAX_HAMMING_DISTANCE = 12  # 256ビットのハッシュのうち、何ビットまでの違いを同じ画面とみなすか
+HASH_BITS = 256            # imaging.compute_phash (hash_size=16) のビット数
+
+
+class CourseCache:
+    """
+    コース決定画面の切り抜きの知覚ハッシュと画面の種類 (単独コースか2連続レースか) をキーに、
+    認識済みのコース名を保存するキャッシュ。同じ種類の画面のうちハミング距離で近いハッシュを検索し、
+    見つかればGemini APIを呼ばずにコース名を返す。
+    件数が上限を超えた場合は、最も長く使われていない項目から削除する。
+
+    検索では、ハッシュをmax_distance + 1個のブロックに分けた索引を使う。距離がmax_distance以下の
+    ハッシュ同士は少なくとも1つのブロックが完全に一致するため、一致するブロックを持つ項目だけを調べればよい。
+    """
+
+    def __init__(self, path=CACHE_PATH, max_entries=MAX_ENTRIES, max_distance=MAX_HAMMING_DISTANCE, hash_bits=HASH_BITS):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        blocks = max_distance + 1
+        bounds = [round(i * hash_bits / blocks) for i in range(blocks + 1)]
+        self._blocks = [(start, (1 << (end - start)) - 1) for start, end in zip(bounds, bounds[1:])]
+        self._entries = OrderedDict()  # (ハッシュ, 単独コースか) -> コース名 (末尾が最近使用したもの)
+        self._index = [{} for _ in self._blocks]  # ブロックごとに、ブロックの値 -> キーの集合
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path): return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                items = json.load(f)
+            for item in items:
+                # 画面の種類を記録していない以前の形式の項目は、種類を取り違えないよう読み込まない
+                if 'single' not in item: continue
+                self._add((int(item['hash'], 16), bool(item['single'])), item['course'])
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[course_cache] WARNING: キャッシュファイルを読み込めませんでした: {e}")
+            self._entries.clear()
+            self._index = [{} for _ in self._blocks]
+
+    def _save(self):
+        if not self.path: return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump([{'hash': f"{h:x}", 'single': single, 'course': c} for (h, single), c in self._entries.items()],
+                      f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def _block_values(self, phash):
+        return [(phash >> start) & mask for start, mask in self._blocks]
+
+    def _add(self, key, course_name):
+        if key not in self._entries:
+            for index, value in zip(self._index, self._block_values(key[0])):
+                index.setdefault(value, set()).add(key)
+        self._entries[key] = course_name
+        self._entries.move_to_end(key)
+
+    def _remove_oldest(self):
+        key, _ = self._entries.popitem(last=False)
+        for index, value in zip(self._index, self._block_values(key[0])):
+            keys = index[value]
+            keys.discard(key)
+            if not keys: del index[value]
+
+    def lookup(self, phash, is_single_course):
+        """同じ種類の画面のうち、最も近いハッシュのコース名を返す。距離がmax_distanceを超える場合はNone。"""
+        with self._lock:
+            if (phash, is_single_course) in self._entries:
+                best_key = (phash, is_single_course)
+            else:
+                candidates = set()
+                for index, value in zip(self._index, self._block_values(phash)):
+                    candidates.update(index.get(value, ()))
+                best_key, best_distance = None, self.max_distance + 1
+                for key in candidates:
+                    if key[1] != is_single_course: continue
+                    distance = bin(key[0] ^ phash).count('1')
+                    if distance < best_distance:
+                        best_key, best_distance = key, distance
+            if best_key is None: return None
+            self._entries.move_to_end(best_key)
+            return self._entries[best_key]
+
+    def put(self, phash, is_single_course, course_name):
+        with self._lock:
+            self._add((phash, is_single_course), course_name)
+            while len(self._entries) > self.max_entries:
+                self._remove_oldest()
+            try:
+                self._save()
+            except OSError as e:
+                print(f"[course_cache] WARNING: キャッシュファイルを保存できませんでした: {e}")
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_course_cache():
+    """プロセス全体で共有するCourseCacheを返す。"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = CourseCache()
+        return _cache
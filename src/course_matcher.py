@@ -0,0 +1,120 @@
+"""
+OCRやGemini APIが返したコース名の文字列を、既知のコース名に照合する。
+コース名リストから起動時に1度だけ、正規化した名前の辞書と文字2-gramの転置索引を作り、
+照合時は 完全一致 → 2-gramを共有する候補の絞り込み → 上限付きの編集距離による順位付け の順に行う。
+類似度は difflib.SequenceMatcher.ratio と同じ尺度の 2 * 一致文字数 / 両者の文字数の合計 で、
+一致文字数には最長共通部分列の長さを使う (ratio以上の値になるため、従来一致した入力は必ず一致する)。
+
+正規化では、NFKCによる全角・半角の統一 (半角カナ・全角英数字など)、ひらがなのカタカナへの統一、
+空白・記号の除去、長音記号の表記ゆれの統一を行う。
+"""
+import re
+import threading
+import unicodedata
+
+import config
+
+# --- 設定 ---
+MIN_SCORE = 0.6         # この値以下の類似度の候補は一致とみなさない
+NGRAM = 2
+
+_IGNORED_CHARS = re.compile(r'[\s・･。、,.，．:：;；!！?？"\'“”‘’「」『』()（）\[\]【】*＊_＿/／]')
+_LONG_VOWELS = str.maketrans({c: 'ー' for c in '-‐‑‒–—―−ｰ～〜'})
+_HIRAGANA_TO_KATAKANA = str.maketrans({chr(c): chr(c + 0x60) for c in range(ord('ぁ'), ord('ゖ') + 1)})
+
+
+def normalize(text):
+    """照合用に文字列を正規化する (表示には使わない)。"""
+    text = unicodedata.normalize('NFKC', text)
+    text = text.translate(_LONG_VOWELS).translate(_HIRAGANA_TO_KATAKANA)
+    return _IGNORED_CHARS.sub('', text).upper()
+
+
+def ngrams(text, n=NGRAM):
+    if len(text) < n: return {text} if text else set()
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def bounded_levenshtein(a, b, limit, substitution_cost=1):
+    """
+    aとbの編集距離を返す。limitを超えることが分かった時点で打ち切り、limit + 1 を返す。
+    substitution_cost=2 とすると置換が削除+挿入と同じ扱いになり、
+    len(a) + len(b) - 2 * 最長共通部分列の長さ を返す。
+    """
+    if abs(len(a) - len(b)) > limit: return limit + 1
+    if len(a) > len(b): a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i] + [0] * len(b)
+        row_min = i
+        for j, cb in enumerate(b, 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (substitution_cost if ca != cb else 0))
+            if current[j] < row_min: row_min = current[j]
+        if row_min > limit: return limit + 1
+        previous = current
+    return previous[-1] if previous[-1] <= limit else limit + 1
+
+
+class CourseMatcher:
+    """既知の名前のリストに対する照合器。名前のリストごとに1度作り、使い回す。"""
+
+    def __init__(self, names, min_score=MIN_SCORE):
+        self.names = list(names)
+        self.min_score = min_score
+        self._normalized = [normalize(name) for name in self.names]
+        self._exact = {}
+        self._index = {}  # 2-gram -> その2-gramを含む名前の番号の集合
+        for i, key in enumerate(self._normalized):
+            self._exact.setdefault(key, i)
+            for gram in ngrams(key):
+                self._index.setdefault(gram, set()).add(i)
+
+    def _candidates(self, key):
+        """keyと2-gramを共有する名前の番号を返す。共有するものがなければ全ての名前を候補にする。"""
+        found = set()
+        for gram in ngrams(key):
+            found.update(self._index.get(gram, ()))
+        return found or range(len(self.names))
+
+    def top_k(self, text, k=1):
+        """
+        textに近い順に最大k件の (名前, 類似度) を返す。
+        類似度は 2 * 最長共通部分列の長さ / 両者の文字数の合計 (0〜1) で、min_scoreより大きいものだけを返す。
+        """
+        if not text: return []
+        key = normalize(text)
+        if not key: return []
+        exact = self._exact.get(key)
+        if exact is not None and k == 1:
+            return [(self.names[exact], 1.0)]
+
+        scored = []
+        for i in self._candidates(key):
+            name_key = self._normalized[i]
+            total = len(key) + len(name_key)
+            # min_scoreに届かない距離の計算は途中で打ち切る
+            limit = int(total * (1 - self.min_score))
+            distance = bounded_levenshtein(key, name_key, limit, substitution_cost=2)
+            if distance > limit: continue
+            score = 1 - distance / total
+            if score <= self.min_score: continue
+            scored.append((score, -i))  # 類似度が同じなら、リストの前にある名前を優先する
+        scored.sort(reverse=True)
+        return [(self.names[-negative_index], score) for score, negative_index in scored[:k]]
+
+    def match(self, text):
+        """最も近い名前を返す。min_score以上の名前がなければNone。"""
+        best = self.top_k(text, 1)
+        return best[0][0] if best else None
+
+
+_matcher = None
+_matcher_lock = threading.Lock()
+
+def get_course_matcher():
+    """config.COURSE_NAMESに対する照合器を返す。初回呼び出し時にのみ索引を作る。"""
+    global _matcher
+    with _matcher_lock:
+        if _matcher is None:
+            _matcher = CourseMatcher(config.COURSE_NAMES)
+        return _matcher
@@ -0,0 +1,127 @@
+import cv2
+import numpy as np
+import os
+import threading
+
+import config
+
+# --- パス設定 ---
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+REFERENCE_DIR = os.path.join(SCRIPT_DIR, '..', 'data', 'reference', 'courses')
+
+# --- 設定 ---
+MATCH_SCALE = 0.5              # 照合前に画像を縮小する倍率
+MIN_MATCH_SCORE = 0.85         # この相関値以上であれば、Gemini APIを使わずに確定する
+MAX_REFERENCES_PER_COURSE = 3
+
+
+def _imread_unicode(path):
+    # cv2.imreadはWindowsで日本語を含むパスを扱えないため、バイト列から復号する
+    data = np.fromfile(path, dtype=np.uint8)
+    return cv2.imdecode(data, cv2.IMREAD_GRAYSCALE) if data.size else None
+
+def _imwrite_unicode(path, image):
+    ok, encoded = cv2.imencode('.png', image)
+    if ok: encoded.tofile(path)
+    return ok
+
+def _prepare(image):
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    return cv2.resize(gray, None, fx=MATCH_SCALE, fy=MATCH_SCALE, interpolation=cv2.INTER_AREA)
+
+
+class LocalCourseRecognizer:
+    """
+    Gemini APIを使わずにコース名を認識する。
+    コースごとに保存した「コース名の表示部分」の参照画像を、
+    単独コースの場合はSINGLE_COURSE_NAME_AREAと直接、2連続レースの場合は
+    COURSE_SEARCH_AREA内をテンプレートマッチングで探索して照合する。
+    参照画像は data/reference/courses/<コース名>_<番号>.png に置く。
+    単独コースの画面でコース名が確定した際にも、自動で追加される。
+    """
+
+    def __init__(self, reference_dir=REFERENCE_DIR):
+        self.reference_dir = reference_dir
+        self._lock = threading.Lock()
+        self._names = []
+        self._templates = []
+        self._load_references()
+
+    def _load_references(self):
+        if not os.path.isdir(self.reference_dir): return
+        for filename in sorted(os.listdir(self.reference_dir)):
+            if not filename.endswith('.png'): continue
+            course_name = filename.rsplit('_', 1)[0]
+            if course_name not in config.COURSE_NAMES: continue
+            image = _imread_unicode(os.path.join(self.reference_dir, filename))
+            if image is not None:
+                self._add(course_name, image)
+
+    def _add(self, course_name, name_area_gray):
+        self._names.append(course_name)
+        self._templates.append(_prepare(name_area_gray))
+
+    @property
+    def has_references(self):
+        return bool(self._names)
+
+    def recognize(self, name_area, search_area=None, is_single_course=True):
+        """
+        (コース名, 相関値) を返す。参照画像がない場合は (None, 0.0)。
+        name_areaはSINGLE_COURSE_NAME_AREA、search_areaはCOURSE_SEARCH_AREAの切り抜き。
+        """
+        with self._lock:
+            names, templates = list(self._names), list(self._templates)
+        if not names: return None, 0.0
+
+        if is_single_course or search_area is None:
+            if name_area is None or name_area.size == 0: return None, 0.0
+            target = _prepare(name_area)
+            # 同じ大きさの領域同士なので、全参照画像との相関を1回の行列積で求める
+            same_size = [i for i, t in enumerate(templates) if t.shape == target.shape]
+            if not same_size: return None, 0.0
+            vectors = np.stack([_zero_mean_unit(templates[i]) for i in same_size])
+            scores = vectors @ _zero_mean_unit(target)
+            best = int(np.argmax(scores))
+            return names[same_size[best]], float(scores[best])
+
+        # 2連続レースでは表示位置が変わるため、探索領域の中から参照画像を探す
+        target = _prepare(search_area)
+        best_name, best_score = None, 0.0
+        for course_name, template in zip(names, templates):
+            if template.shape[0] > target.shape[0] or template.shape[1] > target.shape[1]: continue
+            _, score, _, _ = cv2.minMaxLoc(cv2.matchTemplate(target, template, cv2.TM_CCOEFF_NORMED))
+            if score > best_score:
+                best_name, best_score = course_name, score
+        return best_name, float(best_score)
+
+    def add_reference(self, course_name, name_area):
+        """確定したコース名の表示部分を参照画像として追加する。コースごとの上限を超える場合は何もしない。"""
+        if course_name not in config.COURSE_NAMES or name_area is None or name_area.size == 0: return
+        gray = cv2.cvtColor(name_area, cv2.COLOR_BGR2GRAY) if name_area.ndim == 3 else name_area
+        with self._lock:
+            count = self._names.count(course_name)
+            if count >= MAX_REFERENCES_PER_COURSE: return
+            self._add(course_name, gray)
+        os.makedirs(self.reference_dir, exist_ok=True)
+        if _imwrite_unicode(os.path.join(self.reference_dir, f"{course_name}_{count}.png"), gray):
+            print(f"[course_recognizer] INFO: '{course_name}' の参照画像を追加しました。")
+
+
+def _zero_mean_unit(image):
+    vector = image.astype(np.float32).ravel()
+    vector -= vector.mean()
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+_recognizer = None
+_recognizer_lock = threading.Lock()
+
+def get_local_recognizer():
+    """プロセス全体で共有するLocalCourseRecognizerを返す。"""
+    global _recognizer
+    with _recognizer_lock:
+        if _recognizer is None:
+            _recognizer = LocalCourseRecognizer()
+        return _recognizer
@@ -0,0 +1,290 @@
+"""
+検出したコース決定画面・リザルト画面のフレームを data/temp に保存し、合計サイズと保存期間の上限を超えた
+古いフレームから削除する。保存したフレームは索引に記録するため、レースごとの検索や
+一時ファイルの消去でフォルダを走査しない。索引は、ある時点の全項目 (index.json) と、
+その後の追加・削除を1行ずつ追記するジャーナル (index.journal) からなり、1枚保存するごとに索引全体を書き直さない。
+書き込みはデバッグ画像とは別の artifacts.ArtifactWriter の書き込みスレッドで行い、監視処理は待たない。
+保存期間を過ぎたフレームは、保存時に加えて EVICT_INTERVAL 秒ごとにも削除する。
+
+保存形式は PNG (既定) か、エンコードを行わずに配列をそのまま書き出す .npy を選べる
+(.npy は書き込みが速い代わりに、1920x1080で1枚約6MBになる)。
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import artifacts
+
+# --- パス設定 ---
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMP_DIR = os.path.join(SCRIPT_DIR, '..', 'data', 'temp')
+INDEX_NAME = 'index.json'
+JOURNAL_NAME = 'index.journal'
+
+# --- 設定 ---
+MAX_TOTAL_MB = 2048          # 保存するフレームの合計サイズの上限
+MAX_AGE_DAYS = 14            # これより古いフレームは削除する (0なら期間の上限なし)
+FRAME_FORMAT = 'png'         # 'png' または 'npy'
+FRAME_FORMATS = ('png', 'npy')
+LEGACY_SUBDIRS = ('cropped',)  # 以前のバージョンが切り抜き画像を保存していたフォルダ
+COMPACT_JOURNAL_RECORDS = 512  # ジャーナルがこの行数を超えたら、index.jsonに書き直してジャーナルを空にする
+EVICT_INTERVAL = 3600          # 保存期間を過ぎたフレームを削除する間隔(秒)
+
+
+class FrameStore:
+    """
+    保存したフレームを、ファイル名 -> {レース, 種類, サイズ, 保存時刻} の索引で管理する。
+    索引は保存した順に並んでおり (先頭が最も古い)、上限を超えた分は先頭から削除する。
+    writerを省略した場合は、このストア専用のArtifactWriterで書き込む (デバッグ画像の書き込みで捨てられないように)。
+    """
+
+    def __init__(self, root=TEMP_DIR, max_bytes=MAX_TOTAL_MB * 1024 * 1024, max_age=MAX_AGE_DAYS * 86400,
+                 frame_format=FRAME_FORMAT, writer=None):
+        if frame_format not in FRAME_FORMATS:
+            raise ValueError(f"frame_formatは {', '.join(FRAME_FORMATS)} のいずれかを指定してください: {frame_format}")
+        self.root = root
+        self.index_path = os.path.join(root, INDEX_NAME)
+        self.journal_path = os.path.join(root, JOURNAL_NAME)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.frame_format = frame_format
+        self.total_bytes = 0
+        self.dropped = 0
+        self._writer = writer or artifacts.ArtifactWriter(name="frame_store")
+        self._journal_records = 0
+        self._entries = OrderedDict()  # ファイル名 -> 索引の項目
+        self._races = {}               # レース -> [ファイル名, ...]
+        self._lock = threading.Lock()
+        self._stop_expiry = None
+        self._load()
+
+    # --- 索引 ---
+    def _load(self):
+        if os.path.exists(self.index_path) or os.path.exists(self.journal_path):
+            try:
+                if os.path.exists(self.index_path):
+                    with open(self.index_path, 'r', encoding='utf-8') as f:
+                        for item in json.load(f):
+                            self._add_entry(item)
+                self._replay_journal()
+                return
+            except (OSError, ValueError, KeyError) as e:
+                print(f"[frame_store] WARNING: 索引を読み込めなかったため、作り直します: {e}")
+                self._entries.clear(); self._races.clear(); self.total_bytes = 0
+        self._adopt_existing_files()
+
+    def _replay_journal(self):
+        """ジャーナルの追加・削除を順に索引へ反映する。書き込み途中で終了した最後の行は無視する。"""
+        if not os.path.exists(self.journal_path): return
+        with open(self.journal_path, 'r', encoding='utf-8') as f:
+            lines = f.readlines()
+        for number, line in enumerate(lines, 1):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                if number == len(lines): break
+                raise
+            if 'remove' in record:
+                if record['remove'] in self._entries: self._remove_entry(record['remove'], delete_file=False)
+            else:
+                if record['name'] in self._entries: self._remove_entry(record['name'], delete_file=False)
+                self._add_entry(record)
+        self._journal_records = len(lines)
+
+    def _adopt_existing_files(self):
+        """索引がない場合 (以前のバージョンで保存したフレームがある場合) に、1度だけフォルダを走査して索引に加える。"""
+        folders = [self.root] + [os.path.join(self.root, name) for name in LEGACY_SUBDIRS]
+        found = []
+        for folder in folders:
+            if not os.path.isdir(folder): continue
+            with os.scandir(folder) as it:
+                for entry in it:
+                    if not entry.is_file() or entry.name in (INDEX_NAME, INDEX_NAME + '.tmp', JOURNAL_NAME): continue
+                    stat = entry.stat()
+                    found.append({'name': os.path.relpath(entry.path, self.root).replace(os.sep, '/'),
+                                  'race': None, 'kind': None, 'size': stat.st_size, 'created': stat.st_mtime})
+        if not found: return
+        for item in sorted(found, key=lambda item: item['created']):
+            self._add_entry(item)
+        self._save()
+        print(f"[frame_store] INFO: 既存の{len(found)}個のファイルを索引に登録しました。")
+
+    def _add_entry(self, item):
+        name = item['name']
+        self._entries[name] = item
+        self.total_bytes += item['size']
+        if item.get('race') is not None:
+            self._races.setdefault(item['race'], []).append(name)
+
+    def _remove_entry(self, name, delete_file=True):
+        """索引から項目を削除する。delete_fileがTrueなら、ファイルを削除してジャーナルにも記録する。"""
+        item = self._entries.pop(name)
+        self.total_bytes -= item['size']
+        names = self._races.get(item.get('race'))
+        if names is not None:
+            names.remove(name)
+            if not names: del self._races[item['race']]
+        if not delete_file: return
+        self._append({'remove': name})
+        try:
+            os.remove(os.path.join(self.root, name))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"[frame_store] WARNING: {name} を削除できませんでした: {e}")
+
+    def _append(self, record):
+        """索引の変更をジャーナルに1行追記する。"""
+        os.makedirs(self.root, exist_ok=True)
+        with open(self.journal_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._journal_records += 1
+
+    def _compact_if_needed(self):
+        if self._journal_records > COMPACT_JOURNAL_RECORDS: self._save()
+
+    def _save(self):
+        """索引全体をindex.jsonに書き直し、ジャーナルを空にする。"""
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(list(self._entries.values()), f, ensure_ascii=False)
+        os.replace(tmp_path, self.index_path)
+        try:
+            os.remove(self.journal_path)
+        except FileNotFoundError:
+            pass
+        self._journal_records = 0
+
+    # --- 保存・検索 ---
+    def put(self, kind, frame_id, image, race=None):
+        """
+        フレームを '<kind>_<frame_id>.<形式>' として保存する (書き込みは書き込みスレッドで行う)。
+        raceを指定すると、frames_for_race(race) で検索できる。保存するファイル名を返す。
+        書き込み待ちが一杯で捨てられた場合や書き込みに失敗した場合は索引に登録しない。
+        """
+        name = f"{kind}_{frame_id}.{self.frame_format}"
+        path = os.path.join(self.root, name)
+
+        def on_written(ok):
+            size = None
+            if ok:
+                try: size = os.path.getsize(path)
+                except OSError: pass
+            with self._lock:
+                if size is None:
+                    self._discard_unwritten(name, path)
+                    return
+                # 同じ名前で上書きした場合は、書き込んだばかりのファイルを消さずに索引だけ置き換える
+                if name in self._entries: self._remove_entry(name, delete_file=False)
+                item = {'name': name, 'race': race, 'kind': kind, 'size': size, 'created': time.time()}
+                self._add_entry(item)
+                self._append(item)
+                self._evict_locked()
+                self._compact_if_needed()
+        self._writer.submit(path, image, on_done=on_written)
+        return name
+
+    def _discard_unwritten(self, name, path):
+        """
+        保存できなかったフレームの後始末。索引にない書き込み途中のファイルが残っていれば削除する。
+        同じ名前の古いフレームが索引にあり、そのファイルが書き込みの失敗で壊れていれば索引からも削除する。
+        """
+        self.dropped += 1
+        if name in self._entries:
+            try: intact = os.path.getsize(path) == self._entries[name]['size']
+            except OSError: intact = False
+            if not intact: self._remove_entry(name)
+            return
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"[frame_store] WARNING: {name} を削除できませんでした: {e}")
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def frames_for_race(self, race):
+        """レースの {種類: パス} を返す。"""
+        with self._lock:
+            return {self._entries[name]['kind']: self.path(name) for name in self._races.get(race, ())}
+
+    def files(self, kind=None):
+        """保存されているフレームのパスを古い順に返す。kindを指定すると、その種類のフレームだけを返す。"""
+        with self._lock:
+            return [self.path(name) for name, item in self._entries.items() if kind is None or item['kind'] == kind]
+
+    def __len__(self):
+        return len(self._entries)
+
+    # --- 削除 ---
+    def _evict_locked(self):
+        removed = 0
+        cutoff = time.time() - self.max_age if self.max_age else None
+        while self._entries:
+            name, item = next(iter(self._entries.items()))
+            if self.total_bytes <= self.max_bytes and (cutoff is None or item['created'] >= cutoff): break
+            self._remove_entry(name)
+            removed += 1
+        return removed
+
+    def evict(self):
+        """上限を超えた古いフレームを削除し、削除した数を返す。"""
+        with self._lock:
+            removed = self._evict_locked()
+            if removed: self._compact_if_needed()
+            return removed
+
+    def start_expiry(self, interval=EVICT_INTERVAL):
+        """interval秒ごとにevictを呼ぶスレッドを開始する (アプリが何も保存していない間も期限切れのフレームを削除する)。"""
+        if self._stop_expiry is not None: return
+        self._stop_expiry = stop = threading.Event()
+
+        def loop():
+            while not stop.wait(interval):
+                try:
+                    removed = self.evict()
+                    if removed: print(f"[frame_store] INFO: 保存期間を過ぎた{removed}個のフレームを削除しました。")
+                except Exception as e:
+                    print(f"[frame_store] ERROR: 古いフレームの削除に失敗しました: {e}")
+        threading.Thread(target=loop, name="frame-store-expiry", daemon=True).start()
+
+    def stop_expiry(self):
+        if self._stop_expiry is not None:
+            self._stop_expiry.set()
+            self._stop_expiry = None
+
+    def flush(self, timeout=artifacts.FLUSH_TIMEOUT):
+        """書き込み待ちのフレームが全て書き込まれ、索引に登録されるまで待つ。"""
+        return self._writer.flush(timeout)
+
+    def clear(self):
+        """保存した全てのフレームを削除し、削除した数を返す。"""
+        self.flush()  # 書き込み中のフレームも索引に登録されてから削除する
+        with self._lock:
+            count = len(self._entries)
+            for name in list(self._entries):
+                self._remove_entry(name)
+            self._save()
+            return count
+
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store():
+    """
+    プロセス全体で共有するFrameStoreを返す。初回呼び出し時に索引を読み込み、保存期間を過ぎたフレームを削除して、
+    以後も定期的に削除するスレッドを開始する。
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = FrameStore(TEMP_DIR, MAX_TOTAL_MB * 1024 * 1024, MAX_AGE_DAYS * 86400, FRAME_FORMAT)
+            _store.evict()
+            if _store.max_age: _store.start_expiry()
+        return _store
@@ -0,0 +1,146 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# --- 設定 ---
+MODEL_NAME = "gemini-2.5-flash"
+REQUEST_DEADLINE = 20.0    # 1回の認識要求に許す最大秒数 (再試行を含む)
+MAX_ATTEMPTS = 3
+RETRY_BACKOFF = 1.0        # 再試行までの待機秒数 (試行ごとに倍になる)
+FAILURE_THRESHOLD = 3      # 連続でこの回数失敗すると、一定時間APIを呼ばずに失敗を返す
+OPEN_SECONDS = 60.0
+
+
+class CircuitOpenError(Exception):
+    """障害が続いているため、APIを呼ばずに失敗させたことを表す。"""
+
+
+class GeminiClient:
+    """
+    Gemini APIを呼び出す長寿命のクライアント。
+    モデルは初回使用時に一度だけ生成して使い回し、要求はバックグラウンドのスレッドで実行する。
+    各要求には再試行を含めた期限があり、期限を過ぎると呼び出し側には TimeoutError が返る。
+    連続して失敗した場合はサーキットブレーカーが開き、OPEN_SECONDSの間は即座に失敗を返す。
+    """
+
+    def __init__(self, model_name=MODEL_NAME, deadline=REQUEST_DEADLINE, max_attempts=MAX_ATTEMPTS,
+                 backoff=RETRY_BACKOFF, failure_threshold=FAILURE_THRESHOLD, open_seconds=OPEN_SECONDS):
+        self.model_name = model_name
+        self.deadline = deadline
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self._model = None
+        self._lock = threading.Lock()
+        # 応答しない要求があっても後続の要求を処理できるよう、2スレッドで実行する
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="gemini")
+        self._consecutive_failures = 0
+        self._open_until = 0.0
+        self._trial_in_flight = False
+
+    def _get_model(self):
+        with self._lock:
+            if self._model is None:
+                import google.generativeai as genai  # 読み込みに時間がかかるため、初めて使う時に読み込む
+                self._model = genai.GenerativeModel(self.model_name)
+            return self._model
+
+    @property
+    def is_open(self):
+        return time.monotonic() < self._open_until
+
+    def _acquire_permission(self):
+        """サーキットブレーカーの状態を確認し、APIを呼んでよいかを返す。"""
+        with self._lock:
+            if self._consecutive_failures < self.failure_threshold:
+                return True
+            if time.monotonic() < self._open_until or self._trial_in_flight:
+                return False
+            # 待機時間が過ぎたら、試しに1件だけ通す
+            self._trial_in_flight = True
+            return True
+
+    def _record(self, success):
+        with self._lock:
+            self._trial_in_flight = False
+            if success:
+                self._consecutive_failures = 0
+                return
+            self._consecutive_failures += 1
+            if self._consecutive_failures >= self.failure_threshold:
+                self._open_until = time.monotonic() + self.open_seconds
+                print(f"[gemini] WARNING: API呼び出しが{self._consecutive_failures}回連続で失敗したため、{self.open_seconds:.0f}秒間呼び出しを停止します。")
+
+    def submit(self, contents):
+        """
+        generate_contentをバックグラウンドで実行し、応答テキストを返すFutureを返す。
+        Futureは期限内に必ず完了し、失敗時は例外を保持する。
+        """
+        result = Future()
+        if not self._acquire_permission():
+            result.set_exception(CircuitOpenError("Gemini APIは一時的に停止中です。"))
+            return result
+
+        deadline_at = time.monotonic() + self.deadline
+        timer = threading.Timer(self.deadline, _set_exception_once, (result, TimeoutError("Gemini APIの応答が期限内に得られませんでした。")))
+        timer.daemon = True
+        timer.start()
+
+        def run():
+            try:
+                text = self._generate_with_retries(contents, deadline_at)
+            except Exception as e:
+                self._record(False)
+                _set_exception_once(result, e)
+            else:
+                self._record(True)
+                _set_result_once(result, text)
+            finally:
+                timer.cancel()
+
+        self._executor.submit(run)
+        return result
+
+    def _generate_with_retries(self, contents, deadline_at):
+        model = self._get_model()
+        last_error = None
+        for attempt in range(self.max_attempts):
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0: break
+            try:
+                response = model.generate_content(contents, request_options={'timeout': remaining})
+                return response.text
+            except Exception as e:
+                last_error = e
+                print(f"[gemini] WARNING: API呼び出しに失敗しました ({attempt + 1}/{self.max_attempts}回目): {e}")
+                wait = min(self.backoff * (2 ** attempt), deadline_at - time.monotonic())
+                if attempt + 1 < self.max_attempts and wait > 0: time.sleep(wait)
+        raise last_error or TimeoutError("Gemini APIの応答が期限内に得られませんでした。")
+
+    def generate(self, contents):
+        """submitの結果を待って返す同期版。"""
+        return self.submit(contents).result()
+
+
+def _set_result_once(future, value):
+    if not future.done():
+        try: future.set_result(value)
+        except Exception: pass  # タイマー側と競合した場合
+
+def _set_exception_once(future, error):
+    if not future.done():
+        try: future.set_exception(error)
+        except Exception: pass
+
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """プロセス全体で共有するGeminiClientを返す。"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = GeminiClient()
+        return _client
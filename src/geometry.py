@@ -0,0 +1,105 @@
+import cv2
+import numpy as np
+
+# --- 設定 ---
+BASE_SIZE = (1920, 1080)  # config.pyの座標の基準となる解像度 (幅, 高さ)
+
+
+class FrameGeometry:
+    """
+    1920x1080基準の座標と、キャプチャ元の画像上の座標を相互に変換する。
+    contentはゲーム画面が描かれている範囲 (x, y, 幅, 高さ) で、省略時は画像の中央にある
+    16:9の範囲とみなす (ウィンドウキャプチャで上下・左右に黒帯が入る場合に対応する)。
+    """
+
+    def __init__(self, width, height, content=None):
+        self.width, self.height = width, height
+        if content is None:
+            content = _centered_16_9(width, height)
+        self.content = content
+        cx, cy, cw, ch = content
+        self.scale_x = cw / BASE_SIZE[0]
+        self.scale_y = ch / BASE_SIZE[1]
+
+    @property
+    def is_identity(self):
+        return self.content == (0, 0, BASE_SIZE[0], BASE_SIZE[1])
+
+    def to_source(self, x1, y1, x2, y2):
+        """基準座標の矩形を、キャプチャ元の画像上の矩形に変換する (画像の範囲内に収める)。"""
+        cx, cy = self.content[0], self.content[1]
+        sx1 = min(max(int(round(cx + x1 * self.scale_x)), 0), self.width)
+        sy1 = min(max(int(round(cy + y1 * self.scale_y)), 0), self.height)
+        sx2 = min(max(int(round(cx + x2 * self.scale_x)), sx1 + 1), self.width)
+        sy2 = min(max(int(round(cy + y2 * self.scale_y)), sy1 + 1), self.height)
+        return sx1, sy1, sx2, sy2
+
+
+def _centered_16_9(width, height):
+    if width * BASE_SIZE[1] > height * BASE_SIZE[0]:
+        # 横長: 左右に黒帯
+        content_width = round(height * BASE_SIZE[0] / BASE_SIZE[1])
+        return ((width - content_width) // 2, 0, content_width, height)
+    content_height = round(width * BASE_SIZE[1] / BASE_SIZE[0])
+    return (0, (height - content_height) // 2, width, content_height)
+
+
+class MappedFrame:
+    """
+    任意の解像度のフレームを、1920x1080のフレームと同じように扱うための読み取り専用のビュー。
+    frame[y1:y2, x1:x2] のように基準座標で切り抜くと、対応する元画像の領域だけを
+    基準座標での大きさにリサイズして返す。フレーム全体のリサイズは行わない。
+    """
+
+    def __init__(self, source, geometry=None):
+        self.source = source
+        self.geometry = geometry or FrameGeometry(source.shape[1], source.shape[0])
+        self.shape = (BASE_SIZE[1], BASE_SIZE[0]) + source.shape[2:]
+        self.ndim = source.ndim
+        self.dtype = source.dtype
+        self.size = int(np.prod(self.shape))
+        self._rois = {}
+
+    def __getitem__(self, key):
+        if not (isinstance(key, tuple) and len(key) == 2 and all(isinstance(k, slice) for k in key)):
+            raise TypeError("MappedFrameは frame[y1:y2, x1:x2] 形式の切り抜きのみ対応しています。")
+        y1, y2, _ = key[0].indices(self.shape[0])
+        x1, x2, _ = key[1].indices(self.shape[1])
+        if x2 <= x1 or y2 <= y1:
+            return self.source[0:0, 0:0]
+
+        roi = self._rois.get((x1, y1, x2, y2))
+        if roi is None:
+            sx1, sy1, sx2, sy2 = self.geometry.to_source(x1, y1, x2, y2)
+            roi = cv2.resize(self.source[sy1:sy2, sx1:sx2], (x2 - x1, y2 - y1), interpolation=cv2.INTER_AREA)
+            # 1フレームの中で同じ領域を何度も参照するため、リサイズ結果を使い回す
+            self._rois[(x1, y1, x2, y2)] = roi
+        return roi
+
+    def materialize(self):
+        """フレーム全体を1920x1080に変換したndarrayを返す。保存・デバッグ表示用。"""
+        return self[0:self.shape[0], 0:self.shape[1]]
+
+    def copy(self):
+        return self.materialize().copy()
+
+
+_geometries = {}
+
+def map_frame(raw_frame):
+    """
+    キャプチャしたフレームを、座標設定の基準である1920x1080のフレームとして扱える形で返す。
+    既に1920x1080であればそのまま返し、それ以外はMappedFrameで包む。
+    """
+    height, width = raw_frame.shape[:2]
+    if (width, height) == BASE_SIZE:
+        return raw_frame
+    geometry = _geometries.get((width, height))
+    if geometry is None:
+        geometry = _geometries[(width, height)] = FrameGeometry(width, height)
+    return MappedFrame(raw_frame, geometry)
+
+
+def to_array(image):
+    """MappedFrameであれば1920x1080のndarrayに変換し、それ以外はそのまま返す。"""
+    return image.materialize() if isinstance(image, MappedFrame) else image
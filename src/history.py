@@ -0,0 +1,473 @@
+import csv
+import json
+import os
+import sqlite3
+import threading
+from collections import deque
+
+# --- 設定 ---
+CSV_HEADER = ['Filename', 'Timestamp', 'Course', 'Rank', 'Participants', 'Rate', 'Rate Change']
+COLUMNS = ['filename', 'timestamp', 'course', 'rank', 'participants', 'rate', 'rate_change']
+INT_COLUMNS = {'rank', 'participants', 'rate', 'rate_change'}
+STATS_WINDOW = 100  # 平均レートを求める直近のレース数
+CSV_FLUSH_DELAY = 2.0  # 編集・削除の後、CSVを書き出すまでの秒数 (続けて編集した場合は1回にまとめる)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS races (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    filename TEXT,
+    timestamp TEXT,
+    course TEXT,
+    rank INTEGER,
+    participants INTEGER,
+    rate INTEGER,
+    rate_change INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_races_timestamp ON races(timestamp);
+CREATE INDEX IF NOT EXISTS idx_races_filename ON races(filename);
+CREATE INDEX IF NOT EXISTS idx_races_course ON races(course);
+CREATE INDEX IF NOT EXISTS idx_races_rate ON races(rate);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def _row_to_dict(row):
+    """DBの行を、CSVのヘッダー名をキーにした辞書に変換する。"""
+    if row is None: return None
+    return dict(zip(CSV_HEADER, row))
+
+def row_to_list(row):
+    """辞書形式の行を、CSVの列順のリストに変換する。"""
+    return [row.get(h, '') for h in CSV_HEADER]
+
+
+class RunningStats:
+    """
+    合計レース数・直近window件の平均レート・最高/最低レートを保持する。
+    追加時はリングバッファと累積値だけを更新するため、履歴の件数に関係なくO(1)で済む。
+    編集・削除で最高/最低値が失われた場合の再計算は、RaceHistoryがインデックスを使って行う。
+    """
+
+    def __init__(self, window=STATS_WINDOW):
+        self.window = window
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.last_id = 0
+        self.recent = deque(maxlen=self.window)  # (id, rate)
+        self.recent_sum = 0
+        self.max_rate = None
+        self.min_rate = None
+
+    def add(self, row_id, rate):
+        self.count += 1
+        self.last_id = row_id
+        if rate is None: return
+        if len(self.recent) == self.window:
+            self.recent_sum -= self.recent[0][1]
+        self.recent.append((row_id, rate))
+        self.recent_sum += rate
+        self._extend_extrema(rate)
+
+    def _extend_extrema(self, rate):
+        if self.max_rate is None or rate > self.max_rate: self.max_rate = rate
+        if self.min_rate is None or rate < self.min_rate: self.min_rate = rate
+
+    def replace_recent(self, row_id, rate):
+        """直近window件に含まれる行のレートを差し替える。"""
+        for i, (recent_id, old_rate) in enumerate(self.recent):
+            if recent_id == row_id:
+                self.recent[i] = (row_id, rate)
+                self.recent_sum += rate - old_rate
+                return
+
+    def set_recent(self, rows):
+        """直近window件を (id, rate) の古い順のリストで置き換える。"""
+        self.recent = deque(rows, maxlen=self.window)
+        self.recent_sum = sum(rate for _, rate in self.recent)
+
+    @property
+    def average(self):
+        return self.recent_sum / len(self.recent) if self.recent else None
+
+    def to_json(self):
+        return json.dumps({
+            'count': self.count, 'last_id': self.last_id, 'max': self.max_rate, 'min': self.min_rate,
+            'recent': list(self.recent),
+        })
+
+    @classmethod
+    def from_json(cls, text, window=STATS_WINDOW):
+        data = json.loads(text)
+        stats = cls(window)
+        stats.count, stats.last_id = data['count'], data['last_id']
+        stats.max_rate, stats.min_rate = data['max'], data['min']
+        stats.set_recent(tuple(r) for r in data['recent'])
+        return stats
+
+
+class RaceHistory:
+    """
+    レース履歴をSQLiteに保存し、最終行・タイムスタンプやファイル名での検索・期間指定の取得を
+    インデックスで行う。従来のrace_data.csvは、追記のたびに同じ内容を書き足すミラーとして維持する。
+    CSVが外部で編集・削除された場合は、次回アクセス時にCSVの内容を取り込み直す。
+    既存の行の編集・削除はDB上で1行ずつ行い、CSVは変更済みの印を付けて flush_csv() でまとめて書き出す。
+    """
+
+    def __init__(self, db_path, csv_path=None):
+        self.db_path = db_path
+        self.csv_path = csv_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._lock = threading.RLock()
+        self._flush_timer = None
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+        with self._lock:
+            self._sync_from_csv()
+            self.stats = self._load_stats()
+        # 前回、CSVへの書き出し前に終了していた場合はここで反映する
+        self.flush_csv()
+
+    # --- CSVとの同期 ---
+    def _csv_signature(self):
+        if not self.csv_path or not os.path.exists(self.csv_path): return ""
+        st = os.stat(self.csv_path)
+        return f"{st.st_size}:{st.st_mtime_ns}"
+
+    def _get_meta(self, key):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        self._conn.execute("INSERT OR REPLACE INTO meta(key, value) VALUES (?, ?)", (key, value))
+
+    def _sync_from_csv(self):
+        """ミラーのCSVが前回の書き込み以降に変更されていれば、DBの内容をCSVで置き換える。"""
+        signature = self._csv_signature()
+        if signature == (self._get_meta('csv_signature') or ""): return
+        if self._get_meta('csv_dirty'):
+            # CSVへ未反映の編集がある間は、DBの内容を正とする
+            print("[history] WARNING: CSVが外部で変更されましたが、未保存の編集があるためDBの内容を優先します。")
+            with self._conn:
+                self._mark_csv_synced()
+            return
+        with self._conn:
+            self._conn.execute("DELETE FROM races")
+            self._conn.execute("DELETE FROM meta WHERE key = 'stats'")
+            if signature:
+                self._insert_rows(self._read_csv(self.csv_path))
+            self._set_meta('csv_signature', signature)
+        if hasattr(self, 'stats'): self.stats = self._rebuild_stats()
+
+    # --- 統計 ---
+    def _load_stats(self):
+        """チェックポイントの統計を読み込む。DBの内容と一致しない場合は、インデックスを使って作り直す。"""
+        text = self._get_meta('stats')
+        (last_id,) = self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM races").fetchone()
+        if text:
+            try:
+                stats = RunningStats.from_json(text)
+                if stats.last_id == last_id: return stats
+            except (ValueError, KeyError, TypeError):
+                pass
+        return self._rebuild_stats()
+
+    def _rebuild_stats(self):
+        stats = RunningStats()
+        stats.count, stats.max_rate, stats.min_rate, stats.last_id = self._conn.execute(
+            "SELECT COUNT(*), MAX(rate), MIN(rate), COALESCE(MAX(id), 0) FROM races").fetchone()
+        stats.set_recent(self._recent_rates(stats.window))
+        with self._conn:
+            self._set_meta('stats', stats.to_json())
+        return stats
+
+    def _recent_rates(self, window):
+        rows = self._conn.execute(
+            "SELECT id, rate FROM races WHERE rate IS NOT NULL ORDER BY id DESC LIMIT ?", (window,)).fetchall()
+        return list(reversed(rows))
+
+    def _on_rate_changed(self, row_id, old_rate, new_rate):
+        """1行のレートが変わった (削除はnew_rate=None) ときに、統計を差分で更新する。"""
+        stats = self.stats
+        if old_rate == new_rate: return
+        in_window = any(recent_id == row_id for recent_id, _ in stats.recent)
+        if in_window and new_rate is not None:
+            stats.replace_recent(row_id, new_rate)
+        elif in_window or old_rate is None:
+            # 直近window件の顔ぶれが変わる場合は、window件だけ読み直す
+            stats.set_recent(self._recent_rates(stats.window))
+        if new_rate is not None: stats._extend_extrema(new_rate)
+        # 最高/最低値だった行が変わった場合のみ、インデックスから引き直す
+        if old_rate is not None and (old_rate == stats.max_rate or old_rate == stats.min_rate):
+            stats.max_rate, stats.min_rate = self._conn.execute("SELECT MAX(rate), MIN(rate) FROM races").fetchone()
+
+    def summary(self):
+        """(合計件数, 直近STATS_WINDOW件の平均レート, 最高レート, 最低レート) を返す。"""
+        with self._lock:
+            self._sync_from_csv()
+            stats = self.stats
+            return stats.count, stats.average, stats.max_rate, stats.min_rate
+
+    def _mark_csv_synced(self):
+        self._set_meta('csv_signature', self._csv_signature())
+
+    @staticmethod
+    def _read_csv(path):
+        with open(path, 'r', newline='', encoding='utf-8-sig') as f:
+            reader = csv.reader(f)
+            header = next(reader, None)
+            if not header: return []
+            indexes = [header.index(h) if h in header else None for h in CSV_HEADER]
+            rows = []
+            for row in reader:
+                rows.append([row[i] if i is not None and i < len(row) else '' for i in indexes])
+            return rows
+
+    def _insert_rows(self, rows):
+        values = [
+            tuple(_to_int(v) if col in INT_COLUMNS else v for col, v in zip(COLUMNS, row))
+            for row in rows
+        ]
+        self._conn.executemany(
+            f"INSERT INTO races({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})", values)
+
+    def import_csv(self, path):
+        """既存形式のCSVを読み込み、履歴の末尾に追加する。追加した件数を返す。"""
+        rows = self._read_csv(path)
+        with self._lock, self._conn:
+            self._sync_from_csv()
+            self._insert_rows(rows)
+        with self._lock:
+            self.stats = self._rebuild_stats()
+        if self.csv_path and os.path.abspath(path) != os.path.abspath(self.csv_path):
+            self.export_csv(self.csv_path)
+        return len(rows)
+
+    def export_csv(self, path=None):
+        """履歴全体を既存形式のCSVに書き出す。一時ファイルに書いてから置き換える。"""
+        path = path or self.csv_path
+        with self._lock:
+            self._sync_from_csv()
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'w', newline='', encoding='utf-8-sig') as f:
+                writer = csv.writer(f)
+                writer.writerow(CSV_HEADER)
+                writer.writerows(self._conn.execute(f"SELECT {', '.join(COLUMNS)} FROM races ORDER BY id"))
+            os.replace(tmp_path, path)
+            if path == self.csv_path:
+                with self._conn:
+                    self._mark_csv_synced()
+                    self._conn.execute("DELETE FROM meta WHERE key = 'csv_dirty'")
+
+    def flush_csv(self):
+        """編集・削除がCSVに未反映であれば、CSV全体を書き出す。"""
+        with self._lock:
+            if not self.csv_path or not self._get_meta('csv_dirty'): return
+        self.export_csv()
+
+    def schedule_flush_csv(self, delay=CSV_FLUSH_DELAY):
+        """
+        delay秒後にバックグラウンドのスレッドでflush_csvを呼ぶ。待っている間に再度呼ばれた場合は、
+        そこからdelay秒後に1回だけ書き出す。未反映の印 (csv_dirty) はDBにあるため、
+        書き出す前に終了しても次回起動時に書き出される。
+        """
+        def run():
+            try:
+                self.flush_csv()
+            except Exception as e:
+                print(f"[history] WARNING: CSVの書き出しに失敗しました: {e}")
+
+        with self._lock:
+            if self._flush_timer is not None: self._flush_timer.cancel()
+            self._flush_timer = threading.Timer(delay, run)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def _mark_csv_dirty(self):
+        if self.csv_path: self._set_meta('csv_dirty', '1')
+
+    # --- 書き込み ---
+    def _write(self, apply):
+        """applyをトランザクション内で実行し、統計のチェックポイントも同じトランザクションで保存する。"""
+        with self._lock:
+            self._sync_from_csv()
+            try:
+                with self._conn:
+                    result = apply()
+                    self._set_meta('stats', self.stats.to_json())
+            except Exception:
+                self.stats = self._load_stats()  # ロールバックされた変更を統計からも取り消す
+                raise
+            return result
+
+    def append(self, row):
+        """1レース分の行 (CSVの列順のリスト) を追加し、ミラーのCSVにも追記する。"""
+        values = tuple(_to_int(v) if col in INT_COLUMNS else v for col, v in zip(COLUMNS, row))
+
+        def apply():
+            cur = self._conn.execute(
+                f"INSERT INTO races({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})", values)
+            self.stats.add(cur.lastrowid, values[COLUMNS.index('rate')])
+            if self.csv_path:
+                is_new_file = not os.path.exists(self.csv_path) or os.path.getsize(self.csv_path) == 0
+                os.makedirs(os.path.dirname(os.path.abspath(self.csv_path)), exist_ok=True)
+                with open(self.csv_path, 'a', newline='', encoding='utf-8-sig') as f:
+                    writer = csv.writer(f)
+                    if is_new_file: writer.writerow(CSV_HEADER)
+                    writer.writerow(row)
+                self._mark_csv_synced()
+
+        self._write(apply)
+
+    def update_by_filename(self, filename, fields):
+        """Filenameで指定した行の項目を更新する。fieldsはCSVのヘッダー名をキーにした辞書。"""
+        assignments = {COLUMNS[CSV_HEADER.index(k)]: v for k, v in fields.items() if k in CSV_HEADER and k != 'Filename'}
+        if not assignments: return False
+        for column in INT_COLUMNS & assignments.keys():
+            assignments[column] = _to_int(assignments[column])
+
+        def apply():
+            row = self._conn.execute("SELECT id, rate FROM races WHERE filename = ?", (filename,)).fetchone()
+            if row is None: return False
+            self._conn.execute(
+                f"UPDATE races SET {', '.join(f'{c} = ?' for c in assignments)} WHERE id = ?",
+                (*assignments.values(), row[0]))
+            if 'rate' in assignments:
+                self._on_rate_changed(row[0], row[1], assignments['rate'])
+            self._mark_csv_dirty()
+            return True
+
+        return self._write(apply)
+
+    def edit_race(self, filename, fields):
+        """
+        Filenameで指定した1レースを編集し、編集した行とその次の行のRate Changeを前の行のレートから計算し直す。
+        変更は1つのトランザクションでDBに反映し (WALによりクラッシュしても途中の状態は残らない)、
+        CSVは flush_csv() の時点でまとめて書き出す。編集後の行を返す。該当する行がなければNone。
+        """
+        assignments = {COLUMNS[CSV_HEADER.index(k)]: v for k, v in fields.items()
+                       if k in CSV_HEADER and k not in ('Filename', 'Rate Change')}
+        for column in INT_COLUMNS & assignments.keys():
+            assignments[column] = _to_int(assignments[column])
+
+        def apply():
+            row = self._conn.execute("SELECT id, rate FROM races WHERE filename = ?", (filename,)).fetchone()
+            if row is None: return None
+            row_id, old_rate = row
+            new_rate = assignments.get('rate', old_rate)
+            prev_row = self._conn.execute("SELECT rate FROM races WHERE id < ? ORDER BY id DESC LIMIT 1", (row_id,)).fetchone()
+            next_row = self._conn.execute("SELECT id, rate FROM races WHERE id > ? ORDER BY id LIMIT 1", (row_id,)).fetchone()
+
+            changes = dict(assignments)
+            if prev_row and prev_row[0] and new_rate is not None:
+                changes['rate_change'] = new_rate - prev_row[0]
+            if changes:
+                self._conn.execute(f"UPDATE races SET {', '.join(f'{c} = ?' for c in changes)} WHERE id = ?",
+                                   (*changes.values(), row_id))
+            if next_row and next_row[1] is not None and new_rate:
+                self._conn.execute("UPDATE races SET rate_change = ? WHERE id = ?", (next_row[1] - new_rate, next_row[0]))
+            self._on_rate_changed(row_id, old_rate, new_rate)
+            self._mark_csv_dirty()
+            return _row_to_dict(self._conn.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM races WHERE id = ?", (row_id,)).fetchone())
+
+        return self._write(apply)
+
+    def delete_by_filename(self, filename):
+        """Filenameで指定した行を削除する。"""
+        def apply():
+            row = self._conn.execute("SELECT id, rate FROM races WHERE filename = ?", (filename,)).fetchone()
+            if row is None: return False
+            self._conn.execute("DELETE FROM races WHERE id = ?", (row[0],))
+            self.stats.count -= 1
+            (self.stats.last_id,) = self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM races").fetchone()
+            self._on_rate_changed(row[0], row[1], None)
+            self._mark_csv_dirty()
+            return True
+
+        return self._write(apply)
+
+    def clear(self):
+        """全履歴を削除する。ミラーのCSVも削除する。"""
+        def apply():
+            self._conn.execute("DELETE FROM races")
+            self._conn.execute("DELETE FROM meta WHERE key = 'csv_dirty'")
+            if self.csv_path and os.path.exists(self.csv_path):
+                os.remove(self.csv_path)
+            self._mark_csv_synced()
+            self.stats.reset()
+
+        self._write(apply)
+
+    # --- 読み出し ---
+    def _query(self, where="", params=(), order="ORDER BY id", limit=None):
+        sql = f"SELECT {', '.join(COLUMNS)} FROM races {where} {order}"
+        if limit is not None: sql += f" LIMIT {int(limit)}"
+        with self._lock:
+            self._sync_from_csv()
+            return [_row_to_dict(r) for r in self._conn.execute(sql, params)]
+
+    def count(self):
+        with self._lock:
+            self._sync_from_csv()
+            return self.stats.count
+
+    def last(self):
+        """最新の1件を返す。履歴が空ならNone。"""
+        rows = self._query(order="ORDER BY id DESC", limit=1)
+        return rows[0] if rows else None
+
+    def recent(self, limit):
+        """新しい順に最大limit件を返す。"""
+        return self._query(order="ORDER BY id DESC", limit=limit)
+
+    def find_by_timestamp(self, timestamp):
+        rows = self._query("WHERE timestamp = ?", (timestamp,), limit=1)
+        return rows[0] if rows else None
+
+    def find_by_filename(self, filename):
+        rows = self._query("WHERE filename = ?", (filename,), limit=1)
+        return rows[0] if rows else None
+
+    def previous(self, filename):
+        """Filenameで指定した行の1つ前の記録を返す。"""
+        rows = self._query("WHERE id < (SELECT id FROM races WHERE filename = ?)", (filename,),
+                           order="ORDER BY id DESC", limit=1)
+        return rows[0] if rows else None
+
+    def range(self, start_timestamp, end_timestamp):
+        """start_timestamp以上、end_timestamp以下の記録を古い順に返す。"""
+        return self._query("WHERE timestamp >= ? AND timestamp <= ?", (start_timestamp, end_timestamp),
+                           order="ORDER BY timestamp, id")
+
+    def by_course(self, course):
+        return self._query("WHERE course = ?", (course,))
+
+    def close(self):
+        with self._lock:
+            if self._flush_timer is not None: self._flush_timer.cancel()
+        self.flush_csv()
+        with self._lock:
+            self._conn.close()
+
+
+_histories = {}
+_histories_lock = threading.Lock()
+
+def get_history(csv_path):
+    """CSVのパスごとに共有するRaceHistoryを返す。DBはCSVと同じ場所に拡張子.sqlite3で作成する。"""
+    key = os.path.abspath(csv_path)
+    with _histories_lock:
+        if key not in _histories:
+            _histories[key] = RaceHistory(os.path.splitext(key)[0] + '.sqlite3', key)
+        return _histories[key]
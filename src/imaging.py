@@ -1,146 +1,146 @@
 import cv2
 import numpy as np
 import os
+import artifacts
 import config
+import geometry
+import layout
 
 # --- パス設定 ---
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
-OUTPUT_DIR = os.path.join(SCRIPT_DIR, '..', 'data', 'temp', 'cropped')
 DEBUG_DIR = os.path.join(SCRIPT_DIR, '..', 'data', 'debug')
 
-def crop_image_for_result(image_path):
-    """リザルト画面の画像を解析し、ハイライト位置と関連領域を切り抜く"""
-    if not os.path.exists(OUTPUT_DIR): os.makedirs(OUTPUT_DIR)
-    base_filename = os.path.splitext(os.path.basename(image_path))[0]
-    img = cv2.imread(image_path)
-    if img is None: return None
-    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-    lower_highlight = np.array(config.LOWER_HIGHLIGHT)
-    upper_highlight = np.array(config.UPPER_HIGHLIGHT)
-    player_rank_found = None
-    for i in range(1, 14):
-        x1, y1, x2, y2 = config.RESULT_COORDS[f'rank_{i}']
-        if y2 > img.shape[0] or x2 > img.shape[1]: continue
-        check_roi = hsv[y1:y2, x1:x2]
-        mask = cv2.inRange(check_roi, lower_highlight, upper_highlight)
-        if cv2.countNonZero(mask) > ((x2 - x1) * (y2 - y1) * 0.2):
-            player_rank_found = i; break
+# --- 画面判定の設定 ---
+# 数字が描かれた領域は、隣接ピクセル間の輝度差が大きい列を一定割合以上含む
+TEXT_EDGE_THRESHOLD = 40
+TEXT_EDGE_RATIO = 0.04
+PLAYER_SLOT_GRAY_THRESHOLD = 50
+MIN_TEXT_PLAYER_SLOTS = 2
+MIN_TEXT_RATE_ROWS = 2
+HIGHLIGHT_MIN_PIXELS = 500    # 順位列にこれより多くハイライト色があれば、ハイライトありとみなす
+HIGHLIGHT_ROW_RATIO = 0.2     # 順位枠のうちハイライト色がこの割合を超えた行を、プレイヤーの行とみなす
+SINGLE_COURSE_BLACK_VALUE = 70       # 単独コース名の背景とみなす明度 (BGRの最大値) の上限
+SINGLE_COURSE_MIN_BLACK_PIXELS = 5000
+
+SCREEN_COURSE_DECISION = "course_decision"
+SCREEN_RESULT = "result"
+SCREEN_OTHER = "other"
+
+def load_image(image):
+    """
+    ファイルパス、ndarray、またはgeometry.MappedFrameを受け取り、1920x1080基準で切り抜ける画像を返す。
+    読み込めない場合はNone。
+    """
+    if isinstance(image, (np.ndarray, geometry.MappedFrame)): return image
+    return artifacts.read_image(image)  # 日本語を含むパスも読めるよう、cv2.imreadは使わない
+
+def save_images(folder, base_filename, images):
+    """
+    {領域名: 画像} を '<base_filename>_<領域名>.png' としてまとめて保存する。
+    書き込みは artifacts の書き込みスレッドで行うため、呼び出し元は書き込みを待たない。
+    """
+    for region_name, roi in images.items():
+        if roi is None: continue
+        artifacts.submit(os.path.join(folder, f"{base_filename}_{region_name}.png"), roi)
+
+def crop_area(img, coords):
+    """(x1, y1, x2, y2) または {'x1', 'y1', 'x2', 'y2'} 形式の領域を、画像の範囲内に収めて切り抜く。"""
+    if isinstance(coords, dict):
+        coords = (coords['x1'], coords['y1'], coords['x2'], coords['y2'])
+    x1, y1 = max(0, coords[0]), max(0, coords[1])
+    x2, y2 = min(img.shape[1], coords[2]), min(img.shape[0], coords[3])
+    return img[y1:y2, x1:x2]
+
+def crop_image_for_result(image, save_dir=None, base_filename="result"):
+    """
+    リザルト画面を解析し、ハイライト位置と関連領域を切り抜く。
+    (順位, {領域名: 切り抜き}) を返す。切り抜きは元画像のビューであり、
+    save_dirを指定した場合のみファイルにも保存する。
+    """
+    img = load_image(image)
+    if img is None: return None, {}
+    _, player_rank_found = locate_highlight_row(img)
     if player_rank_found:
-        regions_to_crop = {
-            'rank': config.RESULT_COORDS[f'rank_{player_rank_found}'],
-            'rate': config.RESULT_COORDS[f'rate_{player_rank_found}'],
-            'rate_change': config.RESULT_COORDS[f'rate_change_{player_rank_found}'],
-        }
-        for region_name, (x1, y1, x2, y2) in regions_to_crop.items():
-            if y2 > img.shape[0] or x2 > img.shape[1]: continue
-            roi = img[y1:y2, x1:x2]
-            save_path = os.path.join(OUTPUT_DIR, f"{base_filename}_{region_name}.png")
-            cv2.imwrite(save_path, roi)
-        return player_rank_found
-    return None
-
-def analyze_course_decision_screen(image_path):
+        lay = layout.get_layout()
+        crops = {}
+        for table in (lay.rank, lay.rate, lay.rate_change):
+            roi = table.crop(img, player_rank_found - 1)
+            if roi is not None: crops[table.name] = roi
+        if save_dir: save_images(save_dir, base_filename, crops)
+        return player_rank_found, crops
+    return None, {}
+
+def analyze_course_decision_screen(image, save_dir=None, base_filename="course", debug_dir=None):
     """
     コース決定画面を解析し、レート・コース・参加人数に加え、
     単独レースかどうかも判別する。
+    (プレイヤーのレート領域, Geminiに渡すコース領域, 参加人数, 単独レースか) を返す。
+    領域は元画像のビューであり、save_dir・debug_dirを指定した場合のみ保存する。
     """
-    if not os.path.exists(OUTPUT_DIR):
-        os.makedirs(OUTPUT_DIR)
-        
-    base_filename = os.path.splitext(os.path.basename(image_path))[0]
-    img = cv2.imread(image_path)
+    img = load_image(image)
     if img is None:
         return None, None, 0, False
 
-    # --- 参加人数とプレイヤーのレート特定処理 (変更なし) ---
+    lay = layout.get_layout()
+
+    # --- 参加人数とプレイヤーのレート特定処理 ---
+    slots = analyze_player_slots(img)
+    participant_count = slots.participant_count
     brightest_rate_roi = None
-    max_brightness = 0
-    participant_count = 0
-    GRAY_THRESHOLD = 50
-
-    for coords in config.ALL_PLAYER_SLOTS:
-        x1, y1, x2, y2 = coords['x1'], coords['y1'], coords['x2'], coords['y2']
-        if y2 > img.shape[0] or x2 > img.shape[1]:
-            continue
-        roi = img[y1:y2, x1:x2]
-        gray_roi = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
-        
-        if np.mean(gray_roi) > GRAY_THRESHOLD:
-            participant_count += 1
-            brightness = np.max(gray_roi)
-            if brightness > max_brightness:
-                max_brightness = brightness
-                brightest_rate_roi = roi
-    
-    rate_save_path = None
-    if brightest_rate_roi is not None:
-        rate_save_path = os.path.join(OUTPUT_DIR, f"{base_filename}_prerace_rate.png")
-        cv2.imwrite(rate_save_path, brightest_rate_roi)
-
-    course_gemini_input_path = None
-    search_coords = config.COURSE_SEARCH_AREA
-    ax1, ay1, ax2, ay2 = search_coords['x1'], search_coords['y1'], search_coords['x2'], search_coords['y2']
-    ax1, ay1 = max(0, ax1), max(0, ay1)
-    ax2, ay2 = min(img.shape[1], ax2), min(img.shape[0], ay2)
-    course_search_area_img = img[ay1:ay2, ax1:ax2]
-    
-    if course_search_area_img.size > 0:
-        course_gemini_input_path = os.path.join(OUTPUT_DIR, f"{base_filename}_course_gemini_input.png")
-        cv2.imwrite(course_gemini_input_path, course_search_area_img)
+    if slots.brightest is not None:
+        brightest_rate_roi = lay.player_slots.crop(img, slots.brightest)
+
+    course_search_area_img = crop_area(img, lay.course_search_area)
+    if course_search_area_img.size == 0:
+        course_search_area_img = None
+
+    if save_dir:
+        save_images(save_dir, base_filename, {'prerace_rate': brightest_rate_roi, 'course_gemini_input': course_search_area_img})
 
     # --- 単独レースかの判別ロジック ---
     is_single_course = False
-    single_coords = config.SINGLE_COURSE_NAME_AREA
+    single_coords = lay.single_course_name_area
     
     print(f"[DEBUG] SINGLE_COURSE_NAME_AREA: {single_coords}")
     
-    sx1, sy1, sx2, sy2 = single_coords['x1'], single_coords['y1'], single_coords['x2'], single_coords['y2']
-    sx1, sy1 = max(0, sx1), max(0, sy1)
-    sx2, sy2 = min(img.shape[1], sx2), min(img.shape[0], sy2)
-    center_area = img[sy1:sy2, sx1:sx2]
+    center_area = crop_area(img, single_coords)
 
     if center_area.size > 0:
-        ### 追加 ###
-        # デバッグフォルダの存在を確認
-        os.makedirs(DEBUG_DIR, exist_ok=True)
-        # デバッグ用の画像として保存
-        debug_save_path = os.path.join(DEBUG_DIR, f"{base_filename}_single_course_check_area.png")
-        cv2.imwrite(debug_save_path, center_area)
-        print(f"[DEBUG] 確認エリアの画像を保存しました: {os.path.basename(debug_save_path)}")
-        #############
-
-        hsv = cv2.cvtColor(center_area, cv2.COLOR_BGR2HSV)
-        lower_black = np.array([0, 0, 0])
-        upper_black = np.array([180, 255, 70])
-        mask = cv2.inRange(hsv, lower_black, upper_black)
-        
-        pixel_count = cv2.countNonZero(mask)
+        if debug_dir:
+            # デバッグ用の画像として保存
+            save_images(debug_dir, base_filename, {'single_course_check_area': center_area})
+            print(f"[DEBUG] 確認エリアの画像を保存します: {base_filename}_single_course_check_area.png")
+
+        # HSVの明度 (V) はBGRの最大値なので、V <= 70 は全チャンネルが70以下であることと同じ。色変換せずに数える
+        black = (SINGLE_COURSE_BLACK_VALUE,) * 3
+        pixel_count = cv2.countNonZero(cv2.inRange(center_area, (0, 0, 0), black))
         print(f"[DEBUG] 比較対象 (黒ピクセル数): {pixel_count}")
         
-        if pixel_count > 5000:
+        if pixel_count > SINGLE_COURSE_MIN_BLACK_PIXELS:
             is_single_course = True
             print("[imaging] INFO: 単独コースレースを検出しました。")
 
-    return rate_save_path, course_gemini_input_path, participant_count, is_single_course
+    return brightest_rate_roi, course_search_area_img, participant_count, is_single_course
 
 def draw_debug_overlay(image, state, course_name=None, pre_race_rate=None):
     """指定された監視状態に基づいて、画像にデバッグ用の枠線を描画する"""
     debug_img = image.copy()
     
+    lay = layout.get_layout()
+    
     if state == "course_decision":
         state_text = "State: Waiting for Course Decision"
-        for coords in config.ALL_PLAYER_SLOTS:
-            cv2.rectangle(debug_img, (coords['x1'], coords['y1']), (coords['x2'], coords['y2']), (0, 255, 255), 2)
-        search_coords = config.COURSE_SEARCH_AREA
-        cv2.rectangle(debug_img, (search_coords['x1'], search_coords['y1']), (search_coords['x2'], search_coords['y2']), (255, 0, 255), 2)
-        single_coords = config.SINGLE_COURSE_NAME_AREA
-        cv2.rectangle(debug_img, (single_coords['x1'], single_coords['y1']), (single_coords['x2'], single_coords['y2']), (0, 0, 255), 2)
+        for x1, y1, x2, y2 in lay.player_slots.boxes.tolist():
+            cv2.rectangle(debug_img, (x1, y1), (x2, y2), (0, 255, 255), 2)
+        x1, y1, x2, y2 = lay.course_search_area
+        cv2.rectangle(debug_img, (x1, y1), (x2, y2), (255, 0, 255), 2)
+        x1, y1, x2, y2 = lay.single_course_name_area
+        cv2.rectangle(debug_img, (x1, y1), (x2, y2), (0, 0, 255), 2)
 
 
     elif state == "result":
         state_text = f"State: Waiting for Result (Course: {course_name}, Pre-Rate: {pre_race_rate})"
-        for i in range(1, 14):
-            x1, y1, x2, y2 = config.RESULT_COORDS[f'rate_{i}']
+        for x1, y1, x2, y2 in lay.rate.boxes.tolist():
             cv2.rectangle(debug_img, (x1, y1), (x2, y2), (0, 255, 0), 2)
     
     else: state_text = "State: Unknown"
@@ -148,29 +148,133 @@ def draw_debug_overlay(image, state, course_name=None, pre_race_rate=None):
     cv2.putText(debug_img, state_text, (20, 40), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2, cv2.LINE_AA)
     return debug_img
 
+def locate_highlight_row(image):
+    """
+    リザルト画面の順位列だけを1度HSVに変換し、全行のハイライト（黄色い背景）の量をまとめて求める。
+    (ハイライトの有無, プレイヤーの順位) を返す。順位が特定できない場合はNone。
+    """
+    lay = layout.get_layout()
+    x1, y1, x2, y2 = lay.rank[0]
+    row_height = y2 - y1
+    band_bottom = min(y1 + lay.rows * lay.row_step, image.shape[0])
+    x2 = min(x2, image.shape[1])
+    if band_bottom <= y1 or x2 <= x1: return False, None
+
+    hsv_band = cv2.cvtColor(image[y1:band_bottom, x1:x2], cv2.COLOR_BGR2HSV)
+    mask = cv2.inRange(hsv_band, np.array(config.LOWER_HIGHLIGHT), np.array(config.UPPER_HIGHLIGHT))
+    present = cv2.countNonZero(mask) > HIGHLIGHT_MIN_PIXELS
+
+    # 行の間隔で折り返して (行, 行内のy, x) とし、各行の順位枠の範囲だけを一度に数える
+    padded = np.zeros((lay.rows * lay.row_step, mask.shape[1]), dtype=mask.dtype)
+    padded[:mask.shape[0]] = mask
+    rows = padded.reshape(lay.rows, lay.row_step, -1)[:, :row_height]
+    counts = np.count_nonzero(rows, axis=(1, 2))
+    # 画像の下端で欠けている行は判定しない
+    counts[~lay.rank.fits(image.shape)] = 0
+
+    highlighted = np.flatnonzero(counts > row_height * (x2 - x1) * HIGHLIGHT_ROW_RATIO)
+    return present, (int(highlighted[0]) + 1 if highlighted.size else None)
+
 def check_for_highlight(image):
     """
     リザルト画面にプレイヤーのハイライト（黄色い背景）が存在するかをチェックする。
     """
-    lower_highlight = np.array(config.LOWER_HIGHLIGHT)
-    upper_highlight = np.array(config.UPPER_HIGHLIGHT)
+    present, _ = locate_highlight_row(image)
+    return present
 
-    try:
-        y1 = config.RESULT_COORDS['rank_1'][1]
-        y2 = config.RESULT_COORDS['rank_13'][3]
-        x1 = config.RESULT_COORDS['rank_1'][0]
-        x2 = config.RESULT_COORDS['rate_1'][2]
-        
-        search_roi = image[y1:y2, x1:x2]
-    except (KeyError, IndexError):
-        print("[imaging] ERROR: config.pyのRESULT_COORDSの定義が不完全です。")
-        return False
+def has_text_edges(roi):
+    """ROI内に数字らしい縦エッジ (水平方向の急な輝度変化) が十分にあるかを判定する。"""
+    gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY) if roi.ndim == 3 else roi
+    if gray.shape[1] < 2: return False
+    diff = np.abs(np.diff(gray.astype(np.int16), axis=1))
+    return np.count_nonzero(diff > TEXT_EDGE_THRESHOLD) > diff.size * TEXT_EDGE_RATIO
 
-    hsv_roi = cv2.cvtColor(search_roi, cv2.COLOR_BGR2HSV)
-    mask = cv2.inRange(hsv_roi, lower_highlight, upper_highlight)
-    
-    highlight_pixel_count = cv2.countNonZero(mask)
-    if highlight_pixel_count > 500:
-        return True
-    else:
-        return False
\ No newline at end of file
+class SlotAnalysis:
+    """
+    コース決定画面のプレイヤー枠 (layout.Layout.player_slots) をまとめて解析した結果。
+    brightestは最も明るい参加者の枠 (プレイヤー自身) の番号で、参加者がいなければNone。
+    """
+
+    def __init__(self, boxes, lit, text, peak):
+        self.boxes = boxes
+        self.lit = lit      # 枠ごとの、参加者がいる (平均輝度がしきい値を超える) か
+        self.text = text    # 枠ごとの、数字らしいエッジを持つか
+        self.peak = peak    # 枠ごとの最大輝度
+        self.participant_count = int(np.count_nonzero(lit))
+        self.text_slot_count = int(np.count_nonzero(lit & text))
+        lit_peak = np.where(lit, peak, 0)
+        self.brightest = int(np.argmax(lit_peak)) if lit_peak.size and lit_peak.max() > 0 else None
+
+    @property
+    def confidence(self):
+        """
+        コース決定画面らしさ (0〜1)。実際の画面では参加者の枠には必ずレートが表示されるため、
+        明るい枠のうち数字を含む割合と、数字を含む枠の数から求める。
+        """
+        if self.participant_count == 0: return 0.0
+        return (self.text_slot_count / self.participant_count) * min(1.0, self.text_slot_count / MIN_TEXT_PLAYER_SLOTS)
+
+
+def analyze_player_slots(image):
+    """
+    全てのプレイヤー枠を (枠, 高さ, 幅) の配列にまとめて1度だけグレースケールに変換し、
+    参加者の有無・最大輝度・数字らしいエッジの有無を配列の集計でまとめて求める。
+    画像の範囲外の枠は参加者なしとして扱う。
+    """
+    table = layout.get_layout().player_slots
+    boxes = table.boxes
+    inside = table.fits(image.shape)
+    empty = np.zeros(len(boxes), dtype=bool)
+    if not inside.any():
+        return SlotAnalysis(boxes, empty, empty, np.zeros(len(boxes), dtype=np.uint8))
+    width, height = table.uniform_size
+
+    # 全ての枠を (枠, 高さ, 幅) に積み重ね、1回の色変換でグレースケールにする
+    stack = table.stack(image)
+    if stack.ndim == 4:
+        stack = cv2.cvtColor(stack.reshape(-1, width, 3), cv2.COLOR_BGR2GRAY).reshape(-1, height, width)
+
+    lit = empty.copy()
+    text = empty.copy()
+    peak = np.zeros(len(boxes), dtype=np.uint8)
+    lit[inside] = stack.sum(axis=(1, 2), dtype=np.uint32) > PLAYER_SLOT_GRAY_THRESHOLD * width * height
+    peak[inside] = stack.max(axis=(1, 2))
+    if width >= 2:
+        edges = np.abs(np.diff(stack.astype(np.int16), axis=2)) > TEXT_EDGE_THRESHOLD
+        text[inside] = np.count_nonzero(edges, axis=(1, 2)) > height * (width - 1) * TEXT_EDGE_RATIO
+    return SlotAnalysis(boxes, lit, text, peak)
+
+def count_text_player_slots(image):
+    """コース決定画面のプレイヤー枠のうち、明るく数字らしいエッジを持つ枠の数を数える。"""
+    return analyze_player_slots(image).text_slot_count
+
+def course_screen_confidence(image):
+    """毎フレームで使える、コース決定画面らしさの安価な指標 (0〜1)。SlotAnalysis.confidenceを参照。"""
+    return analyze_player_slots(image).confidence
+
+def count_text_rate_rows(image):
+    """リザルト画面のレート列のうち、数字らしいエッジを持つ行の数を数える。"""
+    return sum(1 for roi in layout.get_layout().rate.crops(image) if has_text_edges(roi))
+
+def classify_screen(image):
+    """
+    Tesseractを使わず、レイアウト上の特徴だけで画面の種類を判定する。
+    "result" / "course_decision" / "other" のいずれかを返す。
+    ここでの判定は絞り込み用であり、最終的な確定はOCRで行う。
+    """
+    if count_text_rate_rows(image) >= MIN_TEXT_RATE_ROWS and check_for_highlight(image):
+        return SCREEN_RESULT
+    if count_text_player_slots(image) >= MIN_TEXT_PLAYER_SLOTS:
+        return SCREEN_COURSE_DECISION
+    return SCREEN_OTHER
+
+def compute_phash(image, hash_size=16):
+    """
+    画像の知覚ハッシュ(pHash)を整数で返す。縮小したグレースケール画像のDCT低周波成分が
+    中央値より大きいかどうかをビットにしたもので、似た画像ほどハミング距離が小さくなる。
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    small = cv2.resize(gray, (hash_size * 4, hash_size * 4), interpolation=cv2.INTER_AREA)
+    low_freq = cv2.dct(small.astype(np.float32))[:hash_size, :hash_size].ravel()
+    bits = low_freq > np.median(low_freq[1:])
+    return int("".join('1' if b else '0' for b in bits), 2)
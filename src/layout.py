@@ -0,0 +1,188 @@
+"""
+画面上の読み取り領域 (config.pyの座標設定) を、領域の種類ごとに (N, 4) のNumPy配列へまとめたもの。
+起動時に1度だけ組み立てて範囲を検証し、解析処理は文字列のキーや辞書を経由せず配列から切り抜く。
+config.pyと同じ形式のJSONファイル (layout.json) を置くと、そちらの座標を使う
+(別の解像度・UIサイズのレイアウトに差し替える場合に使用する)。
+"""
+import json
+import os
+import threading
+
+import numpy as np
+
+import config
+import geometry
+
+# --- パス設定 ---
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+LAYOUT_PATH = os.path.join(SCRIPT_DIR, 'layout.json')
+
+# --- 設定 ---
+DEFAULT_RESULT_ROWS = 13
+
+
+class RegionTable:
+    """同じ種類の領域 (x1, y1, x2, y2) を行ごとに並べた配列。"""
+
+    def __init__(self, name, boxes):
+        self.name = name
+        self.boxes = np.ascontiguousarray(np.asarray(boxes, dtype=np.int32).reshape(-1, 4))
+        self.widths = self.boxes[:, 2] - self.boxes[:, 0]
+        self.heights = self.boxes[:, 3] - self.boxes[:, 1]
+        self.areas = self.widths * self.heights
+        self._fits = {}
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def __getitem__(self, index):
+        x1, y1, x2, y2 = self.boxes[index]
+        return int(x1), int(y1), int(x2), int(y2)
+
+    @property
+    def uniform_size(self):
+        """全ての領域が同じ大きさであれば (幅, 高さ)、そうでなければNone。"""
+        if not len(self) or (self.widths != self.widths[0]).any() or (self.heights != self.heights[0]).any():
+            return None
+        return int(self.widths[0]), int(self.heights[0])
+
+    def fits(self, shape):
+        """画像の大きさ (shape) に収まる領域ならTrueとなる真偽値の配列。画像の大きさごとに1度だけ計算する。"""
+        key = tuple(shape[:2])
+        mask = self._fits.get(key)
+        if mask is None:
+            mask = self._fits[key] = (self.boxes[:, 2] <= key[1]) & (self.boxes[:, 3] <= key[0])
+        return mask
+
+    def crop(self, image, index):
+        """index番目の領域を切り抜く。画像に収まらない場合はNone。"""
+        if not self.fits(image.shape)[index]: return None
+        x1, y1, x2, y2 = self[index]
+        return image[y1:y2, x1:x2]
+
+    def crops(self, image):
+        """画像に収まる全ての領域の切り抜きを、領域の順に返す。"""
+        return [image[y1:y2, x1:x2] for x1, y1, x2, y2 in self.boxes[self.fits(image.shape)]]
+
+    def stack(self, image):
+        """画像に収まる全ての領域を (領域, 高さ, 幅[, チャンネル]) の配列に積み重ねる。全領域が同じ大きさである必要がある。"""
+        if self.uniform_size is None:
+            raise ValueError(f"'{self.name}' の領域の大きさが揃っていないため、まとめて切り抜けません。")
+        return np.stack(self.crops(image))
+
+
+class Layout:
+    """
+    1920x1080基準の読み取り領域一式。
+    リザルト画面の rank / rate / rate_change は、i番目が上から i+1 位の行に対応する。
+    """
+
+    def __init__(self, player_slots, rank, rate, rate_change, row_step, course_search_area, single_course_name_area, source="config.py"):
+        self.player_slots = RegionTable('player_slots', player_slots)
+        self.rank = RegionTable('rank', rank)
+        self.rate = RegionTable('rate', rate)
+        self.rate_change = RegionTable('rate_change', rate_change)
+        self.row_step = int(row_step)
+        self.rows = len(self.rank)
+        self.course_search_area = tuple(int(v) for v in course_search_area)
+        self.single_course_name_area = tuple(int(v) for v in single_course_name_area)
+        self.source = source
+
+    def tables(self):
+        return (self.player_slots, self.rank, self.rate, self.rate_change)
+
+    def validate(self, size=geometry.BASE_SIZE):
+        """全ての領域が空でなく、基準解像度の範囲内にあることを確認する。問題があればValueErrorを送出する。"""
+        width, height = size
+        areas = [(table.name, table.boxes) for table in self.tables()]
+        areas += [('course_search_area', np.array([self.course_search_area])),
+                  ('single_course_name_area', np.array([self.single_course_name_area]))]
+        for name, boxes in areas:
+            if not len(boxes):
+                raise ValueError(f"{self.source}: '{name}' に領域がありません。")
+            invalid = ((boxes[:, 0] < 0) | (boxes[:, 1] < 0) | (boxes[:, 2] > width) | (boxes[:, 3] > height)
+                       | (boxes[:, 2] <= boxes[:, 0]) | (boxes[:, 3] <= boxes[:, 1]))
+            if invalid.any():
+                index = int(np.flatnonzero(invalid)[0])
+                raise ValueError(f"{self.source}: '{name}' の{index + 1}番目の領域 {tuple(boxes[index].tolist())} が{width}x{height}の範囲外か、大きさが0です。")
+        if not len(self.rank) == len(self.rate) == len(self.rate_change):
+            raise ValueError(f"{self.source}: リザルト画面の rank / rate / rate_change の行数が一致しません。")
+        if self.player_slots.uniform_size is None:
+            raise ValueError(f"{self.source}: プレイヤー枠の大きさが揃っていません。")
+        if self.row_step < self.rank.heights.max():
+            raise ValueError(f"{self.source}: BASE_Y_STEP ({self.row_step}) が行の高さより小さくなっています。")
+        return self
+
+
+def _box(coords):
+    if isinstance(coords, dict):
+        return (coords['x1'], coords['y1'], coords['x2'], coords['y2'])
+    return tuple(coords)
+
+
+def compile_layout(spec, source="config.py"):
+    """
+    config.pyと同じ名前の設定 (BASE_COORDS, BASE_Y_STEP, ALL_PLAYER_SLOTS, COURSE_SEARCH_AREA,
+    SINGLE_COURSE_NAME_AREA, 省略可能な RESULT_ROWS・BASE_SIZE) を持つ辞書からLayoutを作る。
+    BASE_SIZEが1920x1080と異なる場合は、座標を1920x1080基準に換算する。
+    """
+    try:
+        base = spec['BASE_COORDS']
+        step = spec['BASE_Y_STEP']
+        rows = spec.get('RESULT_ROWS', DEFAULT_RESULT_ROWS)
+        if 'ALL_PLAYER_SLOTS' in spec:
+            slots = spec['ALL_PLAYER_SLOTS']
+        else:
+            slots = list(spec['COURSE_DECISION_RATE_COORDS_LEFT']) + list(spec['COURSE_DECISION_RATE_COORDS_RIGHT'])
+        course_search_area = _box(spec['COURSE_SEARCH_AREA'])
+        single_course_name_area = _box(spec['SINGLE_COURSE_NAME_AREA'])
+        size = tuple(spec.get('BASE_SIZE', geometry.BASE_SIZE))
+        results = {}
+        for kind in ('rank', 'rate', 'rate_change'):
+            x1, y1, x2, y2 = _box(base[kind])
+            offsets = np.arange(rows)[:, None] * step * np.array([0, 1, 0, 1])
+            results[kind] = np.array([x1, y1, x2, y2]) + offsets
+        player_slots = np.array([_box(c) for c in slots])
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"{source}: レイアウトの定義が不完全です ({e})。") from e
+
+    if size != tuple(geometry.BASE_SIZE):
+        # 別の解像度で測った座標を、基準解像度での座標に換算する
+        scale = np.array([geometry.BASE_SIZE[0] / size[0], geometry.BASE_SIZE[1] / size[1]] * 2)
+        scaled = lambda boxes: np.rint(np.asarray(boxes) * scale).astype(np.int32)
+        player_slots = scaled(player_slots)
+        results = {kind: scaled(boxes) for kind, boxes in results.items()}
+        course_search_area = tuple(scaled([course_search_area])[0])
+        single_course_name_area = tuple(scaled([single_course_name_area])[0])
+        step = step * geometry.BASE_SIZE[1] / size[1]
+
+    return Layout(player_slots, results['rank'], results['rate'], results['rate_change'], round(step),
+                  course_search_area, single_course_name_area, source=source).validate()
+
+
+def load_layout(path):
+    """config.pyと同じ形式のJSONファイルからLayoutを読み込む。"""
+    with open(path, encoding='utf-8') as f:
+        return compile_layout(json.load(f), source=os.path.basename(path))
+
+
+_layout = None
+_layout_lock = threading.Lock()
+
+def get_layout():
+    """現在のLayoutを返す。初回呼び出し時に、layout.jsonがあればそれを、なければconfig.pyを読み込む。"""
+    global _layout
+    with _layout_lock:
+        if _layout is None:
+            if os.path.exists(LAYOUT_PATH):
+                _layout = load_layout(LAYOUT_PATH)
+                print(f"[layout] INFO: レイアウトを読み込みました: {LAYOUT_PATH}")
+            else:
+                _layout = compile_layout(vars(config))
+        return _layout
+
+def set_layout(new_layout):
+    """使用するLayoutを差し替える (リプレイで別のレイアウトを指定する場合など)。"""
+    global _layout
+    with _layout_lock:
+        _layout = new_layout
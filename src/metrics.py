@@ -0,0 +1,258 @@
+"""
+監視処理の各段階 (キャプチャ・画面判定・OCR・Gemini API・履歴の保存など) の所要時間と件数を集計する。
+所要時間は固定の区切り (バケット) のヒストグラムで保持し、Prometheus形式のテキストか
+JSONのスナップショットとしてファイルに書き出す。
+無効な間 (既定) は各関数が何もせずに戻るため、計測箇所を残したままでもほとんど負荷はかからない。
+
+有効にするには、環境変数 MKWORLD_METRICS に出力先のパス (.prom / .txt ならPrometheus形式、
+.json ならJSON) を指定するか、enable() を呼び出す。
+"""
+import bisect
+import json
+import os
+import threading
+import time
+
+# --- 設定 ---
+METRICS_ENV = 'MKWORLD_METRICS'
+EXPORT_INTERVAL = 15.0  # ファイルに書き出す間隔(秒)
+PREFIX = 'mkworld_'
+# 所要時間のヒストグラムの区切り(秒)。フレームの解析 (数ms) からGemini APIの応答 (数秒) までを扱う
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+HELP = {
+    'frames_sampled_total': "キャプチャしたフレーム数",
+    'frames_analyzed_total': "解析したフレーム数 (変化がなく解析を省いたフレームを除く)",
+    'screens_detected_total': "検出した画面の数",
+    'races_recorded_total': "保存したレース結果の数",
+    'ocr_failures_total': "読み取りに失敗した項目の数",
+    'capture_failures_total': "フレームを取得できなかった回数",
+    'artifacts_dropped_total': "書き込み待ちが一杯で保存しなかった画像の数 (writer: デバッグ画像はartifacts、検出した画面はframe_store)",
+    'artifacts_failed_total': "保存に失敗した画像の数 (writer: artifacts / frame_store)",
+    'stage_seconds': "処理の段階ごとの所要時間(秒)",
+    'gemini_request_seconds': "Gemini APIによるコース名認識の所要時間(秒)",
+    'course_resolution_seconds': "コース決定画面の検出から、コース名が確定するまでの時間(秒)",
+    'detection_latency_seconds': "リザルト画面のフレームを取得してから、結果を保存するまでの時間(秒)",
+}
+
+
+class Histogram:
+    """累積しない (区切りごとの) 件数と合計を保持する。書き出し時に累積値に変換する。"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total, result = 0, []
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def quantile(self, q):
+        """区切りの上限で近似した分位点。件数がなければNone。"""
+        if not self.count: return None
+        rank = q * self.count
+        for bound, total in self.cumulative():
+            if total >= rank:
+                return bound if bound != float('inf') else self.buckets[-1]
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}    # (名前, ラベル) -> 値
+        self.histograms = {}  # (名前, ラベル) -> Histogram
+
+    def inc(self, name, value, labels):
+        key = (name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, labels):
+        key = (name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    # --- 書き出し ---
+    def render_prometheus(self):
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, (h.cumulative(), h.sum, h.count)) for key, h in self.histograms.items())
+        declared = set()
+
+        def declare(name, kind):
+            if name in declared: return
+            declared.add(name)
+            if name in HELP: lines.append(f"# HELP {PREFIX}{name} {HELP[name]}")
+            lines.append(f"# TYPE {PREFIX}{name} {kind}")
+
+        for (name, labels), value in counters:
+            declare(name, 'counter')
+            lines.append(f"{PREFIX}{name}{_format_labels(labels)} {value}")
+        for (name, labels), (cumulative, total, count) in histograms:
+            declare(name, 'histogram')
+            for bound, bucket_count in cumulative:
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels + (('le', le),))} {bucket_count}")
+            lines.append(f"{PREFIX}{name}_sum{_format_labels(labels)} {total:.6f}")
+            lines.append(f"{PREFIX}{name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        with self._lock:
+            counters = [{'name': name, 'labels': dict(labels), 'value': value}
+                        for (name, labels), value in sorted(self.counters.items())]
+            histograms = [{
+                'name': name, 'labels': dict(labels), 'count': h.count, 'sum': round(h.sum, 6),
+                'p50': h.quantile(0.5), 'p95': h.quantile(0.95),
+                'buckets': [[bound if bound != float('inf') else '+Inf', count] for bound, count in h.cumulative()],
+            } for (name, labels), h in sorted(self.histograms.items())]
+        return {'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'), 'counters': counters, 'histograms': histograms}
+
+
+def _format_labels(labels):
+    if not labels: return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+# --- 計測用の関数 (無効な間は何もしない) ---
+_registry = Registry()
+_enabled = False
+_export_path = None
+_exporter = None
+_exporter_stop = threading.Event()
+
+
+def is_enabled():
+    return _enabled
+
+def inc(name, value=1, **labels):
+    """カウンターを増やす。"""
+    if not _enabled: return
+    _registry.inc(name, value, _labels(labels))
+
+def observe(name, seconds, **labels):
+    """所要時間(秒)をヒストグラムに記録する。"""
+    if not _enabled: return
+    _registry.observe(name, seconds, _labels(labels))
+
+
+class _Timer:
+    __slots__ = ('name', 'labels', 'started')
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        _registry.observe(self.name, time.perf_counter() - self.started, self.labels)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+def timer(name, **labels):
+    """with文の範囲の所要時間を記録する。 例: with metrics.timer('stage_seconds', stage='classify'): ..."""
+    if not _enabled: return _NULL_TIMER
+    return _Timer(name, _labels(labels))
+
+def stage(name):
+    """stage_seconds{stage=name} を記録するtimerの省略形。"""
+    if not _enabled: return _NULL_TIMER
+    return _Timer('stage_seconds', (('stage', name),))
+
+
+# --- 有効化と書き出し ---
+def enable(path=None, interval=EXPORT_INTERVAL):
+    """計測を有効にする。pathを指定した場合は、interval秒ごとと無効化時にファイルへ書き出す。"""
+    global _enabled, _export_path, _exporter
+    _enabled = True
+    if not path: return
+    _export_path = path
+    if _exporter is None or not _exporter.is_alive():
+        _exporter_stop.clear()
+        _exporter = threading.Thread(target=_export_loop, args=(interval,), name="metrics-exporter", daemon=True)
+        _exporter.start()
+
+def enable_from_env():
+    """環境変数 MKWORLD_METRICS が設定されていれば、そのパスへの書き出しを有効にする。"""
+    path = os.environ.get(METRICS_ENV)
+    if path: enable(path)
+    return bool(path)
+
+def disable():
+    """計測を無効にし、書き出し先があれば最後の値を書き出す。"""
+    global _enabled, _exporter
+    _enabled = False
+    if _exporter is not None:
+        _exporter_stop.set()
+        _exporter.join(timeout=5)
+        _exporter = None
+    if _export_path: write(_export_path)
+
+def reset():
+    _registry.reset()
+
+def render_prometheus():
+    return _registry.render_prometheus()
+
+def snapshot():
+    return _registry.snapshot()
+
+def write(path):
+    """拡張子が .json ならJSON、それ以外はPrometheus形式で書き出す。一時ファイルに書いてから置き換える。"""
+    if path.lower().endswith('.json'):
+        text = json.dumps(snapshot(), ensure_ascii=False, indent=2) + "\n"
+    else:
+        text = render_prometheus()
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"[metrics] WARNING: メトリクスの書き出しに失敗しました: {e}")
+
+def _export_loop(interval):
+    while not _exporter_stop.wait(interval):
+        write(_export_path)
@@ -0,0 +1,168 @@
+import cv2
+import itertools
+import time
+from datetime import datetime
+
+import analysis
+import frame_store
+import geometry
+import imaging
+import layout
+import metrics
+import ocr
+
+# --- 設定 ---
+MONITORING_INTERVAL = 2
+COURSE_RETRY_WAIT = 10
+PENDING_POLL_INTERVAL = 0.5  # コース名の認識待ちの間に、完了を確認する間隔
+ERROR_WAIT = 5
+SAVE_DETECTED_FRAMES = True  # 検出した画面を data/temp (frame_store) に保存する (解析自体はメモリ上のフレームで行う)
+
+
+class MonitorState:
+    """監視ループの状態 (コース決定画面待ち / リザルト画面待ち) を保持する。"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.current_course_name = None
+        self.pre_race_rate = None
+        self.participant_count = 0
+        self.pending_course = None  # Gemini APIの応答待ちのanalysis.CourseAnalysis
+        self.race_id = None         # コース決定画面を検出したフレームのID (そのレースで保存するフレームの検索に使う)
+
+    @property
+    def waiting_for_course(self):
+        return self.current_course_name is None
+
+
+def normalize_frame(raw_frame):
+    """
+    キャプチャしたフレームを、座標設定の基準である1920x1080のフレームとして扱える形にする。
+    解像度が異なる場合もフレーム全体はリサイズせず、読み取る領域だけを変換する (geometry.MappedFrame)。
+    """
+    return geometry.map_frame(raw_frame)
+
+
+def is_rate_detected_in_list(regions, frame, required=None):
+    """
+    regions (layout.RegionTable) のうち、3桁以上の数字が読み取れた領域の数を返す。
+    requiredに達した時点でOCRを打ち切る。
+    """
+    grays = [cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY) for roi in regions.crops(frame)]
+
+    # 固定フォントのテンプレート照合で確定できた領域はTesseractに渡さない
+    recognizer = ocr.get_digit_recognizer()
+    texts = []
+    pending = []
+    for gray in grays:
+        _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        text, confidence = recognizer.recognize(binary)
+        if text is not None and confidence >= ocr.DIGIT_TEMPLATE_MIN_CONFIDENCE:
+            texts.append(text)
+        else:
+            pending.append(gray)
+
+    if not required or sum(1 for t in texts if len(t) >= 3) < required:
+        engine = ocr.get_engine()
+        if engine.is_resident:
+            # 常駐エンジンでは1領域ずつ認識し、必要数に達したら打ち切る
+            texts = itertools.chain(texts, (engine.recognize(gray, ocr.DIGITS) for gray in pending))
+        else:
+            # プロセス起動を伴う場合は、全領域を1回の呼び出しにまとめる
+            texts += engine.recognize_batch(pending, ocr.DIGITS)
+
+    detected_count = 0
+    for text in texts:
+        if text.isdigit() and len(text) >= 3:
+            detected_count += 1
+            if required is not None and detected_count >= required: break
+    return detected_count
+
+
+def _confirm_rates(regions, frame, required):
+    """画面判定の結果を、数字の読み取りで確定させる (Tesseractによる確認)。"""
+    with metrics.stage('ocr_gate'):
+        return is_rate_detected_in_list(regions, frame, required=required) >= required
+
+
+def save_detected_frame(frame, kind, frame_id, race_id=None):
+    """検出した画面を記録として保存する。解析には使用しないため、解析の後に行う。"""
+    if not SAVE_DETECTED_FRAMES: return
+    # キャプチャした解像度のまま保存する (リプレイ時も同じ座標変換で読める)。書き込みは書き込みスレッドで行う
+    frame_store.get_store().put(kind, frame_id, getattr(frame, 'source', frame), race=race_id)
+
+
+def _apply_course_analysis(state, on_status, elapsed=0.0):
+    pending, state.pending_course = state.pending_course, None
+    rate, course, p_count = pending.result()
+    metrics.observe('course_resolution_seconds', time.monotonic() - pending.started_at)
+
+    if rate is not None and course != "コース不明":
+        state.pre_race_rate = rate
+        state.current_course_name = course
+        state.participant_count = p_count
+        on_status(f"コース:「{course}」({p_count}人) / あなたのレート: {rate} | リザルト画面を待機中...")
+        return MONITORING_INTERVAL
+
+    metrics.inc('ocr_failures_total', field='course' if rate is not None else 'prerace_rate')
+    on_status("コース解析に失敗。再試行します...")
+    # 同じコース決定画面でGemini APIを呼び続けないよう、検出からCOURSE_RETRY_WAIT秒は間を空ける
+    return max(MONITORING_INTERVAL, COURSE_RETRY_WAIT - elapsed) if elapsed else COURSE_RETRY_WAIT
+
+
+def process_frame(frame, state, on_status=print, on_result=None, is_debug_mode=False, frame_id=None, csv_path=None, async_course=True):
+    """
+    normalize_frameで1920x1080基準にしたフレームを1枚解析し、監視状態を進める。
+    戻り値は、次のフレームを取得するまでに待つべき秒数。
+    GUI・キャプチャ手段には依存しないため、ライブ監視とリプレイの両方から使用する。
+    async_courseがTrueの場合、コース名の認識 (Gemini API) を待たずに戻り、
+    以降の呼び出しで完了を確認する。
+    """
+    if frame_id is None:
+        frame_id = datetime.now().strftime('%Y%m%d_%H%M%S')
+
+    if state.pending_course is not None:
+        if not state.pending_course.done(): return PENDING_POLL_INTERVAL
+        return _apply_course_analysis(state, on_status, time.monotonic() - state.pending_course.started_at)
+
+    # 画面の種類を先に安価に判定し、該当する画面の場合のみTesseractで確定させる
+    with metrics.stage('classify'):
+        screen = imaging.classify_screen(frame)
+
+    if state.waiting_for_course:
+        if screen == imaging.SCREEN_COURSE_DECISION and _confirm_rates(layout.get_layout().player_slots, frame, 1):
+            image_name = f"course_screen_{frame_id}.png"
+            metrics.inc('screens_detected_total', screen=screen)
+            on_status("コース決定画面を検出。解析中...")
+            with metrics.stage('course_analysis'):
+                state.pending_course = analysis.start_course_analysis(frame, csv_path, is_debug_mode, image_name)
+            state.race_id = frame_id
+            save_detected_frame(frame, "course_screen", frame_id, state.race_id)
+
+            if not async_course or state.pending_course.done():
+                return _apply_course_analysis(state, on_status)
+            on_status("コース決定画面を検出。コース名を認識中...")
+            return PENDING_POLL_INTERVAL
+    else: # リザルト画面待機中
+        # classify_screenの時点でハイライトの有無は確認済み
+        if screen == imaging.SCREEN_RESULT and _confirm_rates(layout.get_layout().rate, frame, 2):
+            image_name = f"result_screen_{frame_id}.png"
+            metrics.inc('screens_detected_total', screen=screen)
+            on_status("リザルト画面を検出。解析中...")
+            try:
+                with metrics.stage('result_analysis'):
+                    new_result = analysis.process_result_image(frame, state.current_course_name, state.pre_race_rate, state.participant_count, is_debug_mode, csv_path, image_name)
+                save_detected_frame(frame, "result_screen", frame_id, state.race_id)
+                if new_result and on_result: on_result(new_result)
+                state.reset()
+                on_status("監視中 (コース決定画面を待っています)...")
+
+            except Exception as e:
+                on_status(f"解析エラー: {e}")
+                state.reset()
+                import traceback; traceback.print_exc()
+                return ERROR_WAIT + MONITORING_INTERVAL
+
+    return MONITORING_INTERVAL
@@ -1,21 +1,30 @@
 import cv2
-import pytesseract
 import os
 import re
 import numpy as np
-from PIL import Image
-import google.generativeai as genai
+import artifacts
 import config
+import gemini_client
+import imaging
+import metrics
 import configparser
-import tkinter as tk
-from tkinter import simpledialog
+import itertools
+import time
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+# pytesseract・tesserocr・Pillow・google.generativeai・tkinter は読み込みに時間がかかるうえ、
+# 環境によっては存在しないため、使用する関数の中で初めて読み込む。
+# このモジュールの読み込み自体は副作用を持たない (APIキーの入力はinit_api_keyで明示的に行う)。
 
 # --- パス設定 ---
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 PRIVATE_CONFIG_PATH = os.path.join(SCRIPT_DIR, 'private_config.ini')
+DIGIT_TEMPLATE_DIR = os.path.join(SCRIPT_DIR, '..', 'data', 'templates', 'digits')
+QUARANTINE_SUBDIR = 'quarantine'  # 誤学習の疑いがあるテンプレートの移動先 (読み込まない)
 
-def load_or_prompt_api_key():
-    """private_config.iniからAPIキーを読み込む。なければユーザーに尋ねて保存する。"""
+def load_or_prompt_api_key(prompt=True):
+    """private_config.iniからAPIキーを読み込む。なければ (promptがTrueの場合) ユーザーに尋ねて保存する。"""
     config_parser = configparser.ConfigParser()
     
     # ファイルからキーを読み込む試み
@@ -25,8 +34,12 @@ def load_or_prompt_api_key():
             key = config_parser['Gemini']['api_key']
             if key: # キーが空でなければ返す
                 return key
+    if not prompt:
+        return None
 
     # ファイルまたはキーが存在しない場合、ダイアログでユーザーに尋ねる
+    import tkinter as tk
+    from tkinter import simpledialog
     root = tk.Tk()
     root.withdraw() # メインウィンドウを非表示にする
     api_key = simpledialog.askstring("Gemini API Key", "Google AI Studioから取得したAPIキーを入力してください:", show='*')
@@ -43,96 +56,581 @@ def load_or_prompt_api_key():
         return None
 
 # --- Gemini APIの初期設定 ---
-API_KEY = load_or_prompt_api_key()
-
-if API_KEY:
-    try:
-        genai.configure(api_key=API_KEY)
-    except Exception as e:
-        print(f"[ocr] ERROR: Gemini APIキーの設定に失敗しました: {e}")
-        API_KEY = None # 設定に失敗したらキーをNoneに戻す
-
-# (analyze_rank_ocr などの他の関数は変更なし)
-def analyze_rank_ocr(image_path, tesseract_path=None):
-    if tesseract_path and os.path.exists(tesseract_path):
-        pytesseract.pytesseract.tesseract_cmd = tesseract_path
-    
-    roi = cv2.imread(image_path)
+API_KEY = None
+_api_key_initialized = False
+_api_key_lock = threading.Lock()
+
+def init_api_key(prompt=True):
+    """
+    APIキーを読み込み、Gemini APIに設定する。GUIアプリは起動時に呼び出す (キーがなければダイアログで尋ねる)。
+    呼び出さずにコース名を認識した場合は、private_config.iniにキーがあればそれを使う (ダイアログは表示しない)。
+    """
+    global API_KEY, _api_key_initialized
+    with _api_key_lock:
+        key = load_or_prompt_api_key(prompt)
+        if key:
+            try:
+                import google.generativeai as genai
+                genai.configure(api_key=key)
+            except Exception as e:
+                print(f"[ocr] ERROR: Gemini APIキーの設定に失敗しました: {e}")
+                key = None # 設定に失敗したらキーをNoneに戻す
+        API_KEY = key
+        _api_key_initialized = True
+        return API_KEY
+
+DIGITS = "0123456789"
+SIGNED_DIGITS = "+-0123456789"
+BATCH_ROW_GAP = 20
+FIELD_OCR_WORKERS = 3      # 1画面の複数項目を並行に読み取るスレッド数
+FIELD_OCR_DEADLINE = 10.0  # 1画面の全項目の読み取りに許す秒数
+MAX_RESIDENT_ENGINES = FIELD_OCR_WORKERS + 1  # 常駐させるエンジン (言語モデル) の数の上限
+
+
+class TesseractEngine:
+    """
+    言語モデルを一度だけ読み込んで常駐させるTesseractエンジン。
+    tesserocrが利用可能な場合はC APIを介してプロセス内に常駐させる。
+    利用できない場合はpytesseractを使い、recognize_batchでは複数のROIを
+    縦に並べた1枚の画像として1回の呼び出しで認識することで、起動コストをまとめる。
+    """
+
+    def __init__(self, lang='eng', tesseract_path=None):
+        self.lang = lang
+        self._lock = threading.Lock()
+        self._api = None
+        if tesseract_path and os.path.exists(tesseract_path):
+            import pytesseract
+            pytesseract.pytesseract.tesseract_cmd = tesseract_path
+        try:
+            import tesserocr
+        except ImportError:
+            tesserocr = None
+        if tesserocr is not None:
+            tessdata = os.path.join(os.path.dirname(tesseract_path), 'tessdata') if tesseract_path else None
+            try:
+                kwargs = {'lang': lang, 'psm': tesserocr.PSM.SINGLE_LINE, 'oem': tesserocr.OEM.LSTM_ONLY}
+                if tessdata and os.path.isdir(tessdata): kwargs['path'] = tessdata
+                self._api = tesserocr.PyTessBaseAPI(**kwargs)
+            except RuntimeError as e:
+                print(f"[ocr] WARNING: tesserocrの初期化に失敗したため、pytesseractを使用します: {e}")
+
+    @property
+    def is_resident(self):
+        return self._api is not None
+
+    def recognize(self, image, whitelist=DIGITS):
+        """1行のテキストが写ったグレースケール画像を認識する。"""
+        if self._api is not None:
+            with self._lock:
+                return self._recognize_resident(image, whitelist)
+        import pytesseract
+        config_str = f'--oem 1 --psm 7 -c tessedit_char_whitelist="{whitelist}"'
+        return pytesseract.image_to_string(image, lang=self.lang, config=config_str).strip()
+
+    def recognize_batch(self, images, whitelist=DIGITS):
+        """複数の1行画像をまとめて認識し、入力と同じ順序で文字列のリストを返す。"""
+        if not images: return []
+        if self._api is not None:
+            with self._lock:
+                return [self._recognize_resident(image, whitelist) for image in images]
+        return self._recognize_stitched(images, whitelist)
+
+    def _recognize_resident(self, image, whitelist):
+        h, w = image.shape[:2]
+        image = np.ascontiguousarray(image)
+        self._api.SetVariable("tessedit_char_whitelist", whitelist)
+        self._api.SetImageBytes(image.tobytes(), w, h, 1, w)
+        return self._api.GetUTF8Text().strip()
+
+    def _recognize_stitched(self, images, whitelist):
+        import pytesseract
+        # 各ROIを同じ高さの行に収め、背景色で埋めた余白を挟んで縦に連結する
+        row_h = max(img.shape[0] for img in images) + BATCH_ROW_GAP
+        width = max(img.shape[1] for img in images) + BATCH_ROW_GAP * 2
+        rows = []
+        for img in images:
+            h, w = img.shape[:2]
+            top = (row_h - h) // 2
+            rows.append(cv2.copyMakeBorder(img, top, row_h - h - top, BATCH_ROW_GAP, width - w - BATCH_ROW_GAP, cv2.BORDER_REPLICATE))
+        strip = np.vstack(rows)
+
+        config_str = f'--oem 1 --psm 6 -c tessedit_char_whitelist="{whitelist}"'
+        data = pytesseract.image_to_data(strip, lang=self.lang, config=config_str, output_type=pytesseract.Output.DICT)
+
+        # 単語の縦方向の中心位置から、どのROIに属するかを割り当てる
+        words = [[] for _ in images]
+        for text, left, top, height in zip(data['text'], data['left'], data['top'], data['height']):
+            text = text.strip()
+            if not text: continue
+            idx = int((top + height / 2) // row_h)
+            if 0 <= idx < len(images): words[idx].append((left, text))
+        return ["".join(text for _, text in sorted(row)) for row in words]
+
+    def close(self):
+        if self._api is not None:
+            self._api.End()
+            self._api = None
+
+
+class EnginePool:
+    """
+    TesseractEngineの上限付きのプール。TesseractEngineと同じ recognize / recognize_batch を持ち、
+    呼び出しごとに空いているエンジンを借りて返す。tesserocrの常駐エンジンは同時に1スレッドしか
+    使えず、1つごとに言語モデルを読み込むため、必要になった時点で max_engines 個まで生成し、
+    全て使用中の場合は空くまで待つ。pytesseractの場合はプロセスを起動するだけなので1つを共有する。
+    """
+
+    def __init__(self, tesseract_path=None, max_engines=MAX_RESIDENT_ENGINES, factory=None):
+        self.tesseract_path = tesseract_path
+        self.max_engines = max(1, max_engines)
+        self._factory = factory or (lambda: TesseractEngine(tesseract_path=self.tesseract_path))
+        self._condition = threading.Condition()
+        self._idle = [self._factory()]
+        self._created = 1
+        self._shared = self._idle[0]  # pytesseractの場合に全スレッドで共有するエンジン
+        self.is_resident = self._shared.is_resident
+
+    def _acquire(self):
+        with self._condition:
+            while not self._idle:
+                if self._created < self.max_engines:
+                    self._created += 1
+                    break
+                self._condition.wait()
+            else:
+                return self._idle.pop()
+        try:
+            return self._factory()
+        except Exception:
+            with self._condition:
+                self._created -= 1
+                self._condition.notify()
+            raise
+
+    def _release(self, engine):
+        with self._condition:
+            self._idle.append(engine)
+            self._condition.notify()
+
+    def _call(self, method, *args):
+        if not self.is_resident:
+            return getattr(self._shared, method)(*args)
+        engine = self._acquire()
+        try:
+            return getattr(engine, method)(*args)
+        finally:
+            self._release(engine)
+
+    def recognize(self, image, whitelist=DIGITS):
+        return self._call('recognize', image, whitelist)
+
+    def recognize_batch(self, images, whitelist=DIGITS):
+        return self._call('recognize_batch', images, whitelist)
+
+    def reserve(self, max_engines):
+        """同時に読み取るスレッドが増える場合に、エンジン数の上限を引き上げる。"""
+        with self._condition:
+            self.max_engines = max(self.max_engines, max_engines)
+            self._condition.notify_all()
+
+    @property
+    def size(self):
+        """生成済みのエンジンの数。"""
+        return self._created
+
+    def close(self):
+        """使用中でないエンジンを全て閉じる (使用中のものは返却を待ってから閉じる)。"""
+        with self._condition:
+            while len(self._idle) < self._created:
+                self._condition.wait()
+            for engine in self._idle:
+                engine.close()
+            self._idle.clear()
+            self._created = 0
+
+
+_engine = None
+_engine_lock = threading.Lock()
+_engine_tesseract_path = None
+
+def get_engine(tesseract_path=None, max_engines=None):
+    """
+    プロセス全体で共有するEnginePoolを返す。初回呼び出し時に生成し、使用するTesseractの実行方法を表示する。
+    max_engines: 同時に読み取るスレッド数に合わせたエンジン数の上限 (既定: MAX_RESIDENT_ENGINES)
+    """
+    global _engine, _engine_tesseract_path
+    with _engine_lock:
+        if tesseract_path: _engine_tesseract_path = tesseract_path
+        if _engine is None:
+            _engine = EnginePool(_engine_tesseract_path, max_engines=max_engines or MAX_RESIDENT_ENGINES)
+            if _engine.is_resident:
+                print(f"[ocr] Tesseractの実行方法: tesserocr (言語モデルを常駐、最大{_engine.max_engines}個)")
+            else:
+                print("[ocr] WARNING: Tesseractの実行方法: pytesseract (読み取りごとにプロセスを起動するため低速です。tesserocrを導入してください)")
+        elif max_engines:
+            _engine.reserve(max_engines)
+        return _engine
+
+def close_engines():
+    """共有のEnginePoolのエンジンを閉じる (終了時に呼ぶ)。次にget_engineを呼ぶと作り直す。"""
+    global _engine
+    with _engine_lock:
+        engine, _engine = _engine, None
+    if engine is not None: engine.close()
+
+
+_field_executor = None
+
+def read_fields(tasks, deadline=FIELD_OCR_DEADLINE):
+    """
+    {項目名: (関数, 引数...)} の読み取りを並行に実行し、{項目名: 結果} を返す。
+    全項目で1つの期限を共有し、期限内に終わらなかった項目や例外が発生した項目はNoneになる。
+    """
+    return collect_fields(submit_fields(tasks), deadline)
+
+def submit_fields(tasks):
+    """read_fieldsの読み取りを開始し、{項目名: Future} を返す。待つ間に別の処理を行う場合に使う。"""
+    global _field_executor
+    with _engine_lock:
+        if _field_executor is None:
+            _field_executor = ThreadPoolExecutor(max_workers=FIELD_OCR_WORKERS, thread_name_prefix="field-ocr")
+    return {name: _field_executor.submit(func, *args) for name, (func, *args) in tasks.items()}
+
+def collect_fields(futures, deadline=FIELD_OCR_DEADLINE):
+    """read_fieldsと同じ規則で、{項目名: Future} の結果を期限まで待って集める。"""
+    done, _ = wait(futures.values(), timeout=deadline)
+    results = {}
+    for name, future in futures.items():
+        if future not in done:
+            print(f"[ocr] WARNING: '{name}' の読み取りが{deadline:.0f}秒以内に終わりませんでした。")
+            results[name] = None
+        elif future.exception() is not None:
+            print(f"[ocr] ERROR: '{name}' の読み取りに失敗しました: {future.exception()}")
+            results[name] = None
+        else:
+            results[name] = future.result()
+    return results
+
+GLYPH_SIZE = (16, 24)  # (幅, 高さ)
+MAX_TEMPLATES_PER_LABEL = 5
+DIGIT_TEMPLATE_MIN_CONFIDENCE = 0.8
+DIGIT_TEMPLATE_MIN_MARGIN = 0.1  # 各文字で、最良のラベルと次点のラベルの相関に求める差
+DIGIT_TEMPLATE_CONFLICT_SCORE = 0.95  # 確定した文字とこれ以上の相関を持つ別の文字のテンプレートは誤学習とみなす
+SIGN_LABELS = {'+': 'plus', '-': 'minus'}
+MAX_PENDING_READS = 32           # 確認待ちのTesseractの読み取り結果を保持する件数
+
+# 読み取った値として妥当な範囲 (範囲外の値はテンプレートの学習に使わない)
+RANK_RANGE = (1, 24)
+RATE_RANGE = (0, 10000)
+RATE_CHANGE_RANGE = (-500, 500)
+
+
+class DigitTemplateRecognizer:
+    """
+    ゲーム内の固定フォントで描かれた数字を、保存済みの文字テンプレートとの相関で認識する。
+    列方向の投影で文字を切り出し、全文字と全テンプレートの正規化相関を1回の行列積で求める。
+    テンプレートはTesseractの読み取り結果のうち、別の読み取りやレートの増減と整合したものから学習し、
+    DIGIT_TEMPLATE_DIRに保存する。項目で使う全ての文字のテンプレートが揃うまでは認識に使わない。
+    """
+
+    def __init__(self, template_dir=DIGIT_TEMPLATE_DIR):
+        self.template_dir = template_dir
+        self._lock = threading.Lock()
+        self._labels = []
+        self._paths = []
+        self._vectors = np.zeros((0, GLYPH_SIZE[0] * GLYPH_SIZE[1]), dtype=np.float32)
+        self._pending = {}  # 読み取りの名前 -> (二値画像, テキスト)
+        self._load_templates()
+
+    def _load_templates(self):
+        if not os.path.isdir(self.template_dir): return
+        for filename in sorted(os.listdir(self.template_dir)):
+            if not filename.endswith('.png'): continue
+            label = filename.split('_')[0]
+            label = {v: k for k, v in SIGN_LABELS.items()}.get(label, label)
+            path = os.path.join(self.template_dir, filename)
+            glyph = artifacts.read_image(path, cv2.IMREAD_GRAYSCALE)
+            if glyph is None or len(label) != 1: continue
+            self._add(label, glyph, path)
+
+    def _add(self, label, glyph, path):
+        self._labels.append(label)
+        self._paths.append(path)
+        self._vectors = np.vstack([self._vectors, _normalize_glyph_vector(glyph)])
+
+    def _quarantine(self, index):
+        """テンプレートを認識に使わないようにし、ファイルは削除せずquarantineフォルダへ移す。"""
+        path = self._paths.pop(index)
+        del self._labels[index]
+        self._vectors = np.delete(self._vectors, index, axis=0)
+        folder = os.path.join(self.template_dir, QUARANTINE_SUBDIR)
+        stem, ext = os.path.splitext(os.path.basename(path))
+        try:
+            os.makedirs(folder, exist_ok=True)
+            for n in itertools.count():
+                target = os.path.join(folder, f"{stem}.{n}{ext}")
+                if not os.path.exists(target): break
+            os.replace(path, target)
+        except OSError as e:
+            print(f"[ocr] WARNING: テンプレートを移動できませんでした: {path} ({e})")
+
+    def _new_path(self, label):
+        used = set(self._paths)
+        for n in itertools.count():
+            path = os.path.join(self.template_dir, f"{SIGN_LABELS.get(label, label)}_{n}.png")
+            if path not in used: return path
+
+    @property
+    def has_templates(self):
+        return bool(self._labels)
+
+    def is_complete(self, alphabet):
+        """alphabetの全ての文字にテンプレートがあるかを返す。"""
+        return set(alphabet) <= set(self._labels)
+
+    def recognize(self, binary, signed=False):
+        """
+        二値画像の文字列を認識し、(テキスト, 信頼度) を返す。
+        信頼度は各文字の最良相関のうち最小のもの。項目で使う文字のテンプレートが揃っていない場合や、
+        いずれかの文字で次点の文字との相関の差がDIGIT_TEMPLATE_MIN_MARGIN未満の場合は (None, 0.0)。
+        """
+        text, confidence, margin = self._match(binary, SIGNED_DIGITS if signed else DIGITS, require_complete=True)
+        if text is None or margin < DIGIT_TEMPLATE_MIN_MARGIN: return None, 0.0
+
+        pattern = r'^[+\-]\d+$' if signed else r'^\d+$'
+        if not re.match(pattern, text): return None, 0.0
+        return text, confidence
+
+    def _match(self, binary, alphabet, require_complete):
+        """各文字を最も相関の高い文字に割り当て、(テキスト, 最小の最良相関, 最小の次点との差) を返す。"""
+        glyphs = segment_glyphs(binary)
+        if not glyphs: return None, 0.0, 0.0
+
+        with self._lock:
+            labels = [label for label in alphabet if label in self._labels]
+            if not labels or (require_complete and len(labels) < len(alphabet)): return None, 0.0, 0.0
+            scores = np.stack([_normalize_glyph_vector(g) for g in glyphs]) @ self._vectors.T
+            owners = np.array(self._labels)
+        # 文字ごとに、各ラベルのテンプレートのうち最も高い相関を求める
+        label_scores = np.stack([scores[:, owners == label].max(axis=1) for label in labels], axis=1)
+        order = np.argsort(label_scores, axis=1)
+        best = order[:, -1]
+        rows = np.arange(len(glyphs))
+        text = "".join(labels[i] for i in best)
+        confidence = float(np.min(label_scores[rows, best]))
+        margin = float(np.min(label_scores[rows, best] - label_scores[rows, order[:, -2]])) if len(labels) > 1 else 1.0
+        return text, confidence, margin
+
+    def agrees(self, binary, text, signed=False):
+        """
+        テンプレートのみで読んだ結果がtextと一致するかを返す (Tesseractとは別の読み取りとして使う)。
+        recognizeと異なり次点との差は問わないが、テンプレートが揃っていない場合は一致とみなさない。
+        """
+        guess, confidence, _ = self._match(binary, SIGNED_DIGITS if signed else DIGITS, require_complete=True)
+        return guess == text and confidence >= DIGIT_TEMPLATE_MIN_CONFIDENCE
+
+    def hold(self, name, binary, text):
+        """確認待ちの読み取り結果を保持する。confirmされなかったものは古い順に捨てる。"""
+        with self._lock:
+            self._pending.pop(name, None)
+            self._pending[name] = (binary, text)
+            while len(self._pending) > MAX_PENDING_READS:
+                del self._pending[next(iter(self._pending))]
+
+    def confirm(self, name, text):
+        """保持している読み取り結果のテキストがtextと一致すれば、そこからテンプレートを学習する。"""
+        with self._lock:
+            held = self._pending.pop(name, None)
+        if held is not None and held[1] == text:
+            self.learn(*held)
+
+    def learn(self, binary, text):
+        """
+        確定したテキストと文字の切り出し結果が一致する場合、不足しているテンプレートを追加する。
+        確定した文字とほぼ同一の、別の文字のテンプレートがある場合は、どちらが正しいか判断できないため、
+        そのテンプレートを隔離 (quarantineフォルダへ移動) し、今回の文字も学習しない。
+        """
+        glyphs = segment_glyphs(binary)
+        if len(glyphs) != len(text): return
+        with self._lock:
+            for label, glyph in zip(text, glyphs):
+                if self._labels:
+                    scores = self._vectors @ _normalize_glyph_vector(glyph)
+                    wrong = [i for i, score in enumerate(scores)
+                             if self._labels[i] != label and score >= DIGIT_TEMPLATE_CONFLICT_SCORE]
+                    for i in reversed(wrong):
+                        print(f"[ocr] WARNING: '{label}' と一致した '{self._labels[i]}' のテンプレートを隔離します。")
+                        self._quarantine(i)
+                    if wrong: continue
+                if self._labels.count(label) >= MAX_TEMPLATES_PER_LABEL: continue
+                path = self._new_path(label)
+                if artifacts.write_image(path, glyph):
+                    self._add(label, glyph, path)
+
+
+def segment_glyphs(binary):
+    """
+    二値画像を列方向に投影し、文字ごとの画像に切り出す。
+    文字の高さは行全体で揃え、マイナス記号などの形が正規化で崩れないようにする。
+    """
+    ink = binary > 127
+    # 文字部分が少数派になるよう、背景の方が明るい場合は反転して扱う
+    if np.count_nonzero(ink) > ink.size // 2: ink = ~ink
+    rows = np.flatnonzero(ink.any(axis=1))
+    if rows.size == 0: return []
+    ink = ink[rows[0]:rows[-1] + 1]
+
+    columns = ink.any(axis=0).astype(np.int8)
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], columns, [0]))))
+    glyphs = []
+    for x1, x2 in zip(edges[::2], edges[1::2]):
+        glyph = ink[:, x1:x2]
+        if np.count_nonzero(glyph) < 4: continue  # ノイズ
+        glyphs.append(cv2.resize(glyph.astype(np.uint8) * 255, GLYPH_SIZE, interpolation=cv2.INTER_AREA))
+    return glyphs
+
+def _normalize_glyph_vector(glyph):
+    vector = glyph.astype(np.float32).ravel()
+    vector -= vector.mean()
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+_digit_recognizer = None
+
+def get_digit_recognizer():
+    """プロセス全体で共有するDigitTemplateRecognizerを返す。"""
+    global _digit_recognizer
+    with _engine_lock:
+        if _digit_recognizer is None:
+            _digit_recognizer = DigitTemplateRecognizer()
+        return _digit_recognizer
+
+def read_digits(binary, label, signed=False, tesseract_path=None, value_range=None):
+    """
+    数字の二値画像を読み取る。テンプレート照合で確定できれば結果をそのまま使い、
+    できない場合のみTesseractで読み取る。Tesseractの結果は、値がvalue_rangeの範囲内で、
+    テンプレートでの読み取りと一致すれば学習に使う。一致しない場合はlabelの名前で保持し、
+    confirm_digitsで別の根拠 (レートの増減など) により確認されてから学習に使う。
+    """
+    recognizer = get_digit_recognizer()
+    text, confidence = recognizer.recognize(binary, signed)
+    if text is not None and confidence >= DIGIT_TEMPLATE_MIN_CONFIDENCE:
+        print(f"[ocr] DEBUG: Template Text ('{label}') = '{text}' (confidence: {confidence:.2f})")
+        return text
+
+    text = get_engine(tesseract_path).recognize(binary, SIGNED_DIGITS if signed else DIGITS)
+    print(f"[ocr] DEBUG: OCR Raw Text ('{label}') = '{text}'")
+    if re.match(r'^[+\-]\d+$' if signed else r'^\d+$', text) and _in_range(int(text), value_range):
+        if recognizer.agrees(binary, text, signed):
+            recognizer.learn(binary, text)
+        else:
+            recognizer.hold(label, binary, text)
+    return text
+
+def confirm_digits(readings):
+    """
+    {読み取りの名前: テキスト} を、別の根拠で正しいと確認できた読み取りとして登録する。
+    read_digitsで保持していたTesseractの結果のうち、テキストが一致するものからテンプレートを学習する。
+    """
+    recognizer = get_digit_recognizer()
+    for name, text in readings.items():
+        recognizer.confirm(name, text)
+
+def _in_range(value, value_range):
+    return value_range is None or value_range[0] <= value <= value_range[1]
+
+def _roi_label(image, label):
+    if label: return label
+    return os.path.basename(image) if isinstance(image, str) else "roi"
+
+def analyze_rank_ocr(image, tesseract_path=None, label=None):
+    roi = imaging.load_image(image)
     if roi is None: return None
     
     gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
     _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
 
-    config_str = f'--oem 1 --psm 7 -c tessedit_char_whitelist="0123456789"'
-    text = pytesseract.image_to_string(binary, lang='eng', config=config_str).strip()
-    
-    print(f"[ocr] DEBUG: OCR Raw Text ('{os.path.basename(image_path)}') = '{text}'")
+    text = read_digits(binary, _roi_label(image, label), tesseract_path=tesseract_path, value_range=RANK_RANGE)
     return int(text) if text and text.isdigit() else None
 
-def analyze_rate_ocr(image_path, tesseract_path=None):
-    if tesseract_path and os.path.exists(tesseract_path):
-        pytesseract.pytesseract.tesseract_cmd = tesseract_path
-
-    roi = cv2.imread(image_path)
+def analyze_rate_ocr(image, tesseract_path=None, label=None):
+    roi = imaging.load_image(image)
     if roi is None: return None
     
     gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
     _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
 
-    config_str = f'--oem 1 --psm 7 -c tessedit_char_whitelist="0123456789"'
-    text = pytesseract.image_to_string(binary, lang='eng', config=config_str).strip()
-    
-    print(f"[ocr] DEBUG: OCR Raw Text ('{os.path.basename(image_path)}') = '{text}'")
+    text = read_digits(binary, _roi_label(image, label), tesseract_path=tesseract_path, value_range=RATE_RANGE)
     return int(text) if text and text.isdigit() else None
 
-def analyze_rate_change_ocr(image_path, tesseract_path=None):
-    if tesseract_path and os.path.exists(tesseract_path):
-        pytesseract.pytesseract.tesseract_cmd = tesseract_path
-
-    roi = cv2.imread(image_path)
+def analyze_rate_change_ocr(image, tesseract_path=None, label=None):
+    roi = imaging.load_image(image)
     if roi is None: return 0
     gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
     
     inverted = cv2.bitwise_not(gray)
     _, binary = cv2.threshold(inverted, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
     
-    config_str = f'--oem 1 --psm 7 -c tessedit_char_whitelist="+-0123456789"'
-    text = pytesseract.image_to_string(binary, lang='eng', config=config_str).strip()
-    
-    print(f"[ocr] DEBUG: OCR Raw Text ('{os.path.basename(image_path)}') = '{text}'")
+    text = read_digits(binary, _roi_label(image, label), signed=True, tesseract_path=tesseract_path, value_range=RATE_CHANGE_RANGE)
     if text and re.match(r'^[+\-]\d+$', text): return int(text)
     return 0 
 
-def analyze_course_ocr(image_path):
+COURSE_PROMPT = (
+    "これはレースゲームのコース選択画面の画像です。"
+    "以下の『コース名リスト』の中から、画像に表示されているコース名を**一つだけ**正確に選び出し、そのテキストだけを返してください。"
+    "リストにない名前は絶対に回答しないでください。\n\n"
+    "--- コース名リスト ---\n"
+    f"{', '.join(config.COURSE_NAMES)}"
+)
+
+def submit_course_ocr(image, label=None):
+    """
+    コース名の認識をバックグラウンドで開始し、認識結果の文字列を返すFutureを返す。
+    FutureはGeminiClientの期限内に完了し、失敗した場合も例外ではなく「コース不明 (...)」を返す。
+    """
+    result = Future()
+    if not _api_key_initialized:
+        init_api_key(prompt=False)
     if not API_KEY:
         print("[ocr] WARNING: Gemini APIキーが設定されていません。コース名認識をスキップします。")
-        return "コース不明 (APIキー未設定)"
+        result.set_result("コース不明 (APIキー未設定)")
+        return result
         
-    if not os.path.exists(image_path):
-        print(f"[ocr] ERROR: 画像ファイルが見つかりません: {image_path}")
-        return "コース不明 (ファイルなし)"
+    if isinstance(image, str) and not os.path.exists(image):
+        print(f"[ocr] ERROR: 画像ファイルが見つかりません: {image}")
+        result.set_result("コース不明 (ファイルなし)")
+        return result
 
-    try:
-        model = genai.GenerativeModel("gemini-2.5-flash")
-        img = Image.open(image_path)
-        
-        course_list_str = ", ".join(config.COURSE_NAMES)
-
-        prompt = (
-            "これはレースゲームのコース選択画面の画像です。"
-            "以下の『コース名リスト』の中から、画像に表示されているコース名を**一つだけ**正確に選び出し、そのテキストだけを返してください。"
-            "リストにない名前は絶対に回答しないでください。\n\n"
-            "--- コース名リスト ---\n"
-            f"{course_list_str}"
-        )
-        
-        response = model.generate_content([prompt, img])
-        text = response.text.strip().replace(" ", "").replace("\n", "")
-        
-        print(f"[ocr] DEBUG: Gemini API Raw Text ('{os.path.basename(image_path)}') = '{text}'")
-        
-        return text if text else "コース不明"
+    from PIL import Image
+    if isinstance(image, str):
+        img = Image.open(image)
+    else:
+        img = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+
+    started = time.perf_counter()
+
+    def on_done(future):
+        try:
+            text = future.result().strip().replace(" ", "").replace("\n", "")
+        except gemini_client.CircuitOpenError as e:
+            print(f"[ocr] WARNING: {e} コース名認識をスキップします。")
+            metrics.inc('ocr_failures_total', field='course_gemini')
+            result.set_result("コース不明 (APIエラー)")
+            return
+        except Exception as e:
+            print(f"[ocr] ERROR: Gemini APIの呼び出し中にエラーが発生しました: {e}")
+            metrics.observe('gemini_request_seconds', time.perf_counter() - started, outcome='error')
+            metrics.inc('ocr_failures_total', field='course_gemini')
+            result.set_result("コース不明 (APIエラー)")
+            return
+        metrics.observe('gemini_request_seconds', time.perf_counter() - started, outcome='ok')
+        print(f"[ocr] DEBUG: Gemini API Raw Text ('{_roi_label(image, label)}') = '{text}'")
+        result.set_result(text if text else "コース不明")
+
+    gemini_client.get_client().submit([COURSE_PROMPT, img]).add_done_callback(on_done)
+    return result
 
-    except Exception as e:
-        print(f"[ocr] ERROR: Gemini APIの呼び出し中にエラーが発生しました: {e}")
-        return "コース不明 (APIエラー)"
\ No newline at end of file
+def analyze_course_ocr(image, label=None):
+    return submit_course_ocr(image, label).result()
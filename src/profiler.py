@@ -0,0 +1,165 @@
+"""
+監視処理を実行しているスレッドのスタックを一定間隔で読み取り (サンプリング)、
+どこで時間を使っているかを調べる。指定した秒数だけ動作し、関数ごとの集計 (テキスト) と、
+flamegraph.pl や speedscope で読める collapsed stack 形式のファイルを data/debug に書き出す。
+
+サンプリングは別スレッドからスタックを読むだけなので、監視の状態機械には手を加えない。
+プロファイル中でなければスレッド自体が存在しないため、負荷はかからない。
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+# --- パス設定 ---
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEBUG_DIR = os.path.join(SCRIPT_DIR, '..', 'data', 'debug')
+
+# --- 設定 ---
+SAMPLE_INTERVAL = 0.005        # スタックを読み取る間隔(秒)
+DEFAULT_DURATION = 30          # プロファイルする秒数
+TARGET_THREAD_PREFIXES = ("session_", "field-ocr_")  # 監視処理を実行するスレッドプールのスレッド名の接頭辞
+REPORT_TOP = 40                # 集計に表示する関数の数
+# 処理を待っているだけのスレッドプールのスレッド (最も内側の関数が次の処理を待っている) は記録しない
+IDLE_FRAMES = {('thread.py', '_worker')}
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """
+    対象のスレッドのスタックをinterval秒ごとに記録する。
+    thread_prefixesに一致する名前のスレッド (と、include_mainがTrueならメインスレッド) を対象にする。
+    """
+
+    def __init__(self, duration=DEFAULT_DURATION, interval=SAMPLE_INTERVAL, thread_prefixes=TARGET_THREAD_PREFIXES,
+                 include_main=False, output_dir=DEBUG_DIR, on_finished=None):
+        self.duration = duration
+        self.interval = interval
+        self.thread_prefixes = tuple(thread_prefixes)
+        self.include_main = include_main
+        self.output_dir = output_dir
+        self.on_finished = on_finished
+        self.stacks = Counter()   # (スレッド名, 関数, ...) -> サンプル数
+        self.samples = 0
+        self.paths = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._started_at = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        self._started_at = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """予定の秒数を待たずに終了させる。結果は終了時に書き出される。"""
+        self._stop.set()
+
+    def join(self, timeout=None):
+        if self._thread is not None: self._thread.join(timeout)
+        return self.paths
+
+    def _targets(self):
+        main_ident = threading.main_thread().ident
+        targets = {}
+        for thread in threading.enumerate():
+            if thread.ident == main_ident and self.include_main:
+                targets[thread.ident] = thread.name
+            elif thread.name.startswith(self.thread_prefixes):
+                targets[thread.ident] = thread.name
+        return targets
+
+    def _run(self):
+        deadline = self._started_at + self.duration
+        targets, refreshed_at = {}, 0.0
+        try:
+            while not self._stop.is_set() and time.monotonic() < deadline:
+                now = time.monotonic()
+                if now - refreshed_at >= 1.0:
+                    # スレッドプールのスレッドは後から増えるため、対象の一覧を定期的に更新する
+                    targets, refreshed_at = self._targets(), now
+                for ident, frame in sys._current_frames().items():
+                    name = targets.get(ident)
+                    if name is None or (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name) in IDLE_FRAMES: continue
+                    stack = []
+                    while frame is not None:
+                        stack.append(_frame_label(frame))
+                        frame = frame.f_back
+                    stack.append(name)
+                    self.stacks[tuple(reversed(stack))] += 1
+                self.samples += 1
+                self._stop.wait(self.interval)
+            self.paths = self.write()
+        except Exception as e:
+            print(f"[profiler] ERROR: プロファイルの記録に失敗しました: {e}")
+        finally:
+            if self.on_finished: self.on_finished(self)
+
+    # --- 書き出し ---
+    def collapsed(self):
+        """collapsed stack 形式 (「スレッド;呼び出し元;...;関数 サンプル数」) の行の一覧。"""
+        return [f"{';'.join(stack)} {count}" for stack, count in sorted(self.stacks.items())]
+
+    def report(self):
+        """関数ごとの自身のサンプル数 (self) と、呼び出し先を含むサンプル数 (total) の集計。"""
+        total_samples = sum(self.stacks.values())
+        own, inclusive = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for label in set(stack[1:]):
+                inclusive[label] += count
+        elapsed = time.monotonic() - self._started_at if self._started_at else 0.0
+
+        lines = [
+            f"# 監視スレッドのプロファイル ({datetime.now().strftime('%Y-%m-%d %H:%M:%S')})",
+            f"# 期間: {elapsed:.1f}秒 / 間隔: {self.interval * 1000:.0f}ms / 記録回数: {self.samples} / スタック数: {total_samples}",
+            f"# スレッド: {', '.join(sorted({stack[0] for stack in self.stacks})) or '(なし)'}",
+            "",
+        ]
+        if not total_samples:
+            lines.append("対象のスレッドが見つかりませんでした (監視中に実行してください)。")
+            return "\n".join(lines) + "\n"
+
+        for title, counter in (("自身の処理時間が長い順 (self)", own), ("呼び出し先を含む処理時間が長い順 (total)", inclusive)):
+            lines.append(f"## {title}")
+            lines.append(f"{'total%':>7} {'self%':>7}  関数")
+            for label, _ in counter.most_common(REPORT_TOP):
+                lines.append(f"{inclusive[label] / total_samples:7.1%} {own[label] / total_samples:7.1%}  {label}")
+            lines.append("")
+        return "\n".join(lines) + "\n"
+
+    def write(self):
+        """集計と collapsed stack を書き出し、(集計のパス, collapsed stackのパス) を返す。"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        base = os.path.join(self.output_dir, f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+        with open(base + '.txt', 'w', encoding='utf-8') as f:
+            f.write(self.report())
+        with open(base + '.folded', 'w', encoding='utf-8') as f:
+            f.write("\n".join(self.collapsed()) + "\n")
+        return base + '.txt', base + '.folded'
+
+
+_active = None
+_active_lock = threading.Lock()
+
+def profile_for(duration=DEFAULT_DURATION, **kwargs):
+    """
+    プロファイルをduration秒間行う。結果はon_finished (指定した場合) で受け取れる。
+    既に実行中の場合はNoneを返す。
+    """
+    global _active
+    with _active_lock:
+        if _active is not None and _active.running: return None
+        _active = SamplingProfiler(duration, **kwargs).start()
+        return _active
@@ -0,0 +1,251 @@
+"""
+録画済みの動画ファイル、またはスクリーンショットを並べたフォルダを入力として、
+監視ループの状態機械 (コース決定画面待ち → リザルト画面待ち → 結果保存) を
+GUIなしで実行する。実時間の待機は行わず、動画上の時間を進めて処理するため、
+CPUが許す限りの速度で解析できる。
+
+使い方:
+    python src/replay.py <動画ファイル or フォルダ> [--csv 出力CSV [--append]] [--interval 秒]
+    python src/replay.py <ソース1> <ソース2> ... [--streams N] [--workers N]  (複数ストリームの並行処理)
+"""
+import argparse
+import math
+import os
+import time
+from collections import Counter
+from datetime import datetime
+
+import cv2
+
+import artifacts
+import layout
+import metrics
+import monitor
+import profiler
+import session
+
+# --- パス設定 ---
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+REPLAY_OUTPUT_DIR = os.path.join(SCRIPT_DIR, '..', 'data', 'output')
+
+# --- 設定 ---
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+
+
+class VideoFrameSource:
+    """動画ファイルから、動画上の指定時刻のフレームを順に取り出す。"""
+
+    def __init__(self, path):
+        self.name = os.path.basename(path)
+        self.cap = cv2.VideoCapture(path)
+        if not self.cap.isOpened():
+            raise IOError(f"動画ファイルを開けません: {path}")
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 30.0
+        self.position = -1
+
+    def read_at(self, seconds):
+        """指定時刻以降の最初のフレームを返す。動画の終端に達した場合はNone。"""
+        target = max(self.position + 1, math.ceil(seconds * self.fps))
+        # 不要なフレームはgrab()のみで読み飛ばし、色変換を省く
+        while self.position < target - 1:
+            if not self.cap.grab(): return None
+            self.position += 1
+        ret, frame = self.cap.read()
+        if not ret: return None
+        self.position += 1
+        return frame
+
+    def release(self):
+        self.cap.release()
+
+
+class ImageFolderSource:
+    """フォルダ内の画像を、frame_interval秒間隔で撮影された連続フレームとして扱う。"""
+
+    def __init__(self, path, frame_interval):
+        self.name = os.path.basename(os.path.normpath(path))
+        self.frame_interval = frame_interval
+        self.files = sorted(
+            os.path.join(path, f) for f in os.listdir(path)
+            if f.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        self.position = -1
+
+    def read_at(self, seconds):
+        target = max(self.position + 1, math.ceil(seconds / self.frame_interval))
+        while target < len(self.files):
+            self.position = target
+            frame = cv2.imread(self.files[target])
+            if frame is not None: return frame
+            print(f"[replay] WARNING: 画像を読み込めませんでした: {self.files[target]}")
+            target += 1
+        return None
+
+    def release(self):
+        pass
+
+
+def open_source(path, frame_interval=monitor.MONITORING_INTERVAL):
+    if os.path.isdir(path):
+        return ImageFolderSource(path, frame_interval)
+    return VideoFrameSource(path)
+
+
+def run_replay(source, csv_path, interval=monitor.MONITORING_INTERVAL, is_debug_mode=False, verbose=False, adaptive=True):
+    """
+    フレームソースを最後まで処理し、処理フレーム数・抽出レース数・処理速度を返す。
+    monitor.process_frameが返す待機秒数は、実時間ではなく動画上の時間として消化する。
+    adaptiveがTrueの場合はライブ監視と同じくsampler.AdaptiveSamplerで間隔を決める
+    (CPU予算は実時間に依存するため使用しない)。
+    """
+    results = []
+    replay_session = _create_session(_source_name(source), source, csv_path, interval, is_debug_mode, verbose, adaptive, results)
+    started = time.perf_counter()
+    try:
+        while replay_session.step() is not None:
+            pass
+    finally:
+        replay_session.finish()
+    return _report(replay_session, results, time.perf_counter() - started)
+
+
+def run_replays(sources, csv_paths, interval=monitor.MONITORING_INTERVAL, is_debug_mode=False, verbose=False,
+                adaptive=True, workers=None):
+    """
+    複数のフレームソースを、共有のスレッドプール上のセッションとして並行に処理する。
+    ソースごとの結果と、全体の処理時間・処理速度を返す。
+    """
+    scheduler = session.SessionScheduler(max_workers=workers)
+    results = [[] for _ in sources]
+    sessions = [
+        _create_session(name, source, csv_path, interval, is_debug_mode, verbose, adaptive, stream_results)
+        for name, source, csv_path, stream_results in zip(stream_names(sources), sources, csv_paths, results)
+    ]
+    started = time.perf_counter()
+    try:
+        for replay_session in sessions:
+            scheduler.add(replay_session)
+        scheduler.join()
+    finally:
+        scheduler.shutdown()
+    elapsed = time.perf_counter() - started
+
+    reports = [_report(s, r, elapsed) for s, r in zip(sessions, results)]
+    frames = sum(r['frames'] for r in reports)
+    return {
+        'streams': reports,
+        'workers': scheduler.max_workers,
+        'frames': frames,
+        'races': sum(r['races'] for r in reports),
+        'elapsed': elapsed,
+        'fps': frames / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+def _source_name(source):
+    return os.path.splitext(source.name)[0]
+
+def stream_names(sources):
+    """
+    ソースごとのセッション名を返す。同じファイル名のソースが複数ある場合は '<名前>_<番号>' にして、
+    フレームID・検出した画面の保存名が重ならないようにする。
+    """
+    names = [_source_name(source) for source in sources]
+    counts = Counter(names)
+    return [f"{name}_{i}" if counts[name] > 1 else name for i, name in enumerate(names)]
+
+def default_csv_path(name, run_id):
+    """実行ごとに別のCSV (とDB) に書き出す。前回の実行の行に追記され、その最終レートを引き継がないようにする。"""
+    return os.path.join(REPLAY_OUTPUT_DIR, f"replay_{name}_{run_id}.csv")
+
+
+def _create_session(name, source, csv_path, interval, is_debug_mode, verbose, adaptive, results):
+    on_status = (lambda text: print(f"[{name}] {text}")) if verbose else (lambda text: None)
+    return session.MonitorSession(
+        name, source, csv_path, on_status=on_status, on_result=results.append,
+        is_debug_mode=is_debug_mode, interval=interval, realtime=False, adaptive=adaptive,
+    )
+
+
+def _report(replay_session, results, elapsed):
+    return {
+        'frames': replay_session.frames,
+        'analyzed': replay_session.analyzed,
+        'races': len(results),
+        'elapsed': elapsed,
+        'fps': replay_session.frames / elapsed if elapsed > 0 else 0.0,
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="録画済みの映像から、レース結果をヘッドレスで抽出します。")
+    parser.add_argument('sources', nargs='+', help="動画ファイル、または画像フォルダのパス (複数指定すると並行に処理する)")
+    parser.add_argument('--csv', help="結果を書き出すCSVのパス (既定: data/output/replay_<ソース名>_<実行日時>.csv)。ソースが1つの場合のみ有効")
+    parser.add_argument('--append', action='store_true', help="--csvのファイルが既にある場合に、その履歴に追記する (指定しない場合はエラーにする)")
+    parser.add_argument('--streams', type=int, default=1, help="各ソースを同時に再生するストリーム数 (並行処理の性能測定用)")
+    parser.add_argument('--workers', type=int, help="並行処理に使うワーカースレッド数 (既定: CPUコア数)")
+    parser.add_argument('--interval', type=float, default=monitor.MONITORING_INTERVAL, help="動画上のサンプリング間隔(秒)")
+    parser.add_argument('--frame-interval', type=float, default=monitor.MONITORING_INTERVAL, help="画像フォルダ使用時の、1枚あたりの間隔(秒)")
+    parser.add_argument('--fixed-interval', action='store_true', help="適応的なサンプリングを使わず、--intervalの固定間隔で全フレームを解析する")
+    parser.add_argument('--layout', help="config.pyの代わりに使う座標設定 (config.pyと同じ形式のJSONファイル)")
+    parser.add_argument('--metrics', help="処理段階ごとの所要時間と件数を書き出すパス (.jsonならJSON、それ以外はPrometheus形式)")
+    parser.add_argument('--profile', type=float, metavar='SECONDS', help="処理の最初のSECONDS秒間をプロファイルし、結果をdata/debugに保存する")
+    parser.add_argument('--tesseract', help="tesseract実行ファイルのパス (既定: PATH上のtesseract)")
+    parser.add_argument('--debug', action='store_true', help="デバッグ画像を保存する")
+    parser.add_argument('--verbose', action='store_true', help="状態遷移を表示する")
+    args = parser.parse_args()
+    if args.frame_interval <= 0:
+        parser.error("--frame-interval には0より大きい秒数を指定してください。")
+    if args.interval <= 0:
+        parser.error("--interval には0より大きい秒数を指定してください。")
+    if args.streams < 1:
+        parser.error("--streams には1以上を指定してください。")
+    if args.workers is not None and args.workers < 1:
+        parser.error("--workers には1以上を指定してください。")
+    if args.csv and os.path.exists(args.csv) and not args.append:
+        parser.error(f"{args.csv} は既に存在します。既存の履歴に追記する場合は --append を指定してください。")
+
+    if args.metrics:
+        metrics.enable(args.metrics)
+    if args.layout:
+        layout.set_layout(layout.load_layout(args.layout))
+    paths = [path for path in args.sources for _ in range(args.streams)]
+    # 各ワーカーと項目の並行読み取りスレッドが同時にエンジンを使うため、その数まで常駐させる
+    workers = 1 if len(paths) == 1 else (args.workers or os.cpu_count() or 1)
+    monitor.ocr.get_engine(args.tesseract, max_engines=monitor.ocr.FIELD_OCR_WORKERS + workers)
+    run_id = datetime.now().strftime('%Y%m%d_%H%M%S')
+    # 単一ストリームの場合はメインスレッドで処理するため、メインスレッドも対象にする
+    profile = profiler.profile_for(args.profile, include_main=len(paths) == 1) if args.profile else None
+    if len(paths) == 1:
+        source = open_source(paths[0], args.frame_interval)
+        csv_path = args.csv or default_csv_path(_source_name(source), run_id)
+
+        report = run_replay(source, csv_path, args.interval, args.debug, args.verbose, adaptive=not args.fixed_interval)
+        print(f"[replay] 処理フレーム数: {report['frames']} (解析: {report['analyzed']}) / 抽出レース数: {report['races']}")
+        print(f"[replay] 処理時間: {report['elapsed']:.1f}秒 ({report['fps']:.1f} frames/sec)")
+        print(f"[replay] 出力CSV: {csv_path}")
+    else:
+        _run_streams(paths, args, run_id)
+    artifacts.flush()  # 検出した画面・デバッグ画像の書き込みを待つ
+    monitor.ocr.close_engines()
+    if profile:
+        profile.stop()
+        print(f"[replay] プロファイル: {', '.join(profile.join() or ())}")
+    if args.metrics:
+        metrics.disable()
+        print(f"[replay] メトリクス: {args.metrics}")
+
+
+def _run_streams(paths, args, run_id):
+    sources = [open_source(path, args.frame_interval) for path in paths]
+    csv_paths = [default_csv_path(name, run_id) for name in stream_names(sources)]
+    report = run_replays(sources, csv_paths, args.interval, args.debug, args.verbose,
+                         adaptive=not args.fixed_interval, workers=args.workers)
+    for path, csv_path, stream in zip(paths, csv_paths, report['streams']):
+        print(f"[replay] {path}: 処理フレーム数 {stream['frames']} (解析: {stream['analyzed']}) / 抽出レース数 {stream['races']} -> {csv_path}")
+    print(f"[replay] {len(sources)}ストリーム / {report['workers']}ワーカー: 処理時間 {report['elapsed']:.1f}秒 ({report['fps']:.1f} frames/sec)")
+
+
+if __name__ == '__main__':
+    main()
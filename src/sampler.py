@@ -0,0 +1,147 @@
+import time
+
+import cv2
+import numpy as np
+
+# --- 設定 ---
+SIGNATURE_SIZE = (32, 18)      # 変化の検出に使う縮小画像の大きさ (幅, 高さ)
+CHANGE_THRESHOLD = 4.0         # 縮小画像の平均輝度差がこれ以上なら「変化した」とみなす
+MIN_INTERVAL = 0.25            # 画面の切り替わりが起きそうなときのサンプリング間隔(秒)
+BASE_INTERVAL = 2.0            # 通常のサンプリング間隔(秒)
+MAX_INTERVAL = 4.0             # 動きが続く間 (レース中など) に広げる間隔の上限(秒)
+BACKOFF_FACTOR = 1.25          # 動きが続くたびに間隔を広げる倍率
+BURST_SAMPLES = 8              # 切り替わりを検出した後、MIN_INTERVALで取得するフレーム数
+FORCE_ANALYSIS_INTERVAL = 15.0 # 変化がなくても、この秒数が経てば解析する
+CPU_BUDGET = 0.25              # 解析に使うCPU時間の割合の上限 (1コアあたり)。Noneで無制限
+
+
+class AdaptiveSampler:
+    """
+    フレームの縮小画像 (シグネチャ) を比較し、解析の要否と次のフレームを取得するまでの間隔を決める。
+    - 前回解析したフレームから変化がなければ、解析を省く。
+    - 画面が変化している途中のフレームを解析した場合は、画面が静止した時点でもう1度解析する
+      (リザルト表が描画途中のフレームだけを解析し、描画し終えた表を読み損なわないようにする)。
+    - 静止していた画面が急に変わった場合や、動きが止まった場合 (画面の切り替わり) は、
+      しばらく間隔を MIN_INTERVAL に詰めて、短時間しか表示されない画面を取りこぼさないようにする。
+    - 動きが続く間 (レース中) は、間隔を MAX_INTERVAL まで広げる。
+    - 解析にかかった時間がCPU_BUDGETの割合を超えないよう、間隔の下限を調整する。
+    時刻はnowで渡すこともでき、リプレイでは動画上の時間を使う。
+    """
+
+    def __init__(self, base_interval=BASE_INTERVAL, min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL,
+                 change_threshold=CHANGE_THRESHOLD, cpu_budget=CPU_BUDGET):
+        self.base_interval = base_interval
+        self.min_interval = min(min_interval, base_interval)
+        self.max_interval = max(max_interval, base_interval)
+        self.change_threshold = change_threshold
+        self.cpu_budget = cpu_budget
+        self.reset()
+
+    def reset(self):
+        """状態を初期化し、次のフレームを必ず解析させる。"""
+        self._previous = None
+        self._analyzed = None
+        self._last_analysis_at = None
+        self._moving_streak = 0
+        self._burst = 0
+        self._settle_pending = False  # 変化の途中のフレームを解析し、静止後の再解析を待っている
+        self._analysis_seconds = 0.0
+        self.skipped = 0
+        self.analyzed = 0
+
+    @staticmethod
+    def signature(frame):
+        """フレームを間引いてグレースケールの縮小画像にする。MappedFrameの場合は元画像から作る。"""
+        source = getattr(frame, 'source', frame)
+        step = max(1, source.shape[1] // (SIGNATURE_SIZE[0] * 4))
+        sampled = source[::step, ::step]
+        gray = cv2.cvtColor(sampled, cv2.COLOR_BGR2GRAY) if sampled.ndim == 3 else sampled
+        return cv2.resize(gray, SIGNATURE_SIZE, interpolation=cv2.INTER_AREA).astype(np.int16)
+
+    @staticmethod
+    def difference(a, b):
+        return float(np.mean(np.abs(a - b)))
+
+    def observe(self, frame, now=None, force=False):
+        """
+        フレームを記録し、解析が必要であればTrueを返す。
+        forceがTrueの場合 (コース名の認識待ちなど) は、変化の有無に関係なく解析させる。
+        """
+        now = time.monotonic() if now is None else now
+        signature = self.signature(frame)
+
+        if self._previous is not None:
+            if self.difference(signature, self._previous) >= self.change_threshold:
+                self._moving_streak += 1
+                if self._moving_streak == 1:
+                    self._burst = BURST_SAMPLES  # 静止していた画面が切り替わった
+            else:
+                if self._moving_streak >= 2:
+                    self._burst = BURST_SAMPLES  # 動きが止まった (レース終了・画面遷移の直後)
+                self._moving_streak = 0
+        self._previous = signature
+
+        moving = self._moving_streak > 0
+        should_analyze = (
+            force
+            or self._analyzed is None
+            or self.difference(signature, self._analyzed) >= self.change_threshold
+            or now - self._last_analysis_at >= FORCE_ANALYSIS_INTERVAL
+            or (self._settle_pending and not moving)
+        )
+        if should_analyze:
+            self._analyzed = signature
+            self._last_analysis_at = now
+            self._settle_pending = moving
+            self.analyzed += 1
+        else:
+            self.skipped += 1
+        return should_analyze
+
+    def record_analysis(self, seconds):
+        """1フレームの解析にかかった時間を記録する (CPU_BUDGETの計算に使用)。"""
+        self._analysis_seconds = seconds if not self._analysis_seconds else 0.8 * self._analysis_seconds + 0.2 * seconds
+
+    def next_interval(self, hint=None):
+        """
+        次のフレームを取得するまでの秒数を返す。
+        hintには監視の状態機械が通常の間隔以外 (認識待ち・エラー後など) を指定した場合にその秒数を渡し、
+        その場合はhintに従う。
+        """
+        if hint is not None:
+            return hint
+
+        if self._burst > 0:
+            self._burst -= 1
+            interval = self.min_interval
+        elif self._moving_streak > 0:
+            interval = min(self.max_interval, self.base_interval * BACKOFF_FACTOR ** self._moving_streak)
+        else:
+            interval = self.base_interval
+
+        if self.cpu_budget:
+            # 解析時間 / (解析時間 + 間隔) <= cpu_budget となるように間隔を広げる
+            interval = max(interval, self._analysis_seconds * (1 - self.cpu_budget) / self.cpu_budget)
+        return interval
+
+
+class FixedSampler:
+    """AdaptiveSamplerと同じインターフェースで、全フレームを固定間隔で解析する。"""
+
+    def __init__(self, base_interval=BASE_INTERVAL):
+        self.base_interval = base_interval
+        self.skipped = 0
+        self.analyzed = 0
+
+    def reset(self):
+        pass
+
+    def observe(self, frame, now=None, force=False):
+        self.analyzed += 1
+        return True
+
+    def record_analysis(self, seconds):
+        pass
+
+    def next_interval(self, hint=None):
+        return self.base_interval if hint is None else hint
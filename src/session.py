@@ -0,0 +1,275 @@
+"""
+1つのキャプチャソースの監視をまとめたセッションと、複数のセッションを共有のスレッドプールで
+公平に実行するスケジューラ。1つのプロセスで複数のゲーム機・キャプチャデバイスを監視できる。
+"""
+import heapq
+import itertools
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import artifacts
+import imaging
+import metrics
+import monitor
+import sampler
+
+# --- パス設定 ---
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEBUG_DIR = os.path.join(SCRIPT_DIR, '..', 'data', 'debug')
+
+# --- 設定 ---
+NO_FRAME_RETRY_WAIT = 0.1  # フレームが取得できなかった場合の再試行までの秒数
+
+
+class MonitorSession:
+    """
+    1つのフレームソースに対する監視状態・サンプリング・出力先をまとめたもの。
+    sourceは read_at(秒) でフレームを返すオブジェクト (replay.VideoFrameSourceなど) で、
+    一時的に取得できない場合はNone、終端に達した・切断された場合はEOFErrorかIOErrorを送出する。
+    realtimeがFalseの場合は実時間の待機を行わず、セッション内の時刻を進めて処理する (リプレイ用)。
+    adaptiveがFalseの場合は、サンプリング間隔を固定して全フレームを解析する。
+    """
+
+    def __init__(self, name, source, csv_path=None, on_status=print, on_result=None, on_finished=None,
+                 is_debug_mode=False, interval=monitor.MONITORING_INTERVAL, realtime=True, adaptive=True):
+        self.name = name
+        self.source = source
+        self.csv_path = csv_path
+        self.on_status = on_status
+        self.on_result = on_result
+        self.on_finished = on_finished
+        self.is_debug_mode = is_debug_mode
+        self.interval = interval
+        self.realtime = realtime
+        self.state = monitor.MonitorState()
+        if adaptive:
+            # CPU予算は実時間に対するものなので、リプレイでは使用しない
+            self.sampler = sampler.AdaptiveSampler(base_interval=interval, cpu_budget=sampler.CPU_BUDGET if realtime else None)
+        else:
+            self.sampler = sampler.FixedSampler(base_interval=interval)
+        self.active = True
+        self.frames = 0
+        self.analyzed = 0
+        self.results = 0
+        self._debug_capture_requested = False
+        self._last_waiting_for_course = None
+        self._position = 0.0
+        self._captured_at = None
+        self._started_at = time.monotonic()
+        self._finish_lock = threading.Lock()
+
+    def now(self):
+        """セッション内の時刻 (秒)。"""
+        return time.monotonic() - self._started_at if self.realtime else self._position
+
+    def request_debug_capture(self):
+        self._debug_capture_requested = True
+
+    def stop(self):
+        self.active = False
+
+    def step(self):
+        """フレームを1枚取得して処理し、次に呼び出すまでの秒数を返す。終了した場合はNone。"""
+        if not self.active: return None
+        labels = {'session': self.name or "live"}
+        self._captured_at = time.perf_counter()
+        try:
+            with metrics.stage('capture'):
+                raw_frame = self.source.read_at(self.now())
+        except (EOFError, IOError) as e:
+            if str(e): self.on_status(f"エラー: {e}")
+            self.active = False
+            return None
+        if raw_frame is None:
+            if not self.realtime:
+                self.active = False
+                return None
+            metrics.inc('capture_failures_total', **labels)
+            return NO_FRAME_RETRY_WAIT
+
+        self.frames += 1
+        metrics.inc('frames_sampled_total', **labels)
+        with metrics.stage('normalize'):
+            frame = monitor.normalize_frame(raw_frame)
+        if self._debug_capture_requested:
+            self._debug_capture_requested = False
+            self._save_debug_capture(frame)
+
+        # 前回解析したフレームから変化がなければ解析を省き、間隔は画面の動きに応じて決める
+        # 認識待ちの間や、状態が切り替わった直後 (強制切替を含む) は変化がなくても解析する
+        wait = None
+        force = self.state.pending_course is not None or self.state.waiting_for_course != self._last_waiting_for_course
+        if self.sampler.observe(frame, now=self.now(), force=force):
+            self._last_waiting_for_course = self.state.waiting_for_course
+            self.analyzed += 1
+            metrics.inc('frames_analyzed_total', **labels)
+            started = time.perf_counter()
+            with metrics.stage('analyze'):
+                wait = monitor.process_frame(
+                    frame, self.state,
+                    on_status=self.on_status, on_result=self._handle_result,
+                    is_debug_mode=self.is_debug_mode, frame_id=self._frame_id(), csv_path=self.csv_path,
+                    async_course=self.realtime,  # リプレイではセッション内の時刻で再現するため、同期で待つ
+                )
+            self.sampler.record_analysis(time.perf_counter() - started)
+
+        interval = self.sampler.next_interval(None if wait == monitor.MONITORING_INTERVAL else wait)
+        if not self.realtime: self._position += interval
+        return interval
+
+    def _frame_id(self):
+        prefix = f"{self.name}_" if self.name else ""
+        if self.realtime:
+            return prefix + datetime.now().strftime('%Y%m%d_%H%M%S')
+        return f"{prefix}{getattr(self.source, 'position', self.frames):07d}"
+
+    def _handle_result(self, row):
+        self.results += 1
+        # 結果の元になったフレームを取得してから、保存が終わるまでの時間
+        metrics.observe('detection_latency_seconds', time.perf_counter() - self._captured_at)
+        if self.on_result: self.on_result(row)
+
+    def _save_debug_capture(self, frame):
+        state = "course_decision" if self.state.waiting_for_course else "result"
+        debug_img = imaging.draw_debug_overlay(frame, state, self.state.current_course_name, self.state.pre_race_rate)
+        prefix = f"{self.name}_" if self.name else ""
+        save_path = os.path.join(DEBUG_DIR, f"debug_capture_{prefix}{datetime.now().strftime('%Y%m%d_%H%M%S')}.png")
+
+        def on_saved(ok):
+            if ok: self.on_status(f"デバッグ画像を保存しました: {os.path.basename(save_path)}")
+            else: self.on_status("エラー: デバッグ画像の保存に失敗しました。")
+        artifacts.submit(save_path, debug_img, on_done=on_saved)
+
+    def finish(self):
+        """ソースを解放し、on_finishedを1度だけ呼び出す。"""
+        with self._finish_lock:
+            if self.source is None: return
+            source, self.source = self.source, None
+        self.active = False
+        release = getattr(source, 'release', None)
+        if release: release()
+        if self.on_finished: self.on_finished(self)
+
+
+class SessionScheduler:
+    """
+    複数のMonitorSessionを共有のスレッドプールで実行する。
+    各セッションは同時に1ステップしか実行されず、次の実行予定時刻が早い順 (同時刻なら待ちの長い順) に
+    ワーカーへ割り当てるため、処理の重いセッションがあっても他のセッションが待たされ続けることはない。
+    実行中のステップ数をワーカー数以下に抑え、順番待ちはスレッドプールではなくこのキューで行う。
+    """
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="session")
+        self._queue = []  # (実行予定時刻, 順番, セッション)
+        self._order = itertools.count()
+        self._sessions = set()
+        self._in_flight = 0
+        self._running = True
+        self._condition = threading.Condition()
+        self._dispatcher = threading.Thread(target=self._dispatch, name="session-dispatcher", daemon=True)
+        self._dispatcher.start()
+
+    @property
+    def sessions(self):
+        with self._condition:
+            return list(self._sessions)
+
+    def add(self, session):
+        with self._condition:
+            self._sessions.add(session)
+            self._push(session, time.monotonic())
+
+    def remove(self, session):
+        """セッションを停止する。実行中のステップが終わり次第、ソースを解放する。"""
+        session.stop()
+        with self._condition:
+            queued = [entry for entry in self._queue if entry[2] is session]
+            if queued:
+                # 実行待ちであれば、次の実行予定時刻を待たずにこの場で終了させる
+                self._queue = [entry for entry in self._queue if entry[2] is not session]
+                heapq.heapify(self._queue)
+            self._condition.notify_all()
+        if queued: self._executor.submit(self._finish, session)
+
+    def _push(self, session, due):
+        heapq.heappush(self._queue, (due, next(self._order), session))
+        self._condition.notify_all()
+
+    def _dispatch(self):
+        with self._condition:
+            while self._running:
+                if not self._queue or self._in_flight >= self.max_workers:
+                    self._condition.wait()
+                    continue
+                due, _, session = self._queue[0]
+                if not session.active:
+                    heapq.heappop(self._queue)
+                    self._executor.submit(self._finish, session)
+                    continue
+                delay = due - time.monotonic()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+                heapq.heappop(self._queue)
+                self._in_flight += 1
+                self._executor.submit(self._run_step, session)
+
+    def _run_step(self, session):
+        interval = None
+        try:
+            interval = session.step()
+        except Exception as e:
+            session.on_status(f"エラー: {e}")
+            traceback.print_exc()
+            interval = monitor.ERROR_WAIT
+        finally:
+            with self._condition:
+                self._in_flight -= 1
+                if session.active and interval is not None:
+                    self._push(session, time.monotonic() + (interval if session.realtime else 0.0))
+                else:
+                    self._condition.notify_all()
+        if not session.active or interval is None:
+            self._finish(session)
+
+    def _finish(self, session):
+        session.finish()
+        with self._condition:
+            self._sessions.discard(session)
+            self._condition.notify_all()
+
+    def join(self, timeout=None):
+        """全てのセッションが終了するまで待つ。"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while self._sessions:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0: return False
+                self._condition.wait(remaining)
+        return True
+
+    def shutdown(self):
+        for session in self.sessions:
+            session.stop()
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        self._executor.shutdown(wait=False)
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler():
+    """プロセス全体で共有するSessionSchedulerを返す。"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = SessionScheduler()
+        return _scheduler
@@ -0,0 +1,105 @@
+import threading
+
+import pytest
+
+cv2 = pytest.importorskip('cv2')
+np = pytest.importorskip('numpy')
+
+import artifacts
+import geometry
+from artifacts import ArtifactWriter
+
+
+class StalledWrites:
+    """write_imageの代わり。releaseするまで最初の書き込みで止まり、書き込んだパスを記録する。"""
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.released = threading.Event()
+        self.paths = []
+        self.images = []
+
+    def __call__(self, path, image, compression=None):
+        self.started.set()
+        self.released.wait(5)
+        self.paths.append(path)
+        self.images.append(image)
+        return True
+
+
+@pytest.fixture
+def stalled(monkeypatch):
+    writes = StalledWrites()
+    monkeypatch.setattr(artifacts, 'write_image', writes)
+    yield writes
+    writes.released.set()
+
+
+IMAGE = np.zeros((4, 4, 3), np.uint8)
+
+
+def fill(writer, stalled, paths, results):
+    """書き込みスレッドを最初の画像で止めてから、残りをキューに入れる。"""
+    writer.submit(paths[0], IMAGE, on_done=lambda ok: results.append((paths[0], ok)))
+    assert stalled.started.wait(5)
+    return [writer.submit(p, IMAGE, on_done=lambda ok, p=p: results.append((p, ok))) for p in paths[1:]]
+
+
+def test_drop_newest_rejects_new_images(stalled):
+    writer = ArtifactWriter(max_queue=2, drop_policy=artifacts.DROP_NEWEST, name="test_newest")
+    results = []
+    assert fill(writer, stalled, ['a', 'b', 'c', 'd'], results) == [True, True, False]
+    assert ('d', False) in results
+    stalled.released.set()
+    assert writer.flush(5)
+    assert stalled.paths == ['a', 'b', 'c']
+    assert (writer.written, writer.dropped) == (3, 1)
+
+
+def test_drop_oldest_replaces_queued_images(stalled):
+    writer = ArtifactWriter(max_queue=2, drop_policy=artifacts.DROP_OLDEST, name="test_oldest")
+    results = []
+    assert fill(writer, stalled, ['a', 'b', 'c', 'd', 'e'], results) == [True, True, True, True]
+    assert sorted(p for p, ok in results if not ok) == ['b', 'c']
+    stalled.released.set()
+    assert writer.flush(5)
+    assert stalled.paths == ['a', 'd', 'e']
+    assert (writer.written, writer.dropped) == (3, 2)
+
+
+def test_block_waits_for_space(stalled):
+    writer = ArtifactWriter(max_queue=1, drop_policy=artifacts.BLOCK, name="test_block")
+    fill(writer, stalled, ['a', 'b'], [])
+    blocked = threading.Thread(target=writer.submit, args=('c', IMAGE))
+    blocked.start()
+    blocked.join(0.1)
+    assert blocked.is_alive()  # キューが空くまで待たされる
+    stalled.released.set()
+    blocked.join(5)
+    assert not blocked.is_alive()
+    assert artifacts.flush(5)  # 個別に生成した書き込みも待つ
+    assert stalled.paths == ['a', 'b', 'c'] and writer.dropped == 0
+
+
+def test_mapped_frames_are_converted_on_the_writer_thread(stalled):
+    stalled.released.set()
+    writer = ArtifactWriter(name="test_mapped")
+    frame = geometry.map_frame(np.zeros((720, 1280, 3), np.uint8))
+    assert writer.submit('mapped.png', frame)
+    assert writer.flush(5)
+    assert isinstance(stalled.images[0], np.ndarray) and stalled.images[0].shape == (1080, 1920, 3)
+
+
+def test_rejects_unknown_policy():
+    with pytest.raises(ValueError):
+        ArtifactWriter(drop_policy="drop_all")
+
+
+def test_write_and_read_unicode_paths(tmp_path):
+    image = np.random.default_rng(0).integers(0, 256, (8, 8, 3), dtype=np.uint8)
+    for name in ('画像.png', '配列.npy'):
+        path = str(tmp_path / 'フォルダ' / name)
+        assert artifacts.write_image(path, image)
+    assert np.array_equal(artifacts.read_image(str(tmp_path / 'フォルダ' / '画像.png')), image)
+    assert np.array_equal(np.load(str(tmp_path / 'フォルダ' / '配列.npy')), image)
+    assert artifacts.read_image(str(tmp_path / 'missing.png')) is None
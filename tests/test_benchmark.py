@@ -0,0 +1,55 @@
+import pytest
+
+pytest.importorskip('cv2')
+np = pytest.importorskip('numpy')
+
+import benchmark
+import imaging
+import ocr
+
+
+def stage(p50):
+    return {'n': 10, 'p50_ms': p50, 'p95_ms': p50, 'mean_ms': p50, 'throughput_per_sec': None}
+
+
+def test_summarize():
+    summary = benchmark.summarize([1.0, 2.0, 3.0, 4.0])
+    assert summary['n'] == 4
+    assert summary['p50_ms'] == 2.5 and summary['mean_ms'] == 2.5
+    assert summary['throughput_per_sec'] == 400.0
+
+
+def test_find_regressions_uses_ratio_and_minimum_delta():
+    baseline = {'stages': {'slow': stage(10.0), 'fast': stage(0.01), 'steady': stage(5.0)}}
+    current = {'slow': stage(13.0), 'fast': stage(0.03), 'steady': stage(6.0), 'new': stage(1.0)}
+    regressions = benchmark.find_regressions(current, baseline, tolerance=0.25)
+    # fastは3倍でも差が測定誤差の範囲内、newは基準値がないため回帰としない
+    assert [r['stage'] for r in regressions] == ['slow']
+    assert regressions[0]['ratio'] == 1.3
+
+
+def test_worker_counts():
+    assert benchmark.worker_counts(1) == [1]
+    assert benchmark.worker_counts(6) == [1, 2, 4, 6]
+    assert benchmark.worker_counts(8) == [1, 2, 4, 8]
+
+
+def test_run_measures_history_stages_without_frames():
+    corpus = {imaging.SCREEN_COURSE_DECISION: [], imaging.SCREEN_RESULT: []}
+    report = benchmark.run(corpus, repeat=2, only={'history.append', 'analysis.find_closest_course_name'})
+    assert set(report) == {'history.append', 'analysis.find_closest_course_name'}
+    assert report['history.append']['n'] == 2
+
+
+def test_measure_streams_reports_fps_per_worker_count(monkeypatch):
+    # install_stub_ocrが差し替える関数を、テストの終了後に元に戻す
+    monkeypatch.setattr(ocr, 'get_engine', ocr.get_engine)
+    monkeypatch.setattr(ocr, 'submit_course_ocr', ocr.submit_course_ocr)
+    benchmark.install_stub_ocr()
+    corpus = {imaging.SCREEN_COURSE_DECISION: [np.zeros((1080, 1920, 3), np.uint8)],
+              imaging.SCREEN_RESULT: [np.full((720, 1280, 3), 80, np.uint8)]}
+    report = benchmark.measure_streams(corpus, streams=3, frames_per_stream=10)
+    assert [entry['workers'] for entry in report['scaling']] == [1, 2, 3]
+    assert all(entry['frames'] == 30 and entry['fps'] > 0 for entry in report['scaling'])
+    assert report['scaling'][0]['speedup'] == 1.0
+    assert benchmark.measure_streams({imaging.SCREEN_COURSE_DECISION: [], imaging.SCREEN_RESULT: []}, 2) is None
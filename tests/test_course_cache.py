@@ -0,0 +1,70 @@
+import json
+import random
+
+from course_cache import CourseCache
+
+
+def _flip(phash, bits):
+    for bit in bits:
+        phash ^= 1 << bit
+    return phash
+
+
+def test_lookup_within_distance():
+    cache = CourseCache(path=None)
+    phash = random.Random(0).getrandbits(256)
+    cache.put(phash, True, 'ワリオシップ')
+    assert cache.lookup(phash, True) == 'ワリオシップ'
+    assert cache.lookup(_flip(phash, range(0, 256, 22)), True) == 'ワリオシップ'  # 12ビット
+    assert cache.lookup(_flip(phash, range(0, 260, 20)), True) is None           # 13ビット
+
+
+def test_lookup_requires_same_screen_type():
+    cache = CourseCache(path=None)
+    phash = random.Random(1).getrandbits(256)
+    cache.put(phash, False, 'ヘイホーカーニバル')
+    assert cache.lookup(phash, True) is None
+    assert cache.lookup(phash, False) == 'ヘイホーカーニバル'
+    cache.put(phash, True, 'ワリオシップ')
+    assert cache.lookup(phash, True) == 'ワリオシップ'
+    assert cache.lookup(phash, False) == 'ヘイホーカーニバル'
+
+
+def test_lookup_matches_linear_scan():
+    rng = random.Random(2)
+    cache = CourseCache(path=None)
+    stored = {}
+    for i in range(200):
+        phash = rng.getrandbits(256)
+        cache.put(phash, True, f"course{i}")
+        stored[phash] = f"course{i}"
+    for phash, name in list(stored.items())[:50]:
+        query = _flip(phash, rng.sample(range(256), rng.randint(0, 14)))
+        distances = {h: bin(h ^ query).count('1') for h in stored}
+        nearest = min(distances, key=distances.get)
+        expected = stored[nearest] if distances[nearest] <= cache.max_distance else None
+        assert cache.lookup(query, True) == expected
+
+
+def test_evicts_least_recently_used():
+    cache = CourseCache(path=None, max_entries=2)
+    a, b, c = (random.Random(seed).getrandbits(256) for seed in (3, 4, 5))
+    cache.put(a, True, 'A')
+    cache.put(b, True, 'B')
+    assert cache.lookup(a, True) == 'A'
+    cache.put(c, True, 'C')
+    assert len(cache) == 2
+    assert cache.lookup(b, True) is None
+    assert cache.lookup(a, True) == 'A'
+
+
+def test_persists_and_skips_entries_without_screen_type(tmp_path):
+    path = tmp_path / 'course_cache.json'
+    path.write_text(json.dumps([{'hash': 'ff', 'course': 'レインボーロード'}]), encoding='utf-8')
+    cache = CourseCache(path=str(path))
+    assert len(cache) == 0
+    cache.put(0xabc, False, 'ワリオシップ')
+
+    reloaded = CourseCache(path=str(path))
+    assert reloaded.lookup(0xabc, False) == 'ワリオシップ'
+    assert reloaded.lookup(0xabc, True) is None
@@ -0,0 +1,92 @@
+from difflib import SequenceMatcher
+
+import pytest
+
+import config
+from course_matcher import CourseMatcher, bounded_levenshtein, normalize
+
+
+def _baseline_match(text, course_list):
+    """course_matcher導入前の find_closest_course_name と同じ照合 (SequenceMatcher.ratio > 0.6)。"""
+    best_match, best_score = None, 0.6
+    for course in course_list:
+        score = SequenceMatcher(None, text, course).ratio()
+        if score > best_score:
+            best_score, best_match = score, course
+    return best_match
+
+
+def _typical_inputs():
+    inputs = list(config.COURSE_NAMES)
+    for name in config.COURSE_NAMES:
+        for length in range(2, len(name)):
+            inputs += [name[:length], name[-length:]]
+        inputs += [name[:-1] + 'X', ' '.join(name), 'カップ' + name]
+    for start, end in config.VALID_ROUTES:
+        inputs += [f"{start}→{end}", f"{start} → {end}", f"{start}->{end}"]
+    inputs += ['ピーチビーチ', 'ワリオ', 'DKスノー', 'サンサンさばく→ヘイホーカーニバル', 'ソルティータウン → ピーチビーチ']
+    return inputs
+
+
+@pytest.fixture(scope='module')
+def matcher():
+    return CourseMatcher(config.COURSE_NAMES)
+
+
+def test_matches_everything_the_baseline_matched(matcher):
+    mismatches = []
+    for text in _typical_inputs():
+        expected = _baseline_match(text, config.COURSE_NAMES)
+        if expected is not None and matcher.match(text) != expected:
+            mismatches.append((text, expected, matcher.match(text)))
+    assert mismatches == []
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('ピーチビーチ', 'バナナカップピーチビーチ'),
+    ('ワリオ', 'ワリオシップ'),
+    ('DKスノー', 'DKスノーマウンテン'),
+    ('サンサンさばく→ヘイホーカーニバル', 'ヘイホーカーニバル'),
+    ('ｄｋうちゅうせんたー', 'DKうちゅうセンター'),
+    ('ショー ニュー ロード', 'ショーニューロード'),
+    ('ロゼッタテンモンダイ', 'ロゼッタてんもんだい'),
+])
+def test_match(matcher, text, expected):
+    assert matcher.match(text) == expected
+
+
+@pytest.mark.parametrize('text', ['', '・・・', 'ABCDEFG', 'コース不明'])
+def test_no_match(matcher, text):
+    assert matcher.match(text) is None
+
+
+def test_top_k_orders_by_score(matcher):
+    results = matcher.top_k('ワリオスタジアム', 3)
+    assert [name for name, _ in results][:2] == ['ワリオスタジアム', 'ピーチスタジアム']
+    assert all(a[1] >= b[1] for a, b in zip(results, results[1:]))
+    assert all(score > matcher.min_score for _, score in results)
+
+
+def test_normalize():
+    assert normalize('ｄｋ うちゅう・センター') == 'DKウチュウセンター'
+    assert normalize('ショ〜ニュ－ロード') == 'ショーニューロード'
+    assert normalize('ｷﾉﾋﾟｵ') == 'キノピオ'
+
+
+@pytest.mark.parametrize('a, b, expected', [
+    ('', '', 0), ('abc', 'abc', 0), ('abc', 'abd', 1), ('abc', '', 3), ('kitten', 'sitting', 3),
+])
+def test_bounded_levenshtein(a, b, expected):
+    assert bounded_levenshtein(a, b, 10) == expected
+    assert bounded_levenshtein(b, a, 10) == expected
+
+
+def test_bounded_levenshtein_stops_at_limit():
+    assert bounded_levenshtein('kitten', 'sitting', 2) == 3
+    assert bounded_levenshtein('a', 'abcdef', 1) == 2
+
+
+def test_bounded_levenshtein_substitution_cost_gives_indel_distance():
+    # len(a) + len(b) - 2 * LCS: 'abcd' と 'acbd' のLCSは3
+    assert bounded_levenshtein('abcd', 'acbd', 10, substitution_cost=2) == 2
+    assert bounded_levenshtein('abc', 'xyz', 10, substitution_cost=2) == 6
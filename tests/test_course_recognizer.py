@@ -0,0 +1,62 @@
+import os
+
+import pytest
+
+cv2 = pytest.importorskip('cv2')
+np = pytest.importorskip('numpy')
+
+import config
+import course_recognizer
+from course_recognizer import LocalCourseRecognizer
+
+COURSE_A, COURSE_B = config.COURSE_NAMES[0], config.COURSE_NAMES[1]
+
+
+def name_area(seed):
+    """コース名の表示部分の代わりに、seedごとに異なる模様を描いた300x50の画像。"""
+    rng = np.random.default_rng(seed)
+    image = np.full((50, 300, 3), 30, np.uint8)
+    for _ in range(6):
+        x, y = int(rng.integers(10, 260)), int(rng.integers(10, 40))
+        cv2.rectangle(image, (x, y), (x + int(rng.integers(10, 40)), y + 8), (255, 255, 255), -1)
+    return image
+
+
+@pytest.fixture
+def recognizer(tmp_path):
+    recognizer = LocalCourseRecognizer(str(tmp_path / '参照画像'))
+    recognizer.add_reference(COURSE_A, name_area(1))
+    recognizer.add_reference(COURSE_B, name_area(2))
+    return recognizer
+
+
+def test_without_references(tmp_path):
+    recognizer = LocalCourseRecognizer(str(tmp_path / 'missing'))
+    assert not recognizer.has_references
+    assert recognizer.recognize(name_area(1)) == (None, 0.0)
+
+
+def test_recognizes_single_course_name_area(recognizer):
+    name, score = recognizer.recognize(name_area(2))
+    assert name == COURSE_B and score > course_recognizer.MIN_MATCH_SCORE
+    _, score = recognizer.recognize(name_area(3))
+    assert score < course_recognizer.MIN_MATCH_SCORE
+
+
+def test_searches_two_race_screen(recognizer):
+    search_area = np.full((400, 600, 3), 30, np.uint8)
+    search_area[220:270, 130:430] = name_area(1)
+    name, score = recognizer.recognize(None, search_area, is_single_course=False)
+    assert name == COURSE_A and score > course_recognizer.MIN_MATCH_SCORE
+
+
+def test_references_are_saved_and_reloaded(recognizer):
+    for _ in range(course_recognizer.MAX_REFERENCES_PER_COURSE + 2):
+        recognizer.add_reference(COURSE_A, name_area(1))
+    recognizer.add_reference("存在しないコース", name_area(4))
+    files = sorted(os.listdir(recognizer.reference_dir))
+    assert len([f for f in files if f.startswith(COURSE_A + '_')]) == course_recognizer.MAX_REFERENCES_PER_COURSE
+    assert len(files) == course_recognizer.MAX_REFERENCES_PER_COURSE + 1
+
+    reloaded = LocalCourseRecognizer(recognizer.reference_dir)
+    assert reloaded.recognize(name_area(2))[0] == COURSE_B
@@ -0,0 +1,114 @@
+import json
+import os
+import time
+
+import pytest
+
+pytest.importorskip('cv2')
+np = pytest.importorskip('numpy')
+
+import frame_store
+from frame_store import FrameStore
+
+IMAGE = np.zeros((8, 8, 3), np.uint8)
+FRAME_BYTES = 128 + IMAGE.nbytes  # .npyのヘッダ + 配列
+
+
+def open_store(root, **kwargs):
+    kwargs.setdefault('max_bytes', 1 << 30)
+    kwargs.setdefault('max_age', 0)
+    return FrameStore(str(root), frame_format='npy', **kwargs)
+
+
+def put_all(store, count, start=0):
+    for i in range(start, start + count):
+        store.put('result', f"{i:04d}", IMAGE, race=i // 2)
+    assert store.flush(5)
+
+
+def names(store):
+    return [os.path.basename(p) for p in store.files()]
+
+
+def test_journal_is_replayed_on_reopen(tmp_path):
+    store = open_store(tmp_path)
+    put_all(store, 4)
+    store.put('course', '0000', IMAGE, race=0)
+    assert store.flush(5)
+    assert not os.path.exists(os.path.join(tmp_path, frame_store.INDEX_NAME))  # 保存ごとに索引全体を書き直さない
+
+    reopened = open_store(tmp_path)
+    assert names(reopened) == names(store)
+    assert reopened.total_bytes == store.total_bytes == 5 * FRAME_BYTES
+    assert set(reopened.frames_for_race(0)) == {'result', 'course'}
+
+
+def test_size_cap_evicts_oldest_frames(tmp_path):
+    store = open_store(tmp_path, max_bytes=3 * FRAME_BYTES)
+    put_all(store, 5)
+    assert names(store) == ['result_0002.npy', 'result_0003.npy', 'result_0004.npy']
+    assert not os.path.exists(os.path.join(tmp_path, 'result_0000.npy'))
+    assert store.frames_for_race(0) == {}
+    assert names(open_store(tmp_path, max_bytes=3 * FRAME_BYTES)) == names(store)
+
+
+def test_expired_frames_are_evicted(tmp_path, monkeypatch):
+    store = open_store(tmp_path, max_age=60)
+    put_all(store, 3)
+    now = time.time()
+    monkeypatch.setattr(frame_store.time, 'time', lambda: now + 120)
+    assert store.evict() == 3
+    assert len(store) == 0 and store.total_bytes == 0
+    assert not [f for f in os.listdir(tmp_path) if f.endswith('.npy')]
+    assert len(open_store(tmp_path)) == 0
+
+
+def test_expiry_thread_evicts_without_new_frames(tmp_path):
+    store = open_store(tmp_path, max_age=0.05)
+    put_all(store, 2)
+    store.start_expiry(interval=0.05)
+    try:
+        deadline = time.monotonic() + 5
+        while len(store) and time.monotonic() < deadline:
+            time.sleep(0.02)
+    finally:
+        store.stop_expiry()
+    assert len(store) == 0
+
+
+def test_journal_is_compacted_into_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(frame_store, 'COMPACT_JOURNAL_RECORDS', 3)
+    store = open_store(tmp_path, max_bytes=4 * FRAME_BYTES)
+    put_all(store, 6)
+    assert os.path.exists(os.path.join(tmp_path, frame_store.INDEX_NAME))
+    assert store._journal_records <= 3
+    reopened = open_store(tmp_path, max_bytes=4 * FRAME_BYTES)
+    assert names(reopened) == names(store) == [f"result_{i:04d}.npy" for i in range(2, 6)]
+
+
+def test_truncated_last_journal_line_is_ignored(tmp_path):
+    put_all(open_store(tmp_path), 2)
+    with open(os.path.join(tmp_path, frame_store.JOURNAL_NAME), 'a', encoding='utf-8') as f:
+        f.write('{"name": "result_9999.npy", "si')  # 書き込み途中で終了した行
+    assert names(open_store(tmp_path)) == ['result_0000.npy', 'result_0001.npy']
+
+
+def test_overwriting_a_frame_keeps_one_entry(tmp_path):
+    store = open_store(tmp_path)
+    put_all(store, 1)
+    put_all(store, 1)
+    assert len(store) == 1 and store.total_bytes == FRAME_BYTES
+    assert len(open_store(tmp_path)) == 1
+
+
+def test_existing_files_are_adopted_once(tmp_path):
+    legacy = tmp_path / 'cropped'
+    legacy.mkdir()
+    (legacy / 'old_rate.png').write_bytes(b'x' * 10)
+    (tmp_path / 'result_old.png').write_bytes(b'x' * 20)
+    store = open_store(tmp_path)
+    assert sorted(names(store)) == ['old_rate.png', 'result_old.png']
+    assert store.total_bytes == 30
+    assert store.clear() == 2
+    assert os.listdir(legacy) == []
+    assert len(open_store(tmp_path)) == 0
@@ -0,0 +1,94 @@
+import threading
+import time
+
+import pytest
+
+from gemini_client import CircuitOpenError, GeminiClient
+
+
+class Response:
+    def __init__(self, text):
+        self.text = text
+
+
+class StubModel:
+    """GenerativeModelの代わり。outcomesを順に返し (例外なら送出し)、呼び出しを記録する。"""
+
+    def __init__(self, *outcomes, gate=None):
+        self.outcomes = list(outcomes)
+        self.gate = gate
+        self.calls = []
+
+    def generate_content(self, contents, request_options=None):
+        self.calls.append((contents, request_options))
+        if self.gate is not None: self.gate.wait(5)
+        outcome = self.outcomes.pop(0) if len(self.outcomes) > 1 else self.outcomes[0]
+        if isinstance(outcome, Exception): raise outcome
+        return Response(outcome)
+
+
+def make_client(model, **kwargs):
+    kwargs.setdefault('backoff', 0.0)
+    client = GeminiClient(**kwargs)
+    client._model = model  # google.generativeaiを読み込まずにスタブを使う
+    return client
+
+
+def test_retries_until_success_and_reuses_model():
+    model = StubModel(RuntimeError("503"), RuntimeError("503"), "マリオサーキット")
+    client = make_client(model, max_attempts=3)
+    assert client.generate(["画像"]) == "マリオサーキット"
+    assert len(model.calls) == 3
+    assert all(0 < options['timeout'] <= client.deadline for _, options in model.calls)
+    assert client.generate(["画像"]) == "マリオサーキット"
+    assert client._model is model
+
+
+def test_deadline_fails_the_future_while_the_call_hangs():
+    gate = threading.Event()
+    client = make_client(StubModel("遅い応答", gate=gate), deadline=0.1)
+    started = time.monotonic()
+    future = client.submit(["画像"])
+    with pytest.raises(TimeoutError):
+        future.result(timeout=5)
+    assert time.monotonic() - started < 1.0
+    gate.set()
+
+
+def test_circuit_opens_after_consecutive_failures_and_recovers():
+    model = StubModel(RuntimeError("500"))
+    client = make_client(model, max_attempts=1, failure_threshold=2, open_seconds=0.2)
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            client.generate(["画像"])
+    assert client.is_open
+
+    # 開いている間はAPIを呼ばずに失敗する
+    with pytest.raises(CircuitOpenError):
+        client.generate(["画像"])
+    assert len(model.calls) == 2
+
+    # 待機時間が過ぎると1件だけ試しに通し、成功すれば元に戻る
+    time.sleep(0.25)
+    gate = threading.Event()
+    model.gate, model.outcomes = gate, ["ワリオスタジアム"]
+    trial = client.submit(["画像"])
+    with pytest.raises(CircuitOpenError):
+        client.generate(["画像"])  # 試行中の要求がある間は通さない
+    gate.set()
+    assert trial.result(timeout=5) == "ワリオスタジアム"
+    assert not client.is_open
+    assert client.generate(["画像"]) == "ワリオスタジアム"
+
+
+def test_failed_trial_reopens_the_circuit():
+    model = StubModel(RuntimeError("500"))
+    client = make_client(model, max_attempts=1, failure_threshold=1, open_seconds=0.1)
+    with pytest.raises(RuntimeError):
+        client.generate(["画像"])
+    time.sleep(0.15)
+    with pytest.raises(RuntimeError):
+        client.generate(["画像"])  # 試行も失敗
+    with pytest.raises(CircuitOpenError):
+        client.generate(["画像"])
+    assert len(model.calls) == 2
@@ -0,0 +1,78 @@
+import pytest
+
+cv2 = pytest.importorskip('cv2')
+np = pytest.importorskip('numpy')
+
+import config
+import imaging
+from geometry import FrameGeometry, MappedFrame, map_frame, to_array
+
+
+def wave_frame(width=1920, height=1080, period=96):
+    """位置ごとに色が周期的に変わるフレーム。リサイズの誤差は小さく、切り抜く位置が数ピクセルずれると大きな差になる。"""
+    x = 127.5 + 127.5 * np.sin(2 * np.pi * np.arange(width, dtype=np.float32) / period)
+    y = 127.5 + 127.5 * np.sin(2 * np.pi * np.arange(height, dtype=np.float32) / period)
+    horizontal = np.broadcast_to(x[None, :], (height, width))
+    vertical = np.broadcast_to(y[:, None], (height, width))
+    return np.stack([horizontal, vertical, (horizontal + vertical) / 2], axis=2).astype(np.uint8)
+
+RESOLUTIONS = [(1280, 720), (1600, 900), (2560, 1440), (3840, 2160)]
+REGIONS = [config.RESULT_COORDS['rank_1'], config.RESULT_COORDS['rate_13'], (0, 0, 1920, 1080), (1350, 350, 1650, 400)]
+
+
+def test_1080p_frames_pass_through():
+    frame = wave_frame()
+    assert map_frame(frame) is frame
+    assert FrameGeometry(1920, 1080).is_identity
+
+
+@pytest.mark.parametrize('size', RESOLUTIONS)
+def test_to_source_scales_coordinates(size):
+    width, height = size
+    geometry = FrameGeometry(width, height)
+    assert geometry.to_source(0, 0, 1920, 1080) == (0, 0, width, height)
+    assert geometry.to_source(960, 540, 1920, 1080) == (width // 2, height // 2, width, height)
+
+
+@pytest.mark.parametrize('size', RESOLUTIONS)
+@pytest.mark.parametrize('region', REGIONS)
+def test_crops_match_resized_frame(size, region):
+    base = wave_frame()
+    mapped = map_frame(cv2.resize(base, size, interpolation=cv2.INTER_AREA))
+    assert isinstance(mapped, MappedFrame) and mapped.shape == base.shape
+    x1, y1, x2, y2 = region
+    crop = mapped[y1:y2, x1:x2]
+    assert crop.shape == (y2 - y1, x2 - x1, 3)
+    assert np.abs(crop.astype(np.int16) - base[y1:y2, x1:x2]).mean() < 4.0  # 4px ずれると約19
+
+
+@pytest.mark.parametrize('size, content', [
+    ((1920, 1200), (0, 60, 1920, 1080)),   # 16:10 (上下に黒帯)
+    ((2560, 1080), (320, 0, 1920, 1080)),  # 21:9 (左右に黒帯)
+])
+def test_letterboxed_frames_crop_the_game_area(size, content):
+    base = wave_frame()
+    raw = np.zeros((size[1], size[0], 3), np.uint8)
+    cx, cy, cw, ch = content
+    raw[cy:cy + ch, cx:cx + cw] = base
+    mapped = map_frame(raw)
+    assert mapped.geometry.content == content
+    x1, y1, x2, y2 = config.RESULT_COORDS['rate_change_5']
+    assert np.array_equal(mapped[y1:y2, x1:x2], base[y1:y2, x1:x2])
+    assert np.array_equal(to_array(mapped), base)
+
+
+@pytest.mark.parametrize('size', RESOLUTIONS)
+def test_highlight_row_is_found_at_any_resolution(size):
+    base = np.zeros((1080, 1920, 3), np.uint8)
+    x1, y1, x2, y2 = config.RESULT_COORDS['rank_7']
+    base[y1:y2, :] = cv2.cvtColor(np.uint8([[[25, 200, 220]]]), cv2.COLOR_HSV2BGR)[0, 0]
+    mapped = map_frame(cv2.resize(base, size, interpolation=cv2.INTER_AREA))
+    assert imaging.locate_highlight_row(mapped) == (True, 7)
+
+
+def test_only_2d_slices_are_supported():
+    mapped = map_frame(wave_frame(1280, 720))
+    with pytest.raises(TypeError):
+        mapped[10]
+    assert mapped[100:100, 0:10].size == 0
@@ -0,0 +1,244 @@
+import csv
+import json
+import os
+import sqlite3
+import time
+
+import pytest
+
+from history import CSV_HEADER, RaceHistory, RunningStats
+
+
+def _row(n, rate, course='ワリオシップ'):
+    return [f"result_{n}.png", f"2026-01-01 00:{n:02d}:00", course, 1, 12, rate, 0]
+
+
+def _read_csv(path):
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        return list(csv.reader(f))
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return str(tmp_path / 'race_data.sqlite3'), str(tmp_path / 'race_data.csv')
+
+
+@pytest.fixture
+def store(paths):
+    history = RaceHistory(*paths)
+    yield history
+    history.close()
+
+
+def test_append_mirrors_csv(store, paths):
+    store.append(_row(1, 1000))
+    store.append(_row(2, 1010))
+    rows = _read_csv(paths[1])
+    assert rows[0] == CSV_HEADER
+    assert [r[0] for r in rows[1:]] == ['result_1.png', 'result_2.png']
+    assert store.last()['Rate'] == 1010
+    assert store.find_by_filename('result_1.png')['Timestamp'] == '2026-01-01 00:01:00'
+    assert store.previous('result_2.png')['Filename'] == 'result_1.png'
+
+
+def test_existing_csv_is_imported_on_open(paths):
+    with open(paths[1], 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_HEADER)
+        writer.writerows([_row(1, 1000), _row(2, 1020)])
+    history = RaceHistory(*paths)
+    try:
+        assert history.count() == 2
+        assert history.last()['Rate'] == 1020
+    finally:
+        history.close()
+
+
+def test_external_csv_edit_replaces_db(store, paths):
+    store.append(_row(1, 1000))
+    with open(paths[1], 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_HEADER)
+        writer.writerows([_row(5, 1500), _row(6, 1600), _row(7, 1400)])
+    assert store.count() == 3
+    assert [r['Filename'] for r in store.recent(2)] == ['result_7.png', 'result_6.png']
+    assert store.summary() == (3, 1500, 1600, 1400)
+
+
+def test_deleted_csv_clears_db(store, paths):
+    store.append(_row(1, 1000))
+    os.remove(paths[1])
+    assert store.count() == 0
+    assert store.last() is None
+
+
+def test_db_wins_over_external_csv_change_while_edits_are_pending(store, paths):
+    store.append(_row(1, 1000))
+    store.delete_by_filename('result_1.png')  # CSVには未反映
+    with open(paths[1], 'a', newline='', encoding='utf-8-sig') as f:
+        csv.writer(f).writerow(_row(2, 2000))
+    assert store.count() == 0
+    store.flush_csv()
+    assert _read_csv(paths[1]) == [CSV_HEADER]
+
+
+def test_range_and_by_course(store):
+    store.append(_row(1, 1000, 'A'))
+    store.append(_row(2, 1010, 'B'))
+    store.append(_row(3, 1020, 'A'))
+    assert [r['Filename'] for r in store.range('2026-01-01 00:02:00', '2026-01-01 00:03:00')] == ['result_2.png', 'result_3.png']
+    assert [r['Filename'] for r in store.by_course('A')] == ['result_1.png', 'result_3.png']
+
+
+def test_clear_removes_csv(store, paths):
+    store.append(_row(1, 1000))
+    store.clear()
+    assert store.count() == 0
+    assert store.last() is None
+    assert not os.path.exists(paths[1])
+
+
+# --- 統計 ---
+def test_running_stats_window():
+    stats = RunningStats(window=3)
+    for row_id, rate in enumerate([1000, 1100, None, 1200, 1300], 1):
+        stats.add(row_id, rate)
+    assert stats.count == 5
+    assert stats.last_id == 5
+    assert stats.average == 1200
+    assert (stats.max_rate, stats.min_rate) == (1300, 1000)
+
+    stats.replace_recent(4, 1500)
+    assert stats.average == (1100 + 1500 + 1300) / 3
+
+
+def test_running_stats_json_roundtrip():
+    stats = RunningStats(window=3)
+    for row_id, rate in enumerate([1000, 1100, 1200, 1300], 1):
+        stats.add(row_id, rate)
+    restored = RunningStats.from_json(stats.to_json(), window=3)
+    assert (restored.count, restored.last_id, restored.average, restored.max_rate, restored.min_rate) == \
+           (stats.count, stats.last_id, stats.average, stats.max_rate, stats.min_rate)
+    restored.add(5, 1400)
+    assert restored.average == 1300
+
+
+def _set_checkpoint(db_path, **changes):
+    conn = sqlite3.connect(db_path)
+    with conn:
+        data = json.loads(conn.execute("SELECT value FROM meta WHERE key = 'stats'").fetchone()[0])
+        data.update(changes)
+        conn.execute("UPDATE meta SET value = ? WHERE key = 'stats'", (json.dumps(data),))
+    conn.close()
+
+
+def test_reopen_uses_checkpoint(paths):
+    history = RaceHistory(*paths)
+    history.append(_row(1, 1000))
+    history.append(_row(2, 1100))
+    history.close()
+
+    _set_checkpoint(paths[0], count=99)
+    history = RaceHistory(*paths)
+    try:
+        assert history.summary()[0] == 99  # チェックポイントをそのまま使い、全件を数え直さない
+    finally:
+        history.close()
+
+
+def test_stale_checkpoint_is_rebuilt(paths):
+    history = RaceHistory(*paths)
+    history.append(_row(1, 1000))
+    history.append(_row(2, 1100))
+    history.close()
+
+    _set_checkpoint(paths[0], count=99, last_id=1)
+    history = RaceHistory(*paths)
+    try:
+        assert history.summary() == (2, 1050, 1100, 1000)
+    finally:
+        history.close()
+
+
+def test_extrema_follow_updates_and_deletes(store):
+    for n, rate in enumerate([1000, 1200, 1100], 1):
+        store.append(_row(n, rate))
+    store.update_by_filename('result_2.png', {'Rate': 1050})
+    assert store.summary() == (3, (1000 + 1050 + 1100) / 3, 1100, 1000)
+    store.delete_by_filename('result_1.png')
+    assert store.summary() == (2, (1050 + 1100) / 2, 1100, 1050)
+
+
+# --- 1レースの編集 ---
+def test_edit_race_recomputes_rate_change(store):
+    for n, rate in enumerate([1000, 1100, 1150], 1):
+        store.append(_row(n, rate))
+    edited = store.edit_race('result_2.png', {'Rate': '1080', 'Course': 'レインボーロード', 'Rate Change': 999})
+    assert edited['Rate'] == 1080
+    assert edited['Rate Change'] == 80           # 前の行のレートから計算し直す (指定値は使わない)
+    assert edited['Course'] == 'レインボーロード'
+    assert store.find_by_filename('result_3.png')['Rate Change'] == 70
+    assert store.summary()[2:] == (1150, 1000)
+
+
+def test_edit_race_first_and_last_rows(store):
+    store.append(_row(1, 1000))
+    store.append(_row(2, 1100))
+    store.edit_race('result_1.png', {'Rate': 900})
+    assert store.find_by_filename('result_1.png')['Rate Change'] == 0   # 前の行がなければ変更しない
+    assert store.find_by_filename('result_2.png')['Rate Change'] == 200
+    assert store.edit_race('result_2.png', {'Rate': 950})['Rate Change'] == 50
+    assert store.summary()[2:] == (950, 900)
+
+
+def test_edit_race_unknown_filename(store):
+    store.append(_row(1, 1000))
+    assert store.edit_race('missing.png', {'Rate': 1}) is None
+
+
+def test_edit_race_marks_csv_until_flushed(store, paths):
+    store.append(_row(1, 1000))
+    store.append(_row(2, 1100))
+    store.edit_race('result_2.png', {'Rate': 1050})
+    assert _read_csv(paths[1])[2][5] == '1100'
+    store.flush_csv()
+    assert _read_csv(paths[1])[2][5:] == ['1050', '50']
+
+
+def test_unflushed_edit_is_written_on_next_open(paths):
+    history = RaceHistory(*paths)
+    history.append(_row(1, 1000))
+    history.append(_row(2, 1100))
+    history.edit_race('result_2.png', {'Rate': 1050})
+    history._conn.close()  # flush_csvを呼ばずに終了した場合
+
+    reopened = RaceHistory(*paths)
+    try:
+        assert _read_csv(paths[1])[2][5:] == ['1050', '50']
+        assert reopened.find_by_filename('result_2.png')['Rate'] == 1050
+    finally:
+        reopened.close()
+
+
+def test_edit_race_leaves_csv_dirty_and_flush_writes_successor(store, paths):
+    for n, rate in enumerate([1000, 1100, 1150], 1):
+        store.append(_row(n, rate))
+    store.edit_race('result_2.png', {'Rate': 1080})
+    assert store._get_meta('csv_dirty') == '1'
+    assert _read_csv(paths[1])[3][5:] == ['1150', '0']
+
+    store.flush_csv()
+    assert store._get_meta('csv_dirty') is None
+    assert [row[5:] for row in _read_csv(paths[1])[2:]] == [['1080', '80'], ['1150', '70']]
+
+
+def test_schedule_flush_csv_writes_in_background(store, paths):
+    store.append(_row(1, 1000))
+    store.append(_row(2, 1100))
+    store.edit_race('result_2.png', {'Rate': 1050})
+    store.schedule_flush_csv(delay=0.05)
+    store.schedule_flush_csv(delay=0.05)  # 続けて呼んでも1回にまとめる
+    deadline = time.monotonic() + 5
+    while store._get_meta('csv_dirty') and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert _read_csv(paths[1])[2][5:] == ['1050', '50']
@@ -0,0 +1,208 @@
+import os
+
+import pytest
+
+cv2 = pytest.importorskip('cv2')
+np = pytest.importorskip('numpy')
+
+import artifacts
+import config
+import geometry
+import imaging
+
+
+def _bgr(h, s, v):
+    return cv2.cvtColor(np.uint8([[[h, s, v]]]), cv2.COLOR_HSV2BGR)[0, 0]
+
+HIGHLIGHT_BGR = _bgr(25, 200, 220)
+
+
+# --- ハイライト行の検出 (以前の1行ずつ調べる実装と比較する) ---
+def baseline_highlight_row(img):
+    """以前のcrop_image_for_resultの、行ごとにHSVに変換して調べる処理。"""
+    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+    for i in range(1, 14):
+        x1, y1, x2, y2 = config.RESULT_COORDS[f'rank_{i}']
+        if y2 > img.shape[0] or x2 > img.shape[1]: continue
+        mask = cv2.inRange(hsv[y1:y2, x1:x2], np.array(config.LOWER_HIGHLIGHT), np.array(config.UPPER_HIGHLIGHT))
+        if cv2.countNonZero(mask) > ((x2 - x1) * (y2 - y1) * 0.2):
+            return i
+    return None
+
+def baseline_check_for_highlight(img):
+    """以前のcheck_for_highlightの、順位列からレート列までの範囲を調べる処理。"""
+    y1, y2 = config.RESULT_COORDS['rank_1'][1], config.RESULT_COORDS['rank_13'][3]
+    x1, x2 = config.RESULT_COORDS['rank_1'][0], config.RESULT_COORDS['rate_1'][2]
+    hsv = cv2.cvtColor(img[y1:y2, x1:x2], cv2.COLOR_BGR2HSV)
+    return cv2.countNonZero(cv2.inRange(hsv, np.array(config.LOWER_HIGHLIGHT), np.array(config.UPPER_HIGHLIGHT))) > 500
+
+
+def random_result_frame(rng):
+    """順位枠のいくつかを、しきい値(20%)の前後の割合でハイライト色に塗ったフレーム。下端を切ることもある。"""
+    img = rng.integers(0, 60, (1080, 1920, 3), dtype=np.uint8)
+    for i in rng.choice(13, size=rng.integers(0, 4), replace=False):
+        x1, y1, x2, y2 = config.RESULT_COORDS[f'rank_{i + 1}']
+        filled = int((y2 - y1) * rng.uniform(0.05, 0.5))
+        img[y1:y1 + filled, x1:x2] = HIGHLIGHT_BGR
+    height = 1080 if rng.random() < 0.5 else int(rng.integers(200, 1080))
+    return np.ascontiguousarray(img[:height])
+
+
+@pytest.mark.parametrize('seed', range(40))
+def test_locate_highlight_row_matches_per_row_scan(seed):
+    img = random_result_frame(np.random.default_rng(seed))
+    present, row = imaging.locate_highlight_row(img)
+    assert row == baseline_highlight_row(img)
+    if img.shape[0] == 1080:
+        # ハイライトは順位枠の中だけに塗っているため、以前の広い範囲で数えた場合と一致する
+        assert present == baseline_check_for_highlight(img)
+
+
+def test_locate_highlight_row_finds_each_row():
+    for i in range(1, 14):
+        img = np.zeros((1080, 1920, 3), np.uint8)
+        x1, y1, x2, y2 = config.RESULT_COORDS[f'rank_{i}']
+        img[y1:y2, x1:x2] = HIGHLIGHT_BGR
+        assert imaging.locate_highlight_row(img) == (True, i)
+        rank, crops = imaging.crop_image_for_result(img)
+        assert rank == i and set(crops) == {'rank', 'rate', 'rate_change'}
+
+
+def test_locate_highlight_row_without_highlight():
+    assert imaging.locate_highlight_row(np.zeros((1080, 1920, 3), np.uint8)) == (False, None)
+
+
+# --- コース決定画面の枠の解析 (以前の1枠ずつ調べる実装と比較する) ---
+def baseline_course_screen(img):
+    """以前のanalyze_course_decision_screenの、(参加人数, 最も明るい枠, 単独レースか) を求める処理。"""
+    brightest, max_brightness, participant_count = None, 0, 0
+    for index, coords in enumerate(config.ALL_PLAYER_SLOTS):
+        x1, y1, x2, y2 = coords['x1'], coords['y1'], coords['x2'], coords['y2']
+        if y2 > img.shape[0] or x2 > img.shape[1]: continue
+        gray_roi = cv2.cvtColor(img[y1:y2, x1:x2], cv2.COLOR_BGR2GRAY)
+        if np.mean(gray_roi) > 50:
+            participant_count += 1
+            if np.max(gray_roi) > max_brightness:
+                max_brightness, brightest = np.max(gray_roi), index
+    area = config.SINGLE_COURSE_NAME_AREA
+    center_area = img[max(0, area['y1']):min(img.shape[0], area['y2']), max(0, area['x1']):min(img.shape[1], area['x2'])]
+    is_single_course = False
+    if center_area.size > 0:
+        mask = cv2.inRange(cv2.cvtColor(center_area, cv2.COLOR_BGR2HSV), np.array([0, 0, 0]), np.array([180, 255, 70]))
+        is_single_course = cv2.countNonZero(mask) > 5000
+    return participant_count, brightest, is_single_course
+
+
+def random_course_frame(rng):
+    """各枠の明るさ・コース名の欄の暗さを、しきい値の前後でばらつかせたフレーム。下端を切ることもある。"""
+    img = rng.integers(0, 256, (1080, 1920, 3), dtype=np.uint8)
+    for coords in config.ALL_PLAYER_SLOTS:
+        x1, y1, x2, y2 = coords['x1'], coords['y1'], coords['x2'], coords['y2']
+        level = int(rng.integers(20, 90))
+        img[y1:y2, x1:x2] = rng.integers(max(0, level - 20), level + 20, (y2 - y1, x2 - x1, 3), dtype=np.uint8)
+        if rng.random() < 0.3:
+            img[y1 + 5, x1:x2] = rng.integers(150, 256)  # 数字の代わりの明るい線
+    area = config.SINGLE_COURSE_NAME_AREA
+    dark = img[area['y1']:area['y2'], area['x1']:area['x2']]
+    dark[rng.random(dark.shape[:2]) < rng.uniform(0.2, 0.5)] = rng.integers(0, 71, 3)
+    height = 1080 if rng.random() < 0.5 else int(rng.integers(300, 1080))
+    return np.ascontiguousarray(img[:height])
+
+
+@pytest.mark.parametrize('seed', range(40))
+def test_slot_analysis_matches_per_slot_loop(seed):
+    img = random_course_frame(np.random.default_rng(seed))
+    participant_count, brightest, is_single_course = baseline_course_screen(img)
+
+    slots = imaging.analyze_player_slots(img)
+    assert (slots.participant_count, slots.brightest) == (participant_count, brightest)
+    rate_roi, _, count, single = imaging.analyze_course_decision_screen(img)
+    assert (count, single) == (participant_count, is_single_course)
+    if brightest is None:
+        assert rate_roi is None
+    else:
+        c = config.ALL_PLAYER_SLOTS[brightest]
+        assert np.array_equal(rate_roi, img[c['y1']:c['y2'], c['x1']:c['x2']])
+
+
+def test_confidence_counts_lit_slots_with_digits():
+    img = np.zeros((1080, 1920, 3), np.uint8)
+    assert imaging.analyze_player_slots(img).confidence == 0.0
+    for coords in config.ALL_PLAYER_SLOTS[:3]:
+        x1, y1, x2, y2 = coords['x1'], coords['y1'], coords['x2'], coords['y2']
+        img[y1:y2, x1:x2] = 120
+        img[y1:y2, x1:x2:4] = 250  # 縦線 (数字のエッジの代わり)
+    slots = imaging.analyze_player_slots(img)
+    assert (slots.participant_count, slots.text_slot_count) == (3, 3)
+    assert slots.confidence == 1.0
+    assert imaging.classify_screen(img) == imaging.SCREEN_COURSE_DECISION
+
+
+# --- メモリ上のフレームの受け渡し ---
+def highlighted_result_frame(row=5):
+    img = np.zeros((1080, 1920, 3), np.uint8)
+    x1, y1, x2, y2 = config.RESULT_COORDS[f'rank_{row}']
+    img[y1:y2, x1:x2] = HIGHLIGHT_BGR
+    return img
+
+
+def test_crops_are_views_and_nothing_is_written_by_default(monkeypatch):
+    submitted = []
+    monkeypatch.setattr(imaging.artifacts, 'submit', lambda path, image, on_done=None: submitted.append(path))
+    img = highlighted_result_frame()
+    rank, crops = imaging.crop_image_for_result(img)
+    assert rank == 5
+    assert all(np.shares_memory(roi, img) for roi in crops.values())  # 複製もファイルへの書き出しもしない
+    assert submitted == []
+
+    imaging.crop_image_for_result(img, save_dir='保存先', base_filename='result_0001')
+    assert sorted(os.path.basename(p) for p in submitted) == [
+        'result_0001_rank.png', 'result_0001_rate.png', 'result_0001_rate_change.png']
+
+
+def test_load_image_accepts_arrays_mapped_frames_and_unicode_paths(tmp_path):
+    img = highlighted_result_frame(row=2)
+    path = str(tmp_path / 'リザルト画面.png')
+    assert artifacts.write_image(path, img)
+    assert imaging.load_image(img) is img
+    assert imaging.crop_image_for_result(path)[0] == 2
+    assert imaging.crop_image_for_result(geometry.map_frame(cv2.resize(img, (1280, 720))))[0] == 2
+    assert imaging.load_image(str(tmp_path / 'missing.png')) is None
+
+
+# --- 画面の種類の判定 ---
+def draw_digits(img, box):
+    """枠の中に縦線 (数字のエッジの代わり) を描く。"""
+    x1, y1, x2, y2 = box
+    img[y1:y2, x1:x2] = 120
+    img[y1:y2, x1:x2:4] = 250
+
+
+def test_classify_result_screen_needs_rates_and_highlight():
+    img = highlighted_result_frame(row=3)
+    assert imaging.classify_screen(img) == imaging.SCREEN_OTHER  # レート列に数字がない
+    for i in range(1, 4):
+        draw_digits(img, config.RESULT_COORDS[f'rate_{i}'])
+    assert imaging.count_text_rate_rows(img) == 3
+    assert imaging.classify_screen(img) == imaging.SCREEN_RESULT
+
+    x1, y1, x2, y2 = config.RESULT_COORDS['rank_3']
+    img[y1:y2, x1:x2] = 0  # ハイライトがなければリザルト画面とみなさない
+    assert imaging.classify_screen(img) == imaging.SCREEN_OTHER
+
+
+def test_classify_course_screen_needs_lit_slots_with_digits():
+    img = np.zeros((1080, 1920, 3), np.uint8)
+    first = config.ALL_PLAYER_SLOTS[0]
+    draw_digits(img, (first['x1'], first['y1'], first['x2'], first['y2']))
+    assert imaging.classify_screen(img) == imaging.SCREEN_OTHER  # 数字のある枠が1つだけ
+    second = config.ALL_PLAYER_SLOTS[1]
+    img[second['y1']:second['y2'], second['x1']:second['x2']] = 120  # 明るいが数字のない枠
+    assert imaging.classify_screen(img) == imaging.SCREEN_OTHER
+    draw_digits(img, (second['x1'], second['y1'], second['x2'], second['y2']))
+    assert imaging.classify_screen(img) == imaging.SCREEN_COURSE_DECISION
+
+
+def test_classify_blank_and_noise_frames_as_other():
+    assert imaging.classify_screen(np.zeros((1080, 1920, 3), np.uint8)) == imaging.SCREEN_OTHER
+    assert imaging.classify_screen(np.full((720, 1280, 3), 200, np.uint8)) == imaging.SCREEN_OTHER
@@ -0,0 +1,36 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+# 使用時に初めて読み込むモジュール (GUI・キャプチャ・OCR・APIクライアント)
+LAZY_MODULES = ('tkinter', 'google.generativeai', 'pytesseract', 'tesserocr', 'PIL.Image',
+                'win32gui', 'win32ui', 'pygrabber', 'pygetwindow')
+
+PROBE = """
+import json, sys
+for name in sys.argv[1].split(','):
+    __import__(name)
+print(json.dumps([m for m in sys.argv[2].split(',') if m in sys.modules]))
+"""
+
+
+def loaded_lazy_modules(*modules):
+    """新しいプロセスでmodulesを読み込み、読み込まれてしまったLAZY_MODULESを返す。"""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([SRC_DIR] + sys.path))
+    completed = subprocess.run([sys.executable, '-c', PROBE, ','.join(modules), ','.join(LAZY_MODULES)],
+                               cwd=SRC_DIR, env=env, capture_output=True, text=True, encoding='utf-8')
+    assert completed.returncode == 0, completed.stderr
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def test_clients_import_without_heavy_dependencies():
+    assert loaded_lazy_modules('gemini_client', 'course_matcher', 'history', 'metrics', 'profiler') == []
+
+
+def test_headless_pipeline_imports_without_gui_or_ocr_backends():
+    pytest.importorskip('cv2')
+    assert loaded_lazy_modules('analysis', 'monitor', 'session', 'replay', 'benchmark') == []
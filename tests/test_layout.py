@@ -0,0 +1,82 @@
+import copy
+import json
+
+import pytest
+
+pytest.importorskip('cv2')
+
+import config
+from layout import compile_layout, load_layout
+
+
+def _spec():
+    return copy.deepcopy({
+        'BASE_COORDS': config.BASE_COORDS,
+        'BASE_Y_STEP': config.BASE_Y_STEP,
+        'ALL_PLAYER_SLOTS': config.ALL_PLAYER_SLOTS,
+        'COURSE_SEARCH_AREA': config.COURSE_SEARCH_AREA,
+        'SINGLE_COURSE_NAME_AREA': config.SINGLE_COURSE_NAME_AREA,
+    })
+
+
+def test_compiles_config():
+    layout = compile_layout(vars(config))
+    assert layout.rows == config.RESULT_ROWS
+    assert len(layout.player_slots) == len(config.ALL_PLAYER_SLOTS)
+    for i in range(1, config.RESULT_ROWS + 1):
+        assert layout.rank[i - 1] == config.RESULT_COORDS[f'rank_{i}']
+        assert layout.rate[i - 1] == config.RESULT_COORDS[f'rate_{i}']
+        assert layout.rate_change[i - 1] == config.RESULT_COORDS[f'rate_change_{i}']
+
+
+def test_result_rows_and_player_slot_fallback():
+    spec = _spec()
+    del spec['ALL_PLAYER_SLOTS']
+    spec['COURSE_DECISION_RATE_COORDS_LEFT'] = config.COURSE_DECISION_RATE_COORDS_LEFT
+    spec['COURSE_DECISION_RATE_COORDS_RIGHT'] = config.COURSE_DECISION_RATE_COORDS_RIGHT
+    spec['RESULT_ROWS'] = 5
+    layout = compile_layout(spec)
+    assert layout.rows == 5
+    assert len(layout.player_slots) == len(config.ALL_PLAYER_SLOTS)
+
+
+def test_scales_coordinates_measured_at_another_resolution():
+    spec = {
+        'BASE_SIZE': [1280, 720],
+        'BASE_COORDS': {kind: {'x1': 100, 'y1': 100, 'x2': 140, 'y2': 120} for kind in ('rank', 'rate', 'rate_change')},
+        'BASE_Y_STEP': 40,
+        'RESULT_ROWS': 3,
+        'ALL_PLAYER_SLOTS': [[10, 10, 50, 30], [60, 10, 100, 30]],
+        'COURSE_SEARCH_AREA': [0, 0, 640, 360],
+        'SINGLE_COURSE_NAME_AREA': [100, 100, 200, 120],
+    }
+    layout = compile_layout(spec, source='test')
+    assert layout.rank[0] == (150, 150, 210, 180)
+    assert layout.rank[2] == (150, 270, 210, 300)
+    assert layout.row_step == 60
+    assert layout.player_slots[1] == (90, 15, 150, 45)
+    assert layout.course_search_area == (0, 0, 960, 540)
+
+
+@pytest.mark.parametrize('mutate, message', [
+    (lambda s: s['ALL_PLAYER_SLOTS'].__setitem__(0, {'x1': 0, 'y1': 0, 'x2': 2000, 'y2': 40}), 'player_slots'),
+    (lambda s: s['ALL_PLAYER_SLOTS'].__setitem__(0, {'x1': 10, 'y1': 0, 'x2': 10, 'y2': 40}), 'player_slots'),
+    (lambda s: s['ALL_PLAYER_SLOTS'].__setitem__(0, {'x1': 0, 'y1': 0, 'x2': 90, 'y2': 40}), 'プレイヤー枠'),
+    (lambda s: s.__setitem__('COURSE_SEARCH_AREA', {'x1': -1, 'y1': 0, 'x2': 10, 'y2': 10}), 'course_search_area'),
+    (lambda s: s.__setitem__('BASE_Y_STEP', 5), 'BASE_Y_STEP'),
+    (lambda s: s.__setitem__('BASE_Y_STEP', 200), 'rank'),  # 下の行が画面外に出る
+    (lambda s: s.pop('SINGLE_COURSE_NAME_AREA'), '不完全'),
+])
+def test_invalid_layouts_are_rejected(mutate, message):
+    spec = _spec()
+    mutate(spec)
+    with pytest.raises(ValueError, match=message):
+        compile_layout(spec, source='test')
+
+
+def test_load_layout_from_json(tmp_path):
+    path = tmp_path / 'layout.json'
+    path.write_text(json.dumps(_spec()), encoding='utf-8')
+    layout = load_layout(str(path))
+    assert layout.source == 'layout.json'
+    assert layout.rank[0] == compile_layout(vars(config)).rank[0]
@@ -0,0 +1,71 @@
+import json
+
+import pytest
+
+import metrics
+from metrics import Histogram
+
+
+@pytest.fixture(autouse=True)
+def clean_metrics(monkeypatch):
+    monkeypatch.setattr(metrics, '_export_path', None)
+    metrics.reset()
+    yield
+    metrics.disable()
+    metrics.reset()
+
+
+def test_disabled_calls_record_nothing():
+    metrics.inc('frames_sampled_total', session='a')
+    metrics.observe('stage_seconds', 0.1, stage='ocr')
+    with metrics.stage('ocr'):
+        pass
+    assert metrics.snapshot()['counters'] == [] and metrics.snapshot()['histograms'] == []
+
+
+def test_counters_and_stage_timers():
+    metrics.enable()
+    metrics.inc('frames_sampled_total', session='a')
+    metrics.inc('frames_sampled_total', 2, session='a')
+    metrics.inc('frames_sampled_total', session='b')
+    with metrics.stage('classify'):
+        pass
+    snapshot = metrics.snapshot()
+    assert [(c['labels'], c['value']) for c in snapshot['counters']] == [({'session': 'a'}, 3), ({'session': 'b'}, 1)]
+    [histogram] = snapshot['histograms']
+    assert histogram['name'] == 'stage_seconds' and histogram['labels'] == {'stage': 'classify'}
+    assert histogram['count'] == 1
+
+
+def test_histogram_buckets_and_quantiles():
+    histogram = Histogram(buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 0.7, 5.0):
+        histogram.observe(value)
+    assert histogram.cumulative() == [(0.1, 2), (1.0, 4), (float('inf'), 5)]
+    assert histogram.quantile(0.5) == 1.0
+    assert histogram.quantile(1.0) == 1.0  # +Infの区切りは最後の上限で近似する
+    assert Histogram().quantile(0.5) is None
+
+
+def test_prometheus_text():
+    metrics.enable()
+    metrics.inc('ocr_failures_total', field='rate "A"')
+    metrics.observe('gemini_request_seconds', 0.3)
+    text = metrics.render_prometheus()
+    assert '# TYPE mkworld_ocr_failures_total counter' in text
+    assert 'mkworld_ocr_failures_total{field="rate \\"A\\""} 1' in text
+    assert 'mkworld_gemini_request_seconds_bucket{le="0.5"} 1' in text
+    assert 'mkworld_gemini_request_seconds_bucket{le="0.25"} 0' in text
+    assert 'mkworld_gemini_request_seconds_count 1' in text
+
+
+def test_disable_writes_the_final_values(tmp_path):
+    path = str(tmp_path / 'metrics.json')
+    metrics.enable(path, interval=60)
+    metrics.inc('races_recorded_total')
+    metrics.disable()
+    with open(path, encoding='utf-8') as f:
+        counters = json.load(f)['counters']
+    assert counters == [{'name': 'races_recorded_total', 'labels': {}, 'value': 1}]
+    metrics.inc('races_recorded_total')  # 無効化した後は記録しない
+    assert metrics.snapshot()['counters'][0]['value'] == 1
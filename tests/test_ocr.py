@@ -0,0 +1,183 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+cv2 = pytest.importorskip('cv2')
+np = pytest.importorskip('numpy')
+
+import ocr
+from ocr import DigitTemplateRecognizer, segment_glyphs
+
+
+def render(text, inverted=False):
+    """OpenCVのフォントで数字を描いた二値画像 (ゲーム内の固定フォントの代わり)。"""
+    image = np.zeros((40, 28 * len(text) + 10), np.uint8)
+    cv2.putText(image, text, (5, 32), cv2.FONT_HERSHEY_SIMPLEX, 1.1, 255, 2)
+    return 255 - image if inverted else image
+
+
+@pytest.fixture
+def template_dir(tmp_path):
+    return str(tmp_path / 'テンプレート')  # 日本語を含むパスでも読み書きできること
+
+
+@pytest.fixture
+def trained(template_dir):
+    recognizer = DigitTemplateRecognizer(template_dir)
+    for text in ('+0123', '-4567', '89'):
+        recognizer.learn(render(text), text)
+    return recognizer
+
+
+@pytest.mark.parametrize('text', ['7', '1234', '+56', '-80'])
+def test_segment_glyphs_splits_characters(text):
+    glyphs = segment_glyphs(render(text))
+    assert len(glyphs) == len(text)
+    assert all(g.shape == (ocr.GLYPH_SIZE[1], ocr.GLYPH_SIZE[0]) for g in glyphs)
+
+
+def test_segment_glyphs_handles_light_background():
+    assert len(segment_glyphs(render('905', inverted=True))) == 3
+    assert segment_glyphs(np.zeros((40, 100), np.uint8)) == []
+
+
+def test_learn_then_recognize(trained):
+    assert trained.is_complete(ocr.SIGNED_DIGITS)
+    text, confidence = trained.recognize(render('3850'))
+    assert text == '3850'
+    assert confidence >= ocr.DIGIT_TEMPLATE_MIN_CONFIDENCE
+
+
+@pytest.mark.parametrize('text', ['+12', '-97', '+0'])
+def test_signed_recognition(trained, text):
+    assert trained.recognize(render(text), signed=True)[0] == text
+
+
+def test_unsigned_field_rejects_signs(trained):
+    assert trained.recognize(render('+12'))[0] is None
+
+
+def test_templates_persist(trained, template_dir):
+    reloaded = DigitTemplateRecognizer(template_dir)
+    assert sorted(reloaded._labels) == sorted(trained._labels)
+    assert reloaded.recognize(render('2024'))[0] == '2024'
+
+
+def test_incomplete_alphabet_is_not_trusted(template_dir):
+    recognizer = DigitTemplateRecognizer(template_dir)
+    recognizer.learn(render('012456789'), '012456789')  # 3だけ未学習
+    assert recognizer.recognize(render('1024')) == (None, 0.0)
+    recognizer.learn(render('3'), '3')
+    assert recognizer.recognize(render('1024'))[0] == '1024'
+
+
+def test_ambiguous_glyph_is_rejected(trained):
+    # 6のテンプレートを8の形にすると、8の文字は6と8の間で差がつかない
+    index = trained._labels.index('6')
+    trained._vectors[index] = trained._vectors[trained._labels.index('8')]
+    assert trained.recognize(render('88')) == (None, 0.0)
+    assert trained.recognize(render('12'))[0] == '12'
+
+
+def test_low_confidence_is_rejected(trained):
+    noise = np.random.default_rng(0).integers(0, 2, (40, 60), dtype=np.uint8) * 255
+    text, confidence = trained.recognize(noise)
+    assert text is None or confidence < ocr.DIGIT_TEMPLATE_MIN_CONFIDENCE
+
+
+def test_conflicting_template_is_quarantined_not_deleted(template_dir):
+    recognizer = DigitTemplateRecognizer(template_dir)
+    recognizer.learn(render('3'), '8')  # 誤って学習した3の形の「8」
+    recognizer.learn(render('3'), '3')
+    assert recognizer._labels == []
+    quarantined = os.listdir(os.path.join(template_dir, ocr.QUARANTINE_SUBDIR))
+    assert [name.split('_')[0] for name in quarantined] == ['8']
+    assert DigitTemplateRecognizer(template_dir)._labels == []
+
+
+def test_read_digits_learns_only_confirmed_reads(monkeypatch, template_dir):
+    recognizer = DigitTemplateRecognizer(template_dir)
+    monkeypatch.setattr(ocr, 'get_digit_recognizer', lambda: recognizer)
+
+    class StubEngine:
+        def recognize(self, image, whitelist):
+            return '1234'
+    monkeypatch.setattr(ocr, 'get_engine', lambda tesseract_path=None: StubEngine())
+
+    assert ocr.read_digits(render('1234'), 'a_rate', value_range=ocr.RATE_RANGE) == '1234'
+    assert recognizer._labels == []
+    ocr.confirm_digits({'a_rate': '1235'})  # 値が一致しなければ学習しない
+    assert recognizer._labels == []
+
+    ocr.read_digits(render('1234'), 'b_rate', value_range=ocr.RATE_RANGE)
+    ocr.confirm_digits({'b_rate': '1234'})
+    assert sorted(recognizer._labels) == ['1', '2', '3', '4']
+
+
+def test_read_digits_ignores_out_of_range_values(monkeypatch, template_dir):
+    recognizer = DigitTemplateRecognizer(template_dir)
+    monkeypatch.setattr(ocr, 'get_digit_recognizer', lambda: recognizer)
+
+    class StubEngine:
+        def recognize(self, image, whitelist):
+            return '99'
+    monkeypatch.setattr(ocr, 'get_engine', lambda tesseract_path=None: StubEngine())
+
+    ocr.read_digits(render('99'), 'a_rank', value_range=ocr.RANK_RANGE)
+    ocr.confirm_digits({'a_rank': '99'})
+    assert recognizer._labels == []
+
+
+class CountingEngine:
+    is_resident = True
+    created = []
+
+    def __init__(self):
+        self.closed = False
+        CountingEngine.created.append(self)
+
+    def recognize(self, image, whitelist):
+        time.sleep(0.02)
+        return image
+
+    def recognize_batch(self, images, whitelist):
+        return list(images)
+
+    def close(self):
+        self.closed = True
+
+
+def test_engine_pool_is_bounded_and_closes_engines():
+    CountingEngine.created = []
+    pool = ocr.EnginePool(max_engines=2, factory=CountingEngine)
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        results = list(executor.map(lambda i: pool.recognize(str(i)), range(12)))
+    assert results == [str(i) for i in range(12)]
+    assert pool.size == len(CountingEngine.created) == 2  # 6スレッドから呼んでも2つまで
+
+    pool.close()
+    assert all(engine.closed for engine in CountingEngine.created)
+    assert pool.size == 0
+
+
+def test_read_fields_runs_in_parallel_under_one_deadline():
+    def slow(value, seconds):
+        time.sleep(seconds)
+        return value
+
+    def broken():
+        raise RuntimeError("読み取り失敗")
+
+    started = time.monotonic()
+    results = ocr.read_fields({
+        'rank': (slow, '3', 0.2),
+        'rate': (slow, '1234', 0.2),
+        'rate_change': (slow, '+12', 0.2),
+    }, deadline=5)
+    assert results == {'rank': '3', 'rate': '1234', 'rate_change': '+12'}
+    assert time.monotonic() - started < 0.5  # 3項目を並行に読み取る
+
+    results = ocr.read_fields({'rate': (slow, '1234', 0.0), 'late': (slow, 'x', 1.0), 'error': (broken,)}, deadline=0.3)
+    assert results == {'rate': '1234', 'late': None, 'error': None}
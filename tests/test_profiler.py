@@ -0,0 +1,55 @@
+import threading
+import time
+
+import profiler
+from profiler import SamplingProfiler
+
+
+def spin_for_profile(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_samples_target_threads_and_writes_reports(tmp_path):
+    stop = threading.Event()
+    worker = threading.Thread(target=spin_for_profile, args=(stop,), name="session_0")
+    other = threading.Thread(target=spin_for_profile, args=(stop,), name="unrelated")
+    worker.start(); other.start()
+    finished = []
+    try:
+        profile = SamplingProfiler(duration=5, interval=0.002, thread_prefixes=("session_",), output_dir=str(tmp_path),
+                                   on_finished=finished.append).start()
+        time.sleep(0.3)
+        profile.stop()
+        report_path, folded_path = profile.join(5)
+    finally:
+        stop.set()
+        worker.join(); other.join()
+
+    assert finished == [profile] and profile.samples > 0
+    with open(folded_path, encoding='utf-8') as f:
+        lines = f.read().splitlines()
+    assert lines and all(line.startswith("session_0;") for line in lines)  # 対象外のスレッドは記録しない
+    assert any("spin_for_profile (test_profiler.py" in line for line in lines)
+    with open(report_path, encoding='utf-8') as f:
+        assert "spin_for_profile" in f.read()
+
+
+def test_report_without_target_threads(tmp_path):
+    profile = SamplingProfiler(duration=0.05, interval=0.01, thread_prefixes=("no-such-thread",), output_dir=str(tmp_path)).start()
+    report_path, _ = profile.join(5)
+    with open(report_path, encoding='utf-8') as f:
+        assert "対象のスレッドが見つかりませんでした" in f.read()
+
+
+def test_profile_for_allows_one_profile_at_a_time(tmp_path):
+    first = profiler.profile_for(5, output_dir=str(tmp_path))
+    try:
+        assert first is not None
+        assert profiler.profile_for(5, output_dir=str(tmp_path)) is None
+    finally:
+        first.stop()
+        first.join(5)
+    second = profiler.profile_for(0.01, output_dir=str(tmp_path))
+    assert second is not None
+    second.join(5)
@@ -0,0 +1,93 @@
+import pytest
+
+pytest.importorskip('cv2')
+
+import sampler
+from sampler import AdaptiveSampler
+
+
+class ScalarSampler(AdaptiveSampler):
+    """フレームの代わりに明るさの値 (数値) を渡して、間隔の決め方だけを確かめる。"""
+
+    @staticmethod
+    def signature(frame):
+        return frame
+
+    @staticmethod
+    def difference(a, b):
+        return abs(a - b)
+
+
+@pytest.fixture
+def s():
+    return ScalarSampler(base_interval=2.0, min_interval=0.25, max_interval=4.0, change_threshold=4.0, cpu_budget=None)
+
+
+def test_skips_unchanged_frames(s):
+    assert s.observe(0, now=0.0)
+    assert not s.observe(1, now=1.0)
+    assert s.observe(10, now=2.0)
+    assert (s.analyzed, s.skipped) == (2, 1)
+
+
+def test_force_and_periodic_analysis(s):
+    s.observe(0, now=0.0)
+    assert s.observe(0, now=1.0, force=True)
+    assert not s.observe(0, now=2.0)
+    assert s.observe(0, now=1.0 + sampler.FORCE_ANALYSIS_INTERVAL)
+
+
+def test_burst_after_static_screen_changes(s):
+    s.observe(0, now=0.0)
+    assert s.next_interval() == 2.0
+    s.observe(50, now=2.0)
+    assert [s.next_interval() for _ in range(sampler.BURST_SAMPLES)] == [0.25] * sampler.BURST_SAMPLES
+    assert s.next_interval() == 2.0 * sampler.BACKOFF_FACTOR
+
+
+def test_backoff_while_moving_is_capped(s):
+    s.observe(0, now=0.0)
+    s.observe(10, now=1.0)
+    for _ in range(sampler.BURST_SAMPLES): s.next_interval()
+    intervals = []
+    for i in range(2, 12):
+        s.observe(i * 10, now=float(i))
+        intervals.append(s.next_interval())
+    assert intervals == sorted(intervals)
+    assert intervals[0] == pytest.approx(2.0 * sampler.BACKOFF_FACTOR ** 2)
+    assert intervals[-1] == 4.0
+
+
+def test_burst_when_motion_stops(s):
+    for i, value in enumerate([0, 10, 20]):
+        s.observe(value, now=float(i))
+    for _ in range(sampler.BURST_SAMPLES): s.next_interval()
+    assert s.next_interval() > 2.0
+    s.observe(20, now=3.0)
+    assert s.next_interval() == 0.25
+
+
+def test_hint_overrides_interval(s):
+    s.observe(0, now=0.0)
+    assert s.next_interval(hint=7.0) == 7.0
+
+
+def test_cpu_budget_widens_interval():
+    s = ScalarSampler(base_interval=2.0, cpu_budget=0.25)
+    s.observe(0, now=0.0)
+    s.record_analysis(1.0)
+    assert s.next_interval() == pytest.approx(3.0)  # 1.0 / (1.0 + 3.0) = 0.25
+
+
+def test_reanalyses_once_after_screen_settles(s):
+    s.observe(0, now=0.0)
+    assert s.observe(10, now=1.0)      # 描画途中の画面 (変化の途中) を解析する
+    assert s.observe(12, now=1.25)     # 解析したフレームとの差は小さいが、静止したのでもう1度解析する
+    assert not s.observe(12, now=1.5)  # 再解析は1度だけ
+    assert not s.observe(13, now=1.75)
+
+
+def test_no_settle_reanalysis_for_static_screen(s):
+    assert s.observe(0, now=0.0)
+    assert not s.observe(1, now=1.0)
+    assert not s.observe(2, now=2.0)
@@ -0,0 +1,96 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('cv2')
+
+from session import SessionScheduler
+
+
+class StubSession:
+    """SessionSchedulerから見たMonitorSessionの代わり。stepsステップ処理したら終了する。"""
+
+    def __init__(self, name, steps, log, cost=0.0, tracker=None):
+        self.name = name
+        self.remaining = steps
+        self.log = log
+        self.cost = cost
+        self.tracker = tracker
+        self.realtime = False
+        self.active = True
+        self.finished = 0
+
+    def on_status(self, text):
+        pass
+
+    def step(self):
+        if self.tracker: self.tracker.enter()
+        try:
+            time.sleep(self.cost)
+            self.log.append(self.name)
+        finally:
+            if self.tracker: self.tracker.leave()
+        self.remaining -= 1
+        if self.remaining <= 0:
+            self.active = False
+            return None
+        return 0.5
+
+    def stop(self):
+        self.active = False
+
+    def finish(self):
+        self.finished += 1
+
+
+class ConcurrencyTracker:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.current = 0
+        self.peak = 0
+
+    def enter(self):
+        with self.lock:
+            self.current += 1
+            self.peak = max(self.peak, self.current)
+
+    def leave(self):
+        with self.lock:
+            self.current -= 1
+
+
+def test_scheduler_interleaves_heavy_and_light_sessions():
+    log = []
+    scheduler = SessionScheduler(max_workers=1)
+    heavy = StubSession('heavy', 5, log, cost=0.02)
+    lights = [StubSession(f'light{i}', 5, log) for i in range(2)]
+    try:
+        for s in [heavy] + lights:
+            scheduler.add(s)
+        assert scheduler.join(timeout=10)
+    finally:
+        scheduler.shutdown()
+
+    assert sorted(log) == sorted(['heavy'] * 5 + ['light0'] * 5 + ['light1'] * 5)
+    # ワーカーが1つでも、重いセッションが連続して実行され続けることはなく、順番に実行される
+    assert log[:3].count('heavy') == 1
+    assert all(a != b for a, b in zip(log, log[1:]))
+    assert all(s.finished == 1 for s in [heavy] + lights)
+
+
+def test_scheduler_limits_steps_in_flight():
+    log = []
+    tracker = ConcurrencyTracker()
+    scheduler = SessionScheduler(max_workers=2)
+    sessions = [StubSession(f's{i}', 4, log, cost=0.01, tracker=tracker) for i in range(5)]
+    try:
+        for s in sessions:
+            scheduler.add(s)
+        assert scheduler.join(timeout=10)
+    finally:
+        scheduler.shutdown()
+
+    assert len(log) == 20
+    assert tracker.peak <= 2
+    assert all(s.finished == 1 for s in sessions)